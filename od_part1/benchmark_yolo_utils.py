@@ -0,0 +1,230 @@
+import argparse
+import time
+from collections import Counter
+import torch
+from yolo_utils import (
+    intersection_over_union, box_iou, non_max_suppression, cellboxes_to_boxes, get_bboxes_training, decode_predictions,
+    decode_labels, MeanAveragePrecision
+)
+
+
+# Reference implementations, as they were defined in yolov1.ipynb
+
+def legacy_non_max_suppression(bboxes, iou_threshold, threshold, box_format="corners"):
+    """NMS with one IoU call per box pair."""
+    bboxes = [box for box in bboxes if box[1] > threshold]
+    bboxes = sorted(bboxes, key=lambda x: x[1], reverse=True)
+    bboxes_after_nms = []
+
+    while bboxes:
+        chosen_box = bboxes.pop(0)
+        bboxes = [
+            box
+            for box in bboxes
+            if box[0] != chosen_box[0]
+            or intersection_over_union(torch.tensor(chosen_box[2:]), torch.tensor(box[2:]), box_format=box_format)
+            < iou_threshold
+        ]
+        bboxes_after_nms.append(chosen_box)
+
+    return bboxes_after_nms
+
+
+def legacy_convert_cellboxes(predictions, S=7):
+    predictions = predictions.to("cpu")
+    batch_size = predictions.shape[0]
+    predictions = predictions.reshape(batch_size, 7, 7, 30)
+    bboxes1 = predictions[..., 21:25]
+    bboxes2 = predictions[..., 26:30]
+    scores = torch.cat((predictions[..., 20].unsqueeze(0), predictions[..., 25].unsqueeze(0)), dim=0)
+    best_box = scores.argmax(0).unsqueeze(-1)
+    best_boxes = bboxes1 * (1 - best_box) + best_box * bboxes2
+    cell_indices = torch.arange(7).repeat(batch_size, 7, 1).unsqueeze(-1)
+    x = 1 / S * (best_boxes[..., :1] + cell_indices)
+    y = 1 / S * (best_boxes[..., 1:2] + cell_indices.permute(0, 2, 1, 3))
+    w_y = 1 / S * best_boxes[..., 2:4]
+    converted_bboxes = torch.cat((x, y, w_y), dim=-1)
+    predicted_class = predictions[..., :20].argmax(-1).unsqueeze(-1)
+    best_confidence = torch.max(predictions[..., 20], predictions[..., 25]).unsqueeze(-1)
+    return torch.cat((predicted_class, best_confidence, converted_bboxes), dim=-1)
+
+
+def legacy_cellboxes_to_boxes(out, S=7):
+    """Per-cell conversion to lists."""
+    converted_pred = legacy_convert_cellboxes(out).reshape(out.shape[0], S * S, -1)
+    converted_pred[..., 0] = converted_pred[..., 0].long()
+    all_bboxes = []
+
+    for ex_idx in range(out.shape[0]):
+        bboxes = []
+        for bbox_idx in range(S * S):
+            bboxes.append([x.item() for x in converted_pred[ex_idx, bbox_idx, :]])
+        all_bboxes.append(bboxes)
+
+    return all_bboxes
+
+
+def legacy_get_bboxes_training(outputs, labels, iou_threshold=0.5, threshold=0.4, box_format="midpoint"):
+    all_pred_boxes = []
+    all_true_boxes = []
+    true_bboxes = legacy_cellboxes_to_boxes(labels)
+    bboxes = legacy_cellboxes_to_boxes(outputs)
+
+    for idx in range(outputs.shape[0]):
+        nms_boxes = legacy_non_max_suppression(bboxes[idx], iou_threshold=iou_threshold, threshold=threshold, box_format=box_format)
+        for nms_box in nms_boxes:
+            all_pred_boxes.append([idx] + nms_box)
+        for box in true_bboxes[idx]:
+            if box[1] > threshold:
+                all_true_boxes.append([idx] + box)
+
+    return all_pred_boxes, all_true_boxes
+
+
+def legacy_mean_average_precision(pred_boxes, true_boxes, iou_threshold=0.5, box_format="midpoint", num_classes=20):
+    """mAP with Python loops over classes, detections and ground truths."""
+    average_precisions = []
+    epsilon = 1e-6
+
+    for c in range(num_classes):
+        detections = [detection for detection in pred_boxes if detection[1] == c]
+        ground_truths = [true_box for true_box in true_boxes if true_box[1] == c]
+        amount_bboxes = Counter([gt[0] for gt in ground_truths])
+        for key, val in amount_bboxes.items():
+            amount_bboxes[key] = torch.zeros(val)
+
+        detections.sort(key=lambda x: x[2], reverse=True)
+        TP = torch.zeros((len(detections)))
+        FP = torch.zeros((len(detections)))
+        total_true_bboxes = len(ground_truths)
+        if total_true_bboxes == 0:
+            continue
+
+        for detection_idx, detection in enumerate(detections):
+            ground_truth_img = [bbox for bbox in ground_truths if bbox[0] == detection[0]]
+            best_iou = 0
+            for idx, gt in enumerate(ground_truth_img):
+                iou = intersection_over_union(torch.tensor(detection[3:]), torch.tensor(gt[3:]), box_format=box_format)
+                if iou > best_iou:
+                    best_iou = iou
+                    best_gt_idx = idx
+
+            if best_iou > iou_threshold:
+                if amount_bboxes[detection[0]][best_gt_idx] == 0:
+                    TP[detection_idx] = 1
+                    amount_bboxes[detection[0]][best_gt_idx] = 1
+                else:
+                    FP[detection_idx] = 1
+            else:
+                FP[detection_idx] = 1
+
+        TP_cumsum = torch.cumsum(TP, dim=0)
+        FP_cumsum = torch.cumsum(FP, dim=0)
+        recalls = TP_cumsum / (total_true_bboxes + epsilon)
+        precisions = torch.divide(TP_cumsum, (TP_cumsum + FP_cumsum + epsilon))
+        precisions = torch.cat((torch.tensor([1]), precisions))
+        recalls = torch.cat((torch.tensor([0]), recalls))
+        average_precisions.append(torch.trapz(precisions, recalls))
+
+    return sum(average_precisions) / len(average_precisions)
+
+
+def make_batch(batch_size, S=7, B=2, C=20, objects=3, seed=0):
+    """Random YOLOv1 outputs and labels with a few objects per image."""
+    generator = torch.Generator().manual_seed(seed)
+    outputs = torch.rand(batch_size, S, S, C + 5 * B, generator=generator)
+    outputs[..., C + 3:C + 5] *= 3 # Boxes up to 3 cells wide overlap their neighbours
+    outputs[..., C + 8:C + 10] *= 3
+    labels = torch.zeros(batch_size, S, S, C + 5 * B)
+    for image in range(batch_size):
+        cells = torch.randperm(S * S, generator=generator)[:objects]
+        rows, cols = cells // S, cells % S
+        labels[image, rows, cols, torch.randint(0, C, (objects,), generator=generator)] = 1
+        labels[image, rows, cols, C] = 1
+        labels[image, rows, cols, C + 1:C + 5] = torch.rand(objects, 4, generator=generator)
+
+    # Confident, slightly shifted copies of the labels as the first box, so some detections are right
+    has_object = labels[..., C:C + 1] > 0
+    noisy = labels[..., C:C + 5] + torch.randn(batch_size, S, S, 5, generator=generator) * 0.1
+    outputs[..., C:C + 5] = torch.where(has_object, noisy, outputs[..., C:C + 5] * 0.5)
+    outputs[..., :C] = torch.where(has_object, labels[..., :C] + outputs[..., :C] * 0.5, outputs[..., :C])
+    return outputs.reshape(batch_size, -1), labels
+
+
+def timeit(fn, repeat):
+    """Best wall time of `repeat` calls, in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized YOLOv1 utilities against the notebook loops")
+    parser.add_argument("--batch-size", type=int, default=64, help="Images per batch")
+    parser.add_argument("--threshold", type=float, default=0.4, help="Confidence threshold")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement; the best is reported")
+    args = parser.parse_args()
+
+    outputs, labels = make_batch(args.batch_size)
+    boxes = cellboxes_to_boxes(outputs)
+    legacy = legacy_get_bboxes_training(outputs, labels, threshold=args.threshold)
+    vectorized = get_bboxes_training(outputs, labels, threshold=args.threshold)
+    matches = all(
+        len(a) == len(b) and torch.allclose(torch.tensor(a).reshape(-1, 7), torch.tensor(b).reshape(-1, 7), atol=1e-5)
+        for a, b in zip(legacy, vectorized)
+    )
+    print(f"Batch of {args.batch_size} images, {len(legacy[0])} boxes after NMS, results match: {matches}")
+
+    def accumulate_map():
+        metric = MeanAveragePrecision()
+        metric.update(decode_predictions(outputs, threshold=args.threshold), decode_labels(labels, threshold=args.threshold))
+        return metric.compute()
+
+    legacy_map, streaming_map = float(legacy_mean_average_precision(*legacy)), accumulate_map()["map50"]
+    print(f"mAP@0.5 loops: {legacy_map:.6f}, streaming: {streaming_map:.6f}")
+
+    pairs = torch.rand(10_000, 4), torch.rand(10_000, 4)
+    measurements = [
+        (
+            "IoU (10k pairs)",
+            lambda: [intersection_over_union(a, b) for a, b in zip(*pairs)],
+            lambda: intersection_over_union(*pairs),
+        ),
+        (
+            "IoU matrix (200 x 200)",
+            lambda: [[intersection_over_union(a, b) for b in pairs[1][:200]] for a in pairs[0][:200]],
+            lambda: box_iou(pairs[0][:200], pairs[1][:200]),
+        ),
+        (
+            "Cell decoding",
+            lambda: legacy_cellboxes_to_boxes(outputs),
+            lambda: cellboxes_to_boxes(outputs),
+        ),
+        (
+            "NMS",
+            lambda: [legacy_non_max_suppression(image_boxes, 0.5, args.threshold, "midpoint") for image_boxes in boxes],
+            lambda: [non_max_suppression(image_boxes, 0.5, args.threshold, "midpoint") for image_boxes in boxes],
+        ),
+        (
+            "get_bboxes_training",
+            lambda: legacy_get_bboxes_training(outputs, labels, threshold=args.threshold),
+            lambda: get_bboxes_training(outputs, labels, threshold=args.threshold),
+        ),
+        (
+            "mAP (10 IoU thresholds)",
+            lambda: [legacy_mean_average_precision(*legacy, iou_threshold=t) for t in torch.linspace(0.5, 0.95, 10).tolist()],
+            accumulate_map,
+        ),
+    ]
+    print(f"{'':24} {'loops (ms)':>12} {'vectorized (ms)':>16} {'speedup':>8}")
+    for name, loops, vectorized in measurements:
+        repeat = 1 if name.startswith("IoU matrix") else args.repeat
+        loop_ms, vectorized_ms = timeit(loops, repeat), timeit(vectorized, args.repeat)
+        print(f"{name:24} {loop_ms:12.1f} {vectorized_ms:16.2f} {loop_ms / vectorized_ms:7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import json
+import os
+import shutil
+import uuid
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+
+def parse_annotation(annotation_path, class_mapping, default_class=0):
+    """
+    Parse a VOC-style annotation XML.
+
+    Parameters:
+        annotation_path (str): Path of the XML file; a missing file means no objects.
+        class_mapping (dict): Mapping from class names to integer IDs.
+        default_class (int): ID of class names missing from the mapping.
+
+    Returns:
+        tuple: Boxes (N, 4) as normalized [x_center, y_center, width, height] and class IDs (N,).
+    """
+    if not os.path.exists(annotation_path):
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+    root = ET.parse(annotation_path).getroot()
+    width = float(root.find("size/width").text)
+    height = float(root.find("size/height").text)
+    boxes, labels = [], []
+    for obj in root.findall("object"):
+        box = obj.find("bndbox")
+        xmin, ymin, xmax, ymax = (int(float(box.find(key).text)) for key in ("xmin", "ymin", "xmax", "ymax"))
+        boxes.append([(xmin + xmax) / 2 / width, (ymin + ymax) / 2 / height, (xmax - xmin) / width, (ymax - ymin) / height])
+        labels.append(class_mapping.get(obj.find("name").text, default_class))
+    return np.array(boxes, dtype=np.float32).reshape(-1, 4), np.array(labels, dtype=np.int64)
+
+
+def voc_samples(root, year="2012", image_set="train"):
+    """List the (name, image path, annotation path) of a VOC split downloaded by torchvision's VOCDetection."""
+    voc_dir = os.path.join(root, "VOCdevkit", f"VOC{year}")
+    with open(os.path.join(voc_dir, "ImageSets", "Main", f"{image_set}.txt")) as f:
+        names = [line.strip() for line in f if line.strip()]
+    return [
+        (name, os.path.join(voc_dir, "JPEGImages", f"{name}.jpg"), os.path.join(voc_dir, "Annotations", f"{name}.xml"))
+        for name in names
+    ]
+
+
+def folder_samples(image_dir, annotation_dir):
+    """List the (name, image path, annotation path) of images with annotations of the same name, like the dog/cat dataset."""
+    return [
+        (name, os.path.join(image_dir, name), os.path.join(annotation_dir, os.path.splitext(name)[0] + ".xml"))
+        for name in sorted(os.listdir(image_dir))
+        if os.path.isfile(os.path.join(image_dir, name))
+    ]
+
+
+def pack_dataset(samples, output_dir, size=(448, 448), class_mapping=None, default_class=0, workers=8, overwrite=False):
+    """
+    Decode, resize and pack a dataset once, so training never parses XML or decodes JPEGs again.
+
+    Writes to `output_dir`:
+        images.npy  (N, height, width, 3) uint8 RGB images, resized to `size` (height, width)
+        boxes.npy   (M, 4) float32 normalized [x_center, y_center, width, height] of all objects
+        labels.npy  (M,) int64 class IDs
+        offsets.npy (N + 1,) int64; the objects of image i are boxes[offsets[i]:offsets[i + 1]]
+        meta.json   image names, size and class mapping
+
+    The pack is written to a temporary directory and renamed when complete, so an interrupted
+    run never leaves a partial pack behind. An existing pack is reused unless `overwrite`.
+
+    Returns:
+        str: `output_dir`.
+    """
+    if os.path.exists(os.path.join(output_dir, "meta.json")) and not overwrite:
+        return output_dir
+
+    class_mapping = class_mapping or {}
+    height, width = size
+    with ThreadPoolExecutor(workers) as pool:
+        annotations = list(pool.map(lambda sample: parse_annotation(sample[2], class_mapping, default_class), samples))
+    counts = [len(labels) for _, labels in annotations]
+
+    tmp_dir = f"{output_dir.rstrip(os.sep)}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(tmp_dir)
+    try:
+        images = np.lib.format.open_memmap(
+            os.path.join(tmp_dir, "images.npy"), mode="w+", dtype=np.uint8, shape=(len(samples), height, width, 3)
+        )
+
+        def load(index):
+            image = cv2.imread(samples[index][1])
+            if image is None:
+                raise ValueError(f"Failed to read image: {samples[index][1]}")
+            shrink = image.shape[0] > height or image.shape[1] > width
+            image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA if shrink else cv2.INTER_LINEAR)
+            images[index] = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+        # OpenCV releases the GIL while decoding and resizing, so threads run in parallel
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(load, range(len(samples))))
+        images.flush()
+        del images
+
+        np.save(os.path.join(tmp_dir, "boxes.npy"), np.concatenate([boxes for boxes, _ in annotations] + [np.zeros((0, 4), np.float32)]))
+        np.save(os.path.join(tmp_dir, "labels.npy"), np.concatenate([labels for _, labels in annotations] + [np.zeros(0, np.int64)]))
+        np.save(os.path.join(tmp_dir, "offsets.npy"), np.concatenate(([0], np.cumsum(counts))).astype(np.int64))
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump({"names": [sample[0] for sample in samples], "size": [height, width], "class_mapping": class_mapping}, f)
+
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+        os.replace(tmp_dir, output_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return output_dir
+
+
+class PackedDataset(Dataset):
+    """
+    Read a dataset written by `pack_dataset`.
+
+    Images are memory-mapped (copy-on-write, so they can be handed to transforms that expect
+    writable arrays) and every sample is a view into the pack: nothing is decoded or parsed
+    per access. The memory map is opened lazily, so DataLoader workers each map the file
+    instead of receiving a pickled copy. Select images with `image_names` (looked up in a
+    dictionary, not scanned) and drop images with more than `max_objects` objects.
+    """
+
+    def __init__(self, pack_dir, image_names=None, max_objects=None):
+        self.pack_dir = pack_dir
+        with open(os.path.join(pack_dir, "meta.json")) as f:
+            meta = json.load(f)
+        self.names = meta["names"]
+        self.class_mapping = meta["class_mapping"]
+        self.boxes = np.load(os.path.join(pack_dir, "boxes.npy"))
+        self.labels = np.load(os.path.join(pack_dir, "labels.npy"))
+        self.offsets = np.load(os.path.join(pack_dir, "offsets.npy"))
+        self._images = None
+
+        self.indices = np.arange(len(self.names)) if image_names is None else self.index_of(image_names)
+        if max_objects is not None:
+            counts = np.diff(self.offsets)[self.indices]
+            self.indices = self.indices[counts <= max_objects]
+
+    def index_of(self, image_names):
+        """Return the pack indices of the given image names."""
+        positions = {name: index for index, name in enumerate(self.names)}
+        return np.array([positions[name] for name in image_names], dtype=np.int64)
+
+    @property
+    def images(self):
+        if self._images is None:
+            self._images = np.load(os.path.join(self.pack_dir, "images.npy"), mmap_mode="c")
+        return self._images
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_images"] = None # Workers open their own memory map
+        return state
+
+    def __len__(self):
+        return len(self.indices)
+
+    def sample(self, idx):
+        """Return the image (H, W, 3), boxes (N, 4) and labels (N,) of a sample as views into the pack."""
+        index = self.indices[idx]
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.images[index], self.boxes[start:end], self.labels[start:end]
+
+    def __getitem__(self, idx):
+        return self.sample(idx)
+
+
+class PackedVOCDataset(PackedDataset):
+    """Packed replacement of `CustomVOCDataset` in yolov1.ipynb: returns the image and its S x S x (C + 5B) label matrix."""
+
+    def __init__(self, pack_dir, S=7, B=2, C=20, custom_transforms=None, **kwargs):
+        super().__init__(pack_dir, **kwargs)
+        self.S = S # Grid size S x S
+        self.B = B # Number of bounding boxes
+        self.C = C # Number of classes
+        self.custom_transforms = custom_transforms
+
+    def __getitem__(self, idx):
+        image, boxes, labels = self.sample(idx)
+        if self.custom_transforms:
+            sample = self.custom_transforms(image=image, bboxes=boxes, labels=labels)
+            image, boxes, labels = sample["image"], sample["bboxes"], sample["labels"]
+
+        label_matrix = torch.zeros((self.S, self.S, self.C + 5 * self.B))
+        boxes = torch.as_tensor(np.asarray(boxes, dtype=np.float32)).reshape(-1, 4)
+        labels = torch.as_tensor(np.asarray(labels)).long()
+        image = torch.as_tensor(image, dtype=torch.float32)
+        if len(boxes):
+            # Grid cell (i, j) of each box; only the first box of a cell is kept
+            i = (self.S * boxes[:, 1]).long().clamp(max=self.S - 1)
+            j = (self.S * boxes[:, 0]).long().clamp(max=self.S - 1)
+            _, first = np.unique((i * self.S + j).numpy(), return_index=True)
+            i, j, boxes, labels = i[first], j[first], boxes[first], labels[first]
+
+            label_matrix[i, j, self.C] = 1
+            label_matrix[i, j, self.C + 1:self.C + 5] = torch.stack(
+                (self.S * boxes[:, 0] - j, self.S * boxes[:, 1] - i, boxes[:, 2] * self.S, boxes[:, 3] * self.S), dim=1
+            )
+            label_matrix[i, j, labels] = 1
+        return image, label_matrix
+
+
+class PackedClassificationDataset(PackedDataset):
+    """Packed replacement of `ImageDataset` in classification.ipynb: returns the image and the label of its first object (-1 if none)."""
+
+    def __init__(self, pack_dir, transform=None, image_names=None, max_objects=1):
+        super().__init__(pack_dir, image_names, max_objects)
+        self.transform = transform
+
+    @property
+    def image_files(self):
+        return [self.names[index] for index in self.indices]
+
+    def __getitem__(self, idx):
+        image, _, labels = self.sample(idx)
+        label = int(labels[0]) if len(labels) else -1
+        if self.transform:
+            image = self.transform(image)
+        return image, label
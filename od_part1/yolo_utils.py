@@ -0,0 +1,319 @@
+import numpy as np
+import torch
+import torchvision
+
+
+def to_corners(boxes, box_format="midpoint"):
+    """
+    Convert boxes to corner format.
+
+    Parameters:
+        boxes (tensor): Boxes (..., 4), as [x_center, y_center, width, height] or [x1, y1, x2, y2].
+        box_format (str): Box format, can be "midpoint" or "corners".
+
+    Returns:
+        tensor: Boxes (..., 4) as [x1, y1, x2, y2].
+    """
+    if box_format == "corners":
+        return boxes
+    return torch.cat((boxes[..., :2] - boxes[..., 2:4] / 2, boxes[..., :2] + boxes[..., 2:4] / 2), dim=-1)
+
+
+def intersection_over_union(boxes_preds, boxes_labels, box_format="midpoint"):
+    """
+    Calculate the Intersection over Union (IoU) between bounding boxes, element-wise with broadcasting.
+
+    Parameters:
+        boxes_preds (tensor): Predicted bounding boxes (..., 4)
+        boxes_labels (tensor): Ground truth bounding boxes (..., 4)
+        box_format (str): Box format, can be "midpoint" or "corners".
+
+    Returns:
+        tensor: Intersection over Union scores (..., 1).
+    """
+    box1 = to_corners(boxes_preds, box_format)
+    box2 = to_corners(boxes_labels, box_format)
+
+    # Compute the area of the intersection rectangle, clamp(0) to handle cases where they do not overlap
+    top_left = torch.max(box1[..., :2], box2[..., :2])
+    bottom_right = torch.min(box1[..., 2:4], box2[..., 2:4])
+    intersection = (bottom_right - top_left).clamp(0).prod(-1, keepdim=True)
+
+    box1_area = ((box1[..., 2:3] - box1[..., 0:1]) * (box1[..., 3:4] - box1[..., 1:2])).abs()
+    box2_area = ((box2[..., 2:3] - box2[..., 0:1]) * (box2[..., 3:4] - box2[..., 1:2])).abs()
+    return intersection / (box1_area + box2_area - intersection + 1e-6)
+
+
+def box_iou(boxes1, boxes2, box_format="midpoint"):
+    """
+    Calculate the IoU between every pair of boxes of two sets.
+
+    Parameters:
+        boxes1 (tensor): Bounding boxes (N, 4)
+        boxes2 (tensor): Bounding boxes (M, 4)
+        box_format (str): Box format, can be "midpoint" or "corners".
+
+    Returns:
+        tensor: IoU matrix (N, M).
+    """
+    return intersection_over_union(boxes1[:, None, :], boxes2[None, :, :], box_format)[..., 0]
+
+
+def non_max_suppression(bboxes, iou_threshold, threshold, box_format="corners", image_ids=None):
+    """
+    Perform class-aware Non-Maximum Suppression on bounding boxes in a single vectorized call.
+
+    Parameters:
+        bboxes (list, tensor or ndarray): Boxes (N, 6), each represented as [class_pred, prob_score, x1, y1, x2, y2].
+        iou_threshold (float): IoU threshold above which the less confident box of a class is removed.
+        threshold (float): Threshold to discard predicted bounding boxes (independent of IoU).
+        box_format (str): "midpoint" or "corners" to specify the format of bounding boxes.
+        image_ids (tensor, optional): Image index (N,) of each box; boxes of different images never suppress each other.
+
+    Returns:
+        Boxes after NMS, sorted by image and then by decreasing probability, in the type of `bboxes`.
+        With `image_ids`, the kept indices are returned as well.
+    """
+    is_list = isinstance(bboxes, list)
+    is_numpy = isinstance(bboxes, np.ndarray)
+    boxes = torch.as_tensor(bboxes, dtype=torch.float32).reshape(-1, 6)
+    ids = torch.zeros(len(boxes), dtype=torch.long, device=boxes.device) if image_ids is None else image_ids.long()
+
+    # Filter predicted bounding boxes based on probability threshold
+    candidates = torch.nonzero(boxes[:, 1] > threshold).flatten()
+    scores = boxes[candidates, 1]
+
+    # Offset the groups so classes of different images are separate as well
+    groups = ids[candidates] * (int(boxes[:, 0].max().item()) + 1 if len(boxes) else 1) + boxes[candidates, 0].long()
+
+    # Shift each group to its own region so one NMS call never compares boxes of different groups
+    # (torchvision's batched_nms falls back to a loop over groups for large inputs on CPU)
+    corners = to_corners(boxes[candidates, 2:6], box_format).double() # Offsets would cost float32 precision
+    offsets = groups.double() * (corners.max() - corners.min() + 1 if len(corners) else 0)
+    keep = candidates[torchvision.ops.nms(corners + offsets[:, None], scores.double(), iou_threshold)]
+    keep = keep[torch.sort(ids[keep], stable=True).indices] # Group by image, keeping the score order
+
+    kept = boxes[keep]
+    if is_list:
+        kept = kept.tolist()
+    elif is_numpy:
+        kept = kept.cpu().numpy()
+    return kept if image_ids is None else (kept, keep)
+
+
+def convert_cellboxes(predictions, S=7, B=2, C=20):
+    """
+    Convert output boxes from YOLO with grid size S to image scale, for a whole batch at once.
+
+    Parameters:
+        predictions (tensor): Model outputs or labels (BATCH_SIZE, S * S * (C + 5 * B)).
+        S (int): Grid size.
+        B (int): Number of boxes per cell.
+        C (int): Number of classes.
+
+    Returns:
+        tensor: (BATCH_SIZE, S, S, 6) as [class_pred, best_confidence, x_center, y_center, width, height],
+                keeping the box of each cell with the highest confidence.
+    """
+    predictions = predictions.reshape(-1, S, S, C + 5 * B)
+    cells = predictions[..., C:].reshape(*predictions.shape[:3], B, 5) # [confidence, x, y, w, h] per box
+    best_confidence, best_box = cells[..., 0].max(-1)
+    best_boxes = torch.gather(cells[..., 1:], 3, best_box[..., None, None].expand(-1, -1, -1, 1, 4))[..., 0, :]
+
+    # Cell offsets: x along the columns, y along the rows
+    cell_indices = torch.arange(S, device=predictions.device, dtype=predictions.dtype)
+    x = (best_boxes[..., 0] + cell_indices[None, None, :]) / S
+    y = (best_boxes[..., 1] + cell_indices[None, :, None]) / S
+    predicted_class = predictions[..., :C].argmax(-1).to(predictions.dtype)
+    return torch.stack((predicted_class, best_confidence, x, y, best_boxes[..., 2] / S, best_boxes[..., 3] / S), dim=-1)
+
+
+def cellboxes_to_boxes(out, S=7, B=2, C=20):
+    """Convert cell-based boxes to a list of [class_pred, prob_score, x, y, w, h] boxes for each example in the batch."""
+    return convert_cellboxes(out, S, B, C).reshape(out.shape[0], S * S, -1).tolist()
+
+
+def decode_predictions(outputs, iou_threshold=0.5, threshold=0.4, box_format="midpoint", S=7, B=2, C=20):
+    """
+    Decode and apply NMS to the outputs of a whole batch, without Python loops over cells or boxes.
+
+    Returns:
+        tensor: (N, 7) boxes as [batch_idx, class_pred, prob_score, x, y, w, h].
+    """
+    boxes = convert_cellboxes(outputs, S, B, C).reshape(-1, 6)
+    image_ids = torch.arange(outputs.shape[0], device=outputs.device).repeat_interleave(S * S)
+    kept, keep = non_max_suppression(boxes, iou_threshold, threshold, box_format, image_ids)
+    return torch.cat((image_ids[keep, None].to(kept.dtype), kept), dim=1)
+
+
+def decode_labels(labels, threshold=0.4, S=7, B=2, C=20):
+    """
+    Decode the target boxes of a whole batch.
+
+    Returns:
+        tensor: (N, 7) boxes as [batch_idx, class_pred, prob_score, x, y, w, h].
+    """
+    boxes = convert_cellboxes(labels, S, B, C).reshape(-1, 6)
+    image_ids = torch.arange(labels.shape[0], device=labels.device).repeat_interleave(S * S)
+    keep = boxes[:, 1] > threshold
+    return torch.cat((image_ids[keep, None].to(boxes.dtype), boxes[keep]), dim=1)
+
+
+def get_bboxes_training(outputs, labels, iou_threshold=0.5, threshold=0.4, box_format="midpoint", S=7, B=2, C=20):
+    """
+    Get predicted (after NMS) and true bounding boxes of a batch as [train_idx, class_pred, prob_score, x, y, w, h] lists.
+    """
+    pred_boxes = decode_predictions(outputs, iou_threshold, threshold, box_format, S, B, C)
+    true_boxes = decode_labels(labels, threshold, S, B, C)
+    return pred_boxes.tolist(), true_boxes.tolist()
+
+
+def get_bboxes(loader, model, iou_threshold, threshold, pred_format="cells", box_format="midpoint", device="cuda"):
+    """Get predicted and true bounding boxes of a whole data loader from the model's outputs."""
+    all_pred_boxes = []
+    all_true_boxes = []
+
+    # Ensure the model is in evaluation mode before obtaining bounding boxes
+    model.eval()
+    train_idx = 0
+
+    for x, labels in loader:
+        x = x.to(device)
+        labels = labels.to(device)
+
+        with torch.no_grad():
+            predictions = model(x)
+
+        pred_boxes = decode_predictions(predictions, iou_threshold, threshold, box_format)
+        true_boxes = decode_labels(labels, threshold)
+
+        # Number the images across batches
+        pred_boxes[:, 0] += train_idx
+        true_boxes[:, 0] += train_idx
+        all_pred_boxes += pred_boxes.tolist()
+        all_true_boxes += true_boxes.tolist()
+        train_idx += x.shape[0]
+
+    model.train()
+    return all_pred_boxes, all_true_boxes
+
+
+def _to_numpy(boxes, columns):
+    """Convert a list, tensor or ndarray of boxes to a float32 ndarray (N, columns)."""
+    if isinstance(boxes, torch.Tensor):
+        boxes = boxes.detach().cpu().numpy()
+    return np.asarray(boxes, dtype=np.float32).reshape(-1, columns)
+
+
+class MeanAveragePrecision:
+    """
+    Dataset-level mean average precision, accumulated batch by batch.
+
+    `update` matches the detections of a batch to its ground truths right away, like
+    `mean_average_precision` does (a detection is a true positive when its best-IoU ground
+    truth of the same image and class is above the threshold and not already taken by a
+    more confident detection), so only each class' scores and true-positive flags are kept.
+    `compute` sorts them once and integrates precision over recall for every IoU threshold.
+    With `max_detections`, each class keeps only its most confident detections, which
+    bounds memory; dropping the low-score end of a class' curve can only lower its AP.
+    """
+
+    def __init__(self, num_classes=20, iou_thresholds=np.linspace(0.5, 0.95, 10), box_format="midpoint", max_detections=None):
+        self.num_classes = num_classes
+        self.iou_thresholds = np.asarray(iou_thresholds, dtype=np.float32)
+        self.box_format = box_format
+        self.max_detections = max_detections
+        self.reset()
+
+    def reset(self):
+        self.num_true = np.zeros(self.num_classes, dtype=np.int64)
+        self.scores = [[] for _ in range(self.num_classes)]
+        self.true_positives = [[] for _ in range(self.num_classes)]
+        self.sizes = np.zeros(self.num_classes, dtype=np.int64)
+
+    def update(self, pred_boxes, true_boxes):
+        """
+        Add the detections and ground truths of a batch.
+
+        Parameters:
+            pred_boxes: Predicted boxes (N, 7) as [image_idx, class_pred, prob_score, *box] in `box_format`, after NMS.
+            true_boxes: Ground truth boxes (M, 7) in the same format, for the same images.
+        """
+        preds = _to_numpy(pred_boxes, 7)
+        truths = _to_numpy(true_boxes, 7)
+        self.num_true += np.bincount(truths[:, 1].astype(np.int64), minlength=self.num_classes)[:self.num_classes]
+        if not len(preds):
+            return
+
+        # Most confident first, so the first match of a ground truth is the true positive
+        preds = preds[np.argsort(-preds[:, 2], kind="stable")]
+        true_positives = np.zeros((len(preds), len(self.iou_thresholds)), dtype=bool)
+        if len(truths):
+            iou = box_iou(torch.from_numpy(preds[:, 3:7]), torch.from_numpy(truths[:, 3:7]), self.box_format).numpy()
+            same = (preds[:, None, 0] == truths[None, :, 0]) & (preds[:, None, 1] == truths[None, :, 1])
+            iou = np.where(same, iou, -1)
+            best_truth = iou.argmax(1)
+            best_iou = iou[np.arange(len(preds)), best_truth]
+            for t, threshold in enumerate(self.iou_thresholds):
+                candidates = np.flatnonzero(best_iou > threshold)
+                _, first = np.unique(best_truth[candidates], return_index=True)
+                true_positives[candidates[first], t] = True
+
+        classes = preds[:, 1].astype(np.int64)
+        for c in np.unique(classes):
+            mask = classes == c
+            self.scores[c].append(preds[mask, 2])
+            self.true_positives[c].append(true_positives[mask])
+            self.sizes[c] += mask.sum()
+            if self.max_detections is not None and self.sizes[c] > 2 * self.max_detections:
+                self._compact(c)
+
+    def _sorted(self, c):
+        """Return the scores and true-positive flags of a class, most confident first."""
+        if not self.scores[c]:
+            return np.zeros(0, dtype=np.float32), np.zeros((0, len(self.iou_thresholds)), dtype=bool)
+        scores = np.concatenate(self.scores[c])
+        true_positives = np.concatenate(self.true_positives[c])
+        order = np.argsort(-scores, kind="stable")
+        return scores[order], true_positives[order]
+
+    def _compact(self, c):
+        """Keep only the `max_detections` most confident detections of a class."""
+        scores, true_positives = self._sorted(c)
+        self.scores[c] = [scores[:self.max_detections]]
+        self.true_positives[c] = [true_positives[:self.max_detections]]
+        self.sizes[c] = len(self.scores[c][0])
+
+    def compute(self):
+        """
+        Compute the average precisions of the classes with ground truths.
+
+        Returns:
+            dict: "map" (mean over the IoU thresholds, mAP@[.5:.95] by default), "map50" (at the
+                  first threshold), "map_per_threshold" and "ap_per_class" (at the first threshold).
+        """
+        epsilon = 1e-6
+        average_precisions = {}
+        for c in np.flatnonzero(self.num_true):
+            _, true_positives = self._sorted(c)
+            tp_cumsum = np.cumsum(true_positives, axis=0)
+            fp_cumsum = np.cumsum(~true_positives, axis=0)
+            recalls = tp_cumsum / (self.num_true[c] + epsilon)
+            precisions = tp_cumsum / (tp_cumsum + fp_cumsum + epsilon)
+
+            # Trapezoidal integration from (recall 0, precision 1), for all thresholds at once
+            ones = np.ones((1, len(self.iou_thresholds)))
+            recalls = np.concatenate((ones * 0, recalls))
+            precisions = np.concatenate((ones, precisions))
+            average_precisions[int(c)] = ((recalls[1:] - recalls[:-1]) * (precisions[1:] + precisions[:-1]) / 2).sum(0)
+
+        if not average_precisions:
+            per_threshold = np.zeros(len(self.iou_thresholds))
+        else:
+            per_threshold = np.mean(list(average_precisions.values()), axis=0)
+        return {
+            "map": float(per_threshold.mean()),
+            "map50": float(per_threshold[0]),
+            "map_per_threshold": {round(float(t), 2): float(ap) for t, ap in zip(self.iou_thresholds, per_threshold)},
+            "ap_per_class": {c: float(ap[0]) for c, ap in average_precisions.items()},
+        }
@@ -0,0 +1,243 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import cv2
+import numpy as np
+import torch
+from ultralytics import YOLO
+from ultralytics.data.augment import LetterBox
+from ultralytics.utils.metrics import box_iou
+from src.utils import setup_logger, open_capture
+
+
+BACKENDS = ("torch", "onnx", "openvino")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def artifact_path(model_path, backend, int8=False, imgsz=640, tag=None):
+    """Path of the exported model cached next to the weights."""
+    stem = os.path.splitext(model_path)[0]
+    name = f"{stem}_{imgsz}" + ("_int8" if int8 else "") + (f"_{tag}" if tag else "")
+    return f"{name}.onnx" if backend == "onnx" else f"{name}_openvino_model"
+
+
+def classes_tag(classes):
+    """Short tag of a list of class prompts, to cache open-vocabulary exports per vocabulary."""
+    return hashlib.sha256("\0".join(classes).encode()).hexdigest()[:12]
+
+
+def sample_frames(source, count=300):
+    """Read up to `count` frames spread evenly over a video, an image, an image directory, a glob or a .txt list of images."""
+    if source.endswith(".txt"):
+        with open(source) as f:
+            paths = [line.strip() for line in f if line.strip()]
+    elif os.path.isdir(source) or glob.has_magic(source) or source.lower().endswith(IMAGE_EXTENSIONS):
+        pattern = os.path.join(source, "*") if os.path.isdir(source) else source
+        paths = sorted(path for path in glob.glob(pattern) if path.lower().endswith(IMAGE_EXTENSIONS))
+    else:
+        paths = None
+    if paths is not None:
+        step = max(1, len(paths) // count)
+        frames = [cv2.imread(path) for path in paths[::step][:count]]
+        return [frame for frame in frames if frame is not None]
+
+    cap = open_capture(source)
+    try:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        step = max(1, total_frames // count) # Streams report no frame count and are read from the start
+        frames = []
+        index = 0
+        while len(frames) < count:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if index % step == 0:
+                frames.append(frame)
+            index += 1
+        return frames
+    finally:
+        cap.release()
+
+
+def write_calibration_dataset(frames, directory, names):
+    """Write frames as an unlabeled dataset that the Ultralytics exporter can calibrate INT8 models on."""
+    image_dir = os.path.join(directory, "images")
+    os.makedirs(image_dir, exist_ok=True)
+    for i, frame in enumerate(frames):
+        cv2.imwrite(os.path.join(image_dir, f"{i:06d}.jpg"), frame)
+    data_path = os.path.join(directory, "calibration.yaml")
+    with open(data_path, "w") as f:
+        json.dump({"path": directory, "train": "images", "val": "images", "names": dict(names)}, f) # JSON is valid YAML
+    return data_path
+
+
+def quantize_onnx(onnx_path, output_path, frames, imgsz=640):
+    """Statically quantize an ONNX model to INT8, calibrating activations on the frames."""
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    letterbox = LetterBox((imgsz, imgsz), auto=False)
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self.frames = iter(frames)
+
+        def get_next(self):
+            frame = next(self.frames, None)
+            if frame is None:
+                return None
+            image = letterbox(image=frame)[..., ::-1].transpose(2, 0, 1) # BGR HWC to RGB CHW
+            return {"images": np.ascontiguousarray(image[None], dtype=np.float32) / 255}
+
+    # Only convolutions and matmuls are quantized; the box decoding stays in float
+    quantize_static(
+        onnx_path,
+        output_path,
+        FrameReader(),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        op_types_to_quantize=["Conv", "MatMul"],
+    )
+
+    # Keep the class names and stride the exporter stored, which YOLO reads back when loading
+    import onnx
+
+    quantized = onnx.load(output_path)
+    quantized.metadata_props.extend(onnx.load(onnx_path, load_external_data=False).metadata_props)
+    onnx.save(quantized, output_path)
+
+
+def match_boxes(baseline, candidate, iou_threshold=0.5):
+    """Match the boxes of two results one-to-one by class and IoU; return the IoU of each match."""
+    if not len(baseline.boxes) or not len(candidate.boxes):
+        return torch.zeros(0)
+    iou = box_iou(baseline.boxes.xyxy.cpu(), candidate.boxes.xyxy.cpu())
+    iou[baseline.boxes.cls.cpu()[:, None] != candidate.boxes.cls.cpu()[None, :]] = 0
+    pairs = torch.nonzero(iou >= iou_threshold)
+    if not len(pairs):
+        return torch.zeros(0)
+
+    # Highest IoU first, then keep the first match of every box
+    pairs = pairs[iou[pairs[:, 0], pairs[:, 1]].argsort(descending=True)].numpy()
+    pairs = pairs[np.unique(pairs[:, 1], return_index=True)[1]]
+    pairs = pairs[np.unique(pairs[:, 0], return_index=True)[1]]
+    return iou[pairs[:, 0], pairs[:, 1]]
+
+
+def compare_models(baseline, candidate, frames, batch_size=8, **predict_args):
+    """Compare the detections and speed of a model against the PyTorch baseline on the frames."""
+    timings = []
+    outputs = []
+    for model in (baseline, candidate):
+        model.predict(frames[:1], verbose=False, **predict_args) # Warm up
+        start = time.perf_counter()
+        results = []
+        for i in range(0, len(frames), batch_size):
+            results += model.predict(frames[i:i + batch_size], verbose=False, **predict_args)
+        timings.append((time.perf_counter() - start) / len(frames) * 1000)
+        outputs.append(results)
+
+    baseline_boxes = sum(len(result.boxes) for result in outputs[0])
+    candidate_boxes = sum(len(result.boxes) for result in outputs[1])
+    matches = [match_boxes(b, c) for b, c in zip(*outputs)]
+    ious = torch.cat(matches)
+    return {
+        "frames": len(frames),
+        "baseline_boxes": baseline_boxes,
+        "boxes": candidate_boxes,
+        "precision": round(len(ious) / candidate_boxes, 4) if candidate_boxes else 1.0,
+        "recall": round(len(ious) / baseline_boxes, 4) if baseline_boxes else 1.0,
+        "mean_iou": round(float(ious.mean()), 4) if len(ious) else None,
+        "baseline_ms_per_frame": round(timings[0], 2),
+        "ms_per_frame": round(timings[1], 2),
+        "speedup": round(timings[0] / timings[1], 2),
+    }
+
+
+def export_backend(
+    model_path, backend, int8=False, calibration=None, calibration_frames=300, imgsz=640, model=None, tag=None
+):
+    """
+    Export a model to ONNX or OpenVINO once and return the path of the cached artifact.
+
+    Artifacts are cached next to the weights, keyed by backend, input size, INT8 and `tag`
+    (e.g. the vocabulary of an open-vocabulary model). INT8 models are statically quantized
+    with frames sampled from `calibration` (a video, image directory or glob). When a
+    calibration source is given, the export is compared against the PyTorch model on other
+    frames of it, and the accuracy and speed deltas are logged and saved as
+    `<artifact>.accuracy.json`. Pass `model` to export an already configured model.
+    """
+    logger = setup_logger()
+    if backend == "torch":
+        return model_path
+    if backend not in BACKENDS:
+        raise ValueError(f"Unsupported backend: {backend}")
+    if int8 and calibration is None:
+        raise ValueError("INT8 quantization needs calibration frames")
+
+    target = artifact_path(model_path, backend, int8, imgsz, tag)
+    if os.path.exists(target):
+        logger.info(f"Using cached {backend} model: {target}")
+        return target
+
+    model = model or YOLO(model_path)
+    frames = sample_frames(calibration, 2 * calibration_frames) if calibration is not None else []
+    calibration_set, evaluation_set = frames[0::2], frames[1::2][:100] # Evaluate on frames not used for calibration
+    if int8 and not calibration_set:
+        raise ValueError(f"No calibration frames could be read from: {calibration}")
+
+    logger.info(f"Exporting {model_path} to {backend}" + (f" with INT8 calibration on {len(calibration_set)} frames" if int8 else ""))
+    work_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(model_path)), prefix=".export_")
+    pt_path = getattr(model.model, "pt_path", None)
+    try:
+        # The exporter writes next to `pt_path`; export into the work directory, then move the result
+        model.model.pt_path = os.path.join(work_dir, os.path.basename(model_path))
+        if backend == "onnx":
+            exported = model.export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+            if int8:
+                quantize_onnx(exported, f"{exported}.int8", calibration_set, imgsz)
+                exported = f"{exported}.int8"
+        else:
+            data = write_calibration_dataset(calibration_set, os.path.join(work_dir, "calibration"), model.names) if int8 else None
+            exported = model.export(format="openvino", imgsz=imgsz, dynamic=True, int8=int8, data=data)
+        os.replace(str(exported).rstrip(os.sep), target)
+    finally:
+        model.model.pt_path = pt_path
+        shutil.rmtree(work_dir, ignore_errors=True)
+    logger.info(f"Exported {backend} model: {target}")
+
+    if evaluation_set:
+        report = {"backend": backend, "int8": int8, **compare_models(model, YOLO(target, task=model.task), evaluation_set)}
+        with open(f"{target}.accuracy.json", "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(
+            f"{backend}{' INT8' if int8 else ''} vs PyTorch on {report['frames']} frames: "
+            f"precision={report['precision']}, recall={report['recall']}, mean IoU={report['mean_iou']}, "
+            f"{report['ms_per_frame']} ms/frame vs {report['baseline_ms_per_frame']} ms/frame ({report['speedup']}x)"
+        )
+    return target
+
+
+def add_backend_arguments(parser):
+    """Add the inference backend command line flags shared by the scripts."""
+    parser.add_argument("--backend", type=str, default="torch", choices=BACKENDS, help="Inference runtime; exports are cached next to the weights")
+    parser.add_argument("--int8", action="store_true", help="Quantize the exported model to INT8")
+    parser.add_argument("--calibration", type=str, default=None, help="Video, image directory or glob of calibration frames (default: the input)")
+    parser.add_argument("--calibration-frames", type=int, default=300, help="Number of frames to calibrate INT8 models on")
+
+
+def model_from_args(args, default_calibration=None, model=None, tag=None):
+    """Return the model path to load for the selected backend, exporting the model on first use."""
+    if args.backend == "torch":
+        if args.int8:
+            setup_logger().warning("--int8 requires --backend onnx or openvino; running the PyTorch model")
+        return args.model_path
+    return export_backend(
+        args.model_path, args.backend, args.int8, args.calibration or default_calibration, args.calibration_frames,
+        model=model, tag=tag
+    )
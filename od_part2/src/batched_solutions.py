@@ -0,0 +1,322 @@
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+import numpy as np
+from ultralytics import solutions
+from ultralytics.solutions import solutions as base_solutions
+from ultralytics.utils.plotting import Annotator, colors
+from src.roi import crop_frames, uncrop_result
+from src.regions import RegionCounter, points_in_polygons
+from src.speed import SpeedEngine
+from src.tracking import load_tracker, restore_tracker, tracker_state, update_tracks
+
+
+_reuse_lock = threading.Lock()
+
+
+@contextmanager
+def reuse_model(model):
+    """
+    Make solutions created inside the block, in this thread, use an already loaded model instead of loading their own.
+
+    `BaseSolution.__init__` loads its model inline, so its loader is replaced for the duration
+    of the block only. Blocks are serialized, and solutions created by other threads meanwhile
+    still load their own model.
+    """
+    with _reuse_lock:
+        load_model = base_solutions.YOLO
+        owner = threading.get_ident()
+        base_solutions.YOLO = lambda *args, **kwargs: model if threading.get_ident() == owner else load_model(*args, **kwargs)
+        try:
+            yield
+        finally:
+            base_solutions.YOLO = load_model
+
+
+class BatchTrackingMixin:
+    """
+    Track a whole batch of frames in one model call, then run the solution's per-frame logic.
+
+    `extract_tracks` normally calls `model.track` on a single frame. While a batch is being
+    processed it instead reads the result that was already computed for the current frame.
+    Pass `shared_model` to reuse a loaded YOLO model across several solutions. Set `metrics`
+    to record detection and tracking times, and per-frame solution logic ("region") and drawing
+    ("plot") times, and `roi` (x1, y1, x2, y2)
+    to detect only inside that part of the frame. `frame_rate` is the frame rate of the video,
+    which scales how long the tracker keeps lost tracks.
+
+    Each solution owns its tracker, so solutions sharing a model keep separate tracks, and
+    `state()` can checkpoint the tracks with the rest of the solution.
+    """
+
+    _batch_result = None
+    metrics = None
+    roi = None
+    tracker = None
+
+    def __init__(self, shared_model=None, frame_rate=30, **kwargs):
+        self.frame_rate = frame_rate
+        if shared_model is None:
+            super().__init__(**kwargs)
+            return
+
+        with reuse_model(shared_model):
+            super().__init__(**kwargs)
+
+    def predict_args(self):
+        """Arguments of `model.predict` that detect like `model.track` would for this solution."""
+        predict_args = {k: v for k, v in self.track_add_args.items() if k != "tracker"}
+        predict_args["conf"] = predict_args["conf"] or 0.1 # The default of `model.track`
+        return {"classes": self.CFG["classes"], **predict_args}
+
+    def track_batch(self, batch_frames):
+        """Run detection and tracking on all frames of the batch in one forward pass."""
+        if self.tracker is None:
+            self.tracker = load_tracker(self.CFG["tracker"], self.frame_rate)
+
+        # With an ROI, track on the crops and map the boxes back to full-frame coordinates
+        source = batch_frames if self.roi is None else crop_frames(batch_frames, self.roi)
+        results = self.model.predict(source, **self.predict_args())
+        results = [update_tracks(self.tracker, result) for result in results]
+        if self.roi is None:
+            return results
+        return [uncrop_result(result, frame, self.roi) for result, frame in zip(results, batch_frames)]
+
+    def state(self):
+        """Return the tracks and drawn track history, to checkpoint a run."""
+        return {
+            "tracker": tracker_state(self.tracker) if self.tracker is not None else None,
+            "track_history": self.track_history,
+        }
+
+    def load_state(self, state):
+        """Continue from a `state` snapshot."""
+        if state["tracker"] is not None:
+            self.tracker = restore_tracker(state["tracker"])
+        self.track_history = state["track_history"]
+
+    def extract_tracks(self, im0):
+        """Extract tracks from the precomputed batch result, or track the frame if there is none."""
+        if self._batch_result is None:
+            return super().extract_tracks(im0)
+
+        self.tracks = [self._batch_result]
+        self.track_data = self._batch_result.obb or self._batch_result.boxes
+        if self.track_data and self.track_data.id is not None:
+            self.boxes = self.track_data.xyxy.cpu()
+            self.clss = self.track_data.cls.cpu().tolist()
+            self.track_ids = self.track_data.id.int().cpu().tolist()
+        else:
+            self.boxes, self.clss, self.track_ids = [], [], []
+
+    def timed(self, stage):
+        """Time the enclosed block as `stage` when metrics are recorded."""
+        return self.metrics.time(stage) if self.metrics is not None else nullcontext()
+
+    def process_result(self, frame, result, process_frame):
+        """Apply `process_frame` to a frame whose tracks were already computed."""
+        self._batch_result = result
+        try:
+            return process_frame(frame)
+        finally:
+            self._batch_result = None
+
+    def process_batch(self, batch_frames, process_frame, on_result=None):
+        """
+        Track the batch once, then apply `process_frame` to each frame in order.
+
+        `on_result(frame_idx, result)` is called after each frame, once the solution state is updated.
+        """
+        start = time.perf_counter()
+        results = self.track_batch(batch_frames)
+        if self.metrics is not None:
+            self.metrics.observe_results(results, time.perf_counter() - start)
+
+        processed_frames = []
+        for frame_idx, (frame, result) in enumerate(zip(batch_frames, results)):
+            processed_frames.append(self.process_result(frame, result, process_frame))
+            if on_result is not None:
+                on_result(frame_idx, result)
+        return processed_frames
+
+
+class BatchedObjectCounter(BatchTrackingMixin, solutions.ObjectCounter):
+    """
+    Object counter that runs detection and tracking once per batch.
+
+    Counts any number of named polygons and lines (`regions`, a mapping of names to points)
+    with a vectorized `RegionCounter`; without it, the single `region` is counted. `in_count`,
+    `out_count` and `classwise_counts` are totals over all regions, and per-region tallies
+    are in `region_counts()`. Objects counted in the last frame are listed in `crossings`.
+    With `draw=False` the frame is left untouched, which skips all annotation work.
+    """
+
+    def __init__(self, draw=True, regions=None, **kwargs):
+        super().__init__(**kwargs)
+        self.draw = draw
+        self.regions = regions
+        self.engine = None
+        self.crossings = []
+
+    def region_counts(self):
+        """Return the IN and OUT totals of every region by name."""
+        return self.engine.region_counts() if self.engine is not None else {}
+
+    def state(self):
+        return {**super().state(), "regions": self.regions, "engine": self.engine}
+
+    def load_state(self, state):
+        super().load_state(state)
+        if state["engine"] is not None:
+            self.initialize_region()
+            self.region_initialized = True
+            self.regions = state["regions"]
+            self.engine = state["engine"]
+            self.update_totals() # Report the restored tallies before the next frame is counted
+
+    def count(self, im0):
+        """Update object counts for a frame, annotating it only when drawing is enabled."""
+        with self.timed("region"):
+            self.update_counts(im0)
+        if self.draw:
+            with self.timed("plot"):
+                self.annotate(im0)
+        return im0
+
+    def update_counts(self, im0):
+        """Count the tracks of the frame that entered or crossed a region."""
+        self.crossings = []
+        if not self.region_initialized:
+            self.initialize_region()
+            self.region_initialized = True
+            self.regions = self.regions or {"region": self.region}
+            self.engine = RegionCounter(self.regions, len(self.names))
+
+        self.extract_tracks(im0)
+        for track_index, region_index, direction in self.engine.update(self.boxes, self.track_ids, self.clss):
+            box, track_id, cls = self.boxes[track_index], self.track_ids[track_index], self.clss[track_index]
+            self.crossings.append({
+                "track_id": track_id,
+                "cls": int(cls),
+                "region": self.engine.names[region_index],
+                "direction": "IN" if direction == 0 else "OUT",
+                "centroid": [float(box[0] + box[2]) / 2, float(box[1] + box[3]) / 2],
+            })
+
+        self.update_totals()
+
+    def update_totals(self):
+        """Set `in_count`, `out_count` and `classwise_counts` from the tallies of all regions."""
+        totals = self.engine.counts.sum(axis=0)
+        self.in_count, self.out_count = int(totals[0].sum()), int(totals[1].sum())
+        self.classwise_counts = {
+            self.names[cls]: {"IN": int(totals[0, cls]), "OUT": int(totals[1, cls])}
+            for cls in np.flatnonzero(totals.sum(axis=0))
+        }
+
+    def annotate(self, im0):
+        """Draw the regions, tracks and counts on the frame."""
+        self.annotator = Annotator(im0, line_width=self.line_width)
+        for points in self.regions.values():
+            self.annotator.draw_region(reg_pts=[tuple(p) for p in points], color=(104, 0, 123), thickness=self.line_width * 2)
+        for box, track_id, cls in zip(self.boxes, self.track_ids, self.clss):
+            self.annotator.box_label(box, label=self.names[cls], color=colors(cls, True))
+            self.store_tracking_history(track_id, box)
+            self.annotator.draw_centroid_and_tracks(self.track_line, color=colors(int(cls), True), track_thickness=self.line_width)
+
+        # Per-region totals when there are several regions, per-class totals otherwise
+        if len(self.regions) > 1:
+            labels = {name: f"IN {value['IN']} OUT {value['OUT']}" for name, value in self.region_counts().items()}
+            if labels:
+                self.annotator.display_analytics(im0, labels, (104, 31, 17), (255, 255, 255), 10)
+        else:
+            self.display_counts(im0)
+        self.display_output(im0)
+
+    def count_batch(self, batch_frames, on_result=None):
+        """Count objects in a batch of frames and return the annotated frames."""
+        return self.process_batch(batch_frames, self.count, on_result)
+
+
+class BatchedSpeedEstimator(BatchTrackingMixin, solutions.SpeedEstimator):
+    """
+    Speed estimator that runs detection and tracking once per batch.
+
+    Frames of a batch are processed back to back, so wall-clock time between them says
+    nothing about the video. Speeds are computed from frame timestamps (`frame index / fps`)
+    instead, for all tracks at once by a `SpeedEngine` (see it for `homography`, `window`,
+    `min_samples` and `pixel_scale`). `spd` holds the current speed of the tracks of the last
+    frame. A track's speed is reported once, in `new_speeds`, when it is inside the speed
+    region and has enough positions for an estimate. Speeds are in `engine.unit`: km/h with
+    a homography, source pixels per second without one. With `draw=False` the frame is left
+    untouched.
+    """
+
+    def __init__(self, fps=30, draw=True, pixel_scale=(1.0, 1.0), homography=None, window=15, min_samples=5, **kwargs):
+        super().__init__(frame_rate=fps, **kwargs)
+        self.fps = fps
+        self.draw = draw
+        self.frame_index = 0
+        self.new_speeds = []
+        self.engine = SpeedEngine(homography, window, min_samples, pixel_scale=pixel_scale)
+        region = np.asarray(self.region, dtype=np.float64)
+        self.region_edges = (region[None], np.roll(region, -1, axis=0)[None])
+
+    def estimate_speed(self, im0):
+        """Estimate the speed of all tracks at the frame timestamp, annotating the frame only when drawing is enabled."""
+        with self.timed("region"):
+            self.update_speeds(im0)
+        if self.draw:
+            with self.timed("plot"):
+                self.annotate(im0)
+        return im0
+
+    def update_speeds(self, im0):
+        """Update the speeds of the tracks of the frame and report new estimates in the speed region."""
+        timestamp = self.frame_index / self.fps
+        self.frame_index += 1
+        self.new_speeds = []
+
+        self.extract_tracks(im0)
+        boxes = np.asarray(self.boxes, dtype=np.float64).reshape(-1, 4)
+        speeds, rows = self.engine.update(self.track_ids, boxes, timestamp)
+        estimated = ~np.isnan(speeds)
+        self.spd = {track_id: float(speed) for track_id, speed, ok in zip(self.track_ids, speeds, estimated) if ok}
+
+        # Report each track once, the first time it is in the speed region with an estimate
+        centroids = (boxes[:, :2] + boxes[:, 2:]) / 2
+        in_region = points_in_polygons(centroids, *self.region_edges)[:, 0]
+        for i in np.flatnonzero(in_region & estimated & ~self.engine.reported[rows]).tolist():
+            self.engine.reported[rows[i]] = True
+            self.new_speeds.append({
+                "track_id": self.track_ids[i],
+                "cls": int(self.clss[i]),
+                "speed": float(speeds[i]),
+                "unit": self.engine.unit,
+                "box": [float(v) for v in boxes[i]],
+            })
+
+    def annotate(self, im0):
+        """Draw the speed region, tracks and speeds on the frame."""
+        self.annotator = Annotator(im0, line_width=self.line_width)
+        self.annotator.draw_region(reg_pts=self.region, color=(104, 0, 123), thickness=self.line_width * 2)
+        for box, track_id, cls in zip(self.boxes, self.track_ids, self.clss):
+            self.store_tracking_history(track_id, box)
+            speed_label = f"{int(self.spd[track_id])} {self.engine.unit}" if track_id in self.spd else self.names[int(cls)]
+            self.annotator.box_label(box, label=speed_label, color=colors(track_id, True))
+            self.annotator.draw_centroid_and_tracks(
+                self.track_line, color=colors(int(track_id), True), track_thickness=self.line_width
+            )
+        self.display_output(im0)
+
+    def state(self):
+        return {**super().state(), "frame_index": self.frame_index, "engine": self.engine}
+
+    def load_state(self, state):
+        super().load_state(state)
+        self.frame_index = state["frame_index"]
+        self.engine = state["engine"]
+
+    def estimate_speed_batch(self, batch_frames, on_result=None):
+        """Estimate speeds in a batch of frames and return the annotated frames."""
+        return self.process_batch(batch_frames, self.estimate_speed, on_result)
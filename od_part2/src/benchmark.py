@@ -0,0 +1,291 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import threading
+import time
+from contextlib import nullcontext
+import cv2
+import numpy as np
+import psutil
+import torch
+import ultralytics
+from ultralytics.engine.results import Results
+from src.utils import setup_logger
+from src.batched_solutions import reuse_model
+from src.tracking import load_tracker, update_tracks
+
+
+BACKGROUND = 64 # Gray level of the synthetic background
+OBJECT_COLORS = [(200, 40, 40), (40, 200, 40), (40, 40, 200)] # BGR; the dominant channel is the class
+VARIANTS = {
+    "tracking": ("src.object_tracking.simple", "src.object_tracking.optimized"),
+    "counting": ("src.object_counting.simple", "src.object_counting.optimized"),
+    "speed": ("src.speech_estimation.simple", "src.speech_estimation.optimized"),
+}
+
+
+def make_synthetic_video(path, width=1280, height=720, fps=30, num_frames=300, num_objects=10, seed=0):
+    """Write a video of colored rectangles moving and bouncing over a plain background."""
+    rng = np.random.default_rng(seed)
+    sizes = rng.uniform(0.04, 0.1, (num_objects, 2)) * (width, height)
+    positions = rng.uniform(0, 1, (num_objects, 2)) * ((width, height) - sizes)
+    velocities = rng.uniform(2, 8, (num_objects, 2)) * rng.choice([-1, 1], (num_objects, 2))
+    colors = [OBJECT_COLORS[i] for i in rng.integers(0, len(OBJECT_COLORS), num_objects)]
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    try:
+        for _ in range(num_frames):
+            frame = np.full((height, width, 3), BACKGROUND, dtype=np.uint8)
+            for (x, y), (w, h), color in zip(positions.astype(int), sizes.astype(int), colors):
+                cv2.rectangle(frame, (x, y), (x + w, y + h), color, -1)
+            writer.write(frame)
+
+            # Move the objects and bounce them off the frame borders
+            positions += velocities
+            limits = (width, height) - sizes
+            bounced = (positions < 0) | (positions > limits)
+            velocities[bounced] *= -1
+            positions = np.clip(positions, 0, limits)
+    finally:
+        writer.release()
+    return path
+
+
+class StubDetector:
+    """
+    Stand-in for a YOLO model that finds the synthetic objects by color.
+
+    Supports the `predict`, `track` and `names` interface used by the pipelines, so the
+    benchmark runs offline without weights and measures everything but the network itself.
+    """
+
+    names = {0: "car", 1: "truck", 2: "bus"}
+
+    def __init__(self, min_area=64):
+        self.min_area = min_area
+        self.tracker = None
+
+    def detect(self, frame):
+        """Detect the objects of one frame as a result with (x1, y1, x2, y2, conf, cls) boxes."""
+        mask = (np.abs(frame.astype(np.int16) - BACKGROUND).max(axis=2) > 40).astype(np.uint8)
+        _, _, stats, centroids = cv2.connectedComponentsWithStats(mask)
+        keep = stats[1:, cv2.CC_STAT_AREA] >= self.min_area # Label 0 is the background
+        x, y, w, h = stats[1:][keep, :4].T
+        cx, cy = centroids[1:][keep].astype(int).T
+        cls = frame[cy, cx].argmax(axis=1)
+        boxes = np.stack([x, y, x + w, y + h, np.full(len(x), 0.9), cls], axis=1).astype(np.float32)
+        return Results(frame, path="", names=self.names, boxes=torch.from_numpy(boxes.reshape(-1, 6)))
+
+    def predict(self, source, **kwargs):
+        frames = source if isinstance(source, list) else [source]
+        return [self.detect(frame) for frame in frames]
+
+    def track(self, source, persist=False, **kwargs):
+        if self.tracker is None or not persist:
+            self.tracker = load_tracker("bytetrack.yaml")
+        return [update_tracks(self.tracker, result) for result in self.predict(source)]
+
+
+class FrameClock:
+    """Record when each frame is read and written, to measure per-frame latency."""
+
+    def __init__(self):
+        self.reads = []
+        self.writes = []
+
+    def wrap(self, target, method, times):
+        """Wrap `cv2.VideoCapture` or `cv2.VideoWriter` so calls to `method` are timestamped."""
+        class Timed:
+            def __init__(self, *args, **kwargs):
+                self.inner = target(*args, **kwargs)
+
+            def __getattr__(self, name):
+                return getattr(self.inner, name)
+
+        def timed(self, *args):
+            value = getattr(self.inner, method)(*args)
+            if method != "read" or value[0]:
+                times.append(time.perf_counter())
+            return value
+
+        setattr(Timed, method, timed)
+        return Timed
+
+    def install(self):
+        cv2.VideoCapture = self.wrap(cv2.VideoCapture, "read", self.reads)
+        cv2.VideoWriter = self.wrap(cv2.VideoWriter, "write", self.writes)
+
+
+class ResourceMonitor:
+    """Sample peak RSS and measure CPU utilization of the current process while a run is active."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak_rss = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self.stop_event.is_set():
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+            self.stop_event.wait(self.interval)
+
+    def __enter__(self):
+        self.cpu_start = self.process.cpu_times()
+        self.wall_start = time.perf_counter()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop_event.set()
+        self.thread.join()
+        self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+        cpu_end = self.process.cpu_times()
+        self.wall_seconds = time.perf_counter() - self.wall_start
+        cpu_seconds = (cpu_end.user - self.cpu_start.user) + (cpu_end.system - self.cpu_start.system)
+        self.cpu_percent = 100 * cpu_seconds / self.wall_seconds
+
+
+def run_variant(task, variant, video_path, output_dir, model_path, batch_size, stub, result_queue):
+    """Run one pipeline variant on the video and put its metrics on the queue; runs in a fresh process."""
+    try:
+        module = __import__(VARIANTS[task][variant == "optimized"], fromlist=["process_video"])
+        kwargs = {"batch_size": batch_size} if variant == "optimized" else {}
+        model = StubDetector() if stub else None
+        if model is not None and variant == "optimized":
+            kwargs["model"] = model # Used instead of loading `model_path`
+        elif model is not None:
+            module.YOLO = lambda *args, **kwargs: model # The simple tracking script loads its own model
+
+        args = [video_path, output_dir, model_path]
+        if task == "counting":
+            cap = cv2.VideoCapture(video_path)
+            width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            cap.release()
+            line = [(width // 2, 0), (width // 2, height)] # Vertical counting line
+            args.append({"line": line} if variant == "optimized" else line) # The optimized script counts named regions
+        clock = FrameClock()
+        clock.install()
+
+        # The simple counting and speed scripts build Ultralytics solutions, which load their own model
+        shared_model = reuse_model(model) if model is not None and variant == "simple" else nullcontext()
+        with ResourceMonitor() as monitor, shared_model:
+            module.process_video(*args, **kwargs)
+
+        frames = min(len(clock.reads), len(clock.writes))
+        if not frames:
+            raise RuntimeError("No frames were processed")
+        latencies = (np.array(clock.writes[:frames]) - np.array(clock.reads[:frames])) * 1000
+        result_queue.put({
+            "frames": frames,
+            "wall_seconds": round(monitor.wall_seconds, 3),
+            "throughput_fps": round(frames / (clock.writes[frames - 1] - clock.reads[0]), 2),
+            "latency_ms": {
+                "mean": round(float(latencies.mean()), 2),
+                "p50": round(float(np.percentile(latencies, 50)), 2),
+                "p95": round(float(np.percentile(latencies, 95)), 2),
+                "p99": round(float(np.percentile(latencies, 99)), 2),
+            },
+            "peak_rss_mb": round(monitor.peak_rss / 2**20, 1),
+            "cpu_percent": round(monitor.cpu_percent, 1),
+        })
+    except Exception as e:
+        result_queue.put({"error": str(e)})
+
+
+def run_benchmark(
+    tasks, batch_sizes, output_path, model_path="yolo11n.pt", stub=True, width=1280, height=720, fps=30,
+    num_frames=300, num_objects=10, seed=0
+):
+    """Benchmark the simple and optimized variants of each task and write the metrics as JSON."""
+    logger = setup_logger()
+    work_dir = os.path.join(os.path.dirname(output_path) or ".", "benchmark")
+    video_path = os.path.join(work_dir, f"synthetic_{width}x{height}_{fps}fps_{num_frames}f_{num_objects}o_s{seed}.mp4")
+    if not os.path.exists(video_path):
+        logger.info(f"Generating synthetic video: {video_path}")
+        make_synthetic_video(video_path, width, height, fps, num_frames, num_objects, seed)
+
+    report = {
+        "config": {
+            "video": {"width": width, "height": height, "fps": fps, "frames": num_frames, "objects": num_objects, "seed": seed},
+            "detector": "stub" if stub else model_path,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch": torch.__version__,
+            "ultralytics": ultralytics.__version__,
+            "opencv": cv2.__version__,
+            "cuda": torch.cuda.is_available(),
+        },
+        "runs": [],
+    }
+
+    # Every run gets a fresh process, so peak RSS and model state do not leak between runs
+    context = multiprocessing.get_context("spawn")
+    for task in tasks:
+        for variant, sizes in (("simple", [None]), ("optimized", batch_sizes)):
+            for batch_size in sizes:
+                result_queue = context.Queue()
+                process = context.Process(
+                    target=run_variant,
+                    args=(task, variant, video_path, work_dir, model_path, batch_size, stub, result_queue),
+                )
+                process.start()
+                metrics = result_queue.get()
+                process.join()
+
+                run = {"task": task, "variant": variant, "batch_size": batch_size, **metrics}
+                report["runs"].append(run)
+                if "error" in run:
+                    logger.error(f"{task}/{variant} batch_size={batch_size}: {run['error']}")
+                else:
+                    logger.info(
+                        f"{task}/{variant} batch_size={batch_size}: {run['throughput_fps']} FPS, "
+                        f"p50={run['latency_ms']['p50']} ms, p99={run['latency_ms']['p99']} ms, "
+                        f"RSS={run['peak_rss_mb']} MB, CPU={run['cpu_percent']}%"
+                    )
+
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Benchmark results saved to: {output_path}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark simple and optimized pipelines on a synthetic video")
+    parser.add_argument("--tasks", type=str, nargs="+", default=list(VARIANTS), choices=list(VARIANTS), help="Pipelines to benchmark")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 64], help="Batch sizes of the optimized variants")
+    parser.add_argument("--output", type=str, default="output/benchmark.json", help="Path of the JSON report")
+    parser.add_argument("--model-path", type=str, default="yolo11n.pt", help="Path to YOLO model, used with --no-stub")
+    parser.add_argument("--no-stub", action="store_true", help="Use the real model instead of the stub detector")
+    parser.add_argument("--width", type=int, default=1280, help="Width of the synthetic video")
+    parser.add_argument("--height", type=int, default=720, help="Height of the synthetic video")
+    parser.add_argument("--fps", type=int, default=30, help="FPS of the synthetic video")
+    parser.add_argument("--frames", type=int, default=300, help="Number of frames of the synthetic video")
+    parser.add_argument("--objects", type=int, default=10, help="Number of moving objects in the synthetic video")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic video")
+    args = parser.parse_args()
+
+    run_benchmark(
+        args.tasks,
+        args.batch_sizes,
+        args.output,
+        args.model_path,
+        not args.no_stub,
+        args.width,
+        args.height,
+        args.fps,
+        args.frames,
+        args.objects,
+        args.seed
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import os
+import pickle
+import shutil
+import threading
+from src.utils import setup_logger, concat_segments
+
+
+STATE_NAME = "state.pkl"
+
+
+class SegmentWriter:
+    """
+    Video writer that splits the output into segment files at checkpoints.
+
+    Frames lag behind the processing stage in the pipeline, so a checkpoint taken at frame N
+    is only committed once frame N has been written: the current segment is then closed,
+    which makes it a complete, playable file, and the next frames go to a new segment.
+    """
+
+    def __init__(self, checkpointer, open_writer):
+        self.checkpointer = checkpointer
+        self.open_writer = open_writer
+        self.frame_count = checkpointer.start_frame
+        self.path = None
+        self.writer = None
+        self._open_segment()
+
+    def _open_segment(self):
+        self.path = os.path.join(self.checkpointer.directory, f"segment_{len(self.checkpointer.segments):05d}.mp4")
+        self.writer = self.open_writer(self.path)
+        self.frames_in_segment = 0
+
+    def write(self, frame):
+        self.writer.write(frame)
+        self.frame_count += 1
+        self.frames_in_segment += 1
+        checkpoint = self.checkpointer.take_pending(self.frame_count)
+        if checkpoint is not None:
+            self.writer.release()
+            self.checkpointer.commit(checkpoint, self.path)
+            self._open_segment()
+
+    def release(self):
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
+
+
+class Checkpointer:
+    """
+    Periodically save the state of a video job, so that a killed run can be resumed.
+
+    Checkpoints live in `<video>_<suffix>_checkpoint` next to the outputs. `state.pkl` holds
+    the next frame to process, the completed output segments and the pickled solution state
+    (tracker, track history, tallies and speed buffers), and is replaced atomically, so a
+    crash never leaves a torn checkpoint behind. With `resume`, the last checkpoint is loaded
+    (`start_frame`, `state`) and segments written after it are discarded; otherwise any old
+    checkpoint is removed.
+
+    Call `save` every `interval` frames (see `due`) after the results of the frame are
+    recorded, write the output video through `open_video`, and call `finish` to join the
+    segments into the final video once the run completes.
+    """
+
+    def __init__(self, output_dir, video_path, suffix, interval=1000, resume=False):
+        logger = setup_logger()
+        video_name = os.path.splitext(os.path.basename(video_path))[0]
+        self.directory = os.path.join(output_dir, f"{video_name}_{suffix}_checkpoint")
+        self.interval = interval
+        self.start_frame = 0
+        self.segments = []
+        self.state = None
+        self.pending = None # (frame, pickled state) waiting for the video to catch up
+        self.writer = None
+        self.lock = threading.Lock()
+
+        state_path = os.path.join(self.directory, STATE_NAME)
+        if resume and os.path.exists(state_path):
+            with open(state_path, "rb") as f:
+                checkpoint = pickle.load(f)
+            self.start_frame = checkpoint["frame"]
+            self.segments = checkpoint["segments"]
+            self.state = pickle.loads(checkpoint["state"])
+            logger.info(f"Resuming from the checkpoint at frame {self.start_frame}")
+            for name in os.listdir(self.directory):
+                if name != STATE_NAME and name not in self.segments:
+                    os.remove(os.path.join(self.directory, name)) # Written after the checkpoint
+        else:
+            if resume:
+                logger.warning(f"No checkpoint found in {self.directory}; starting from the first frame")
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory)
+        self.last_saved = self.start_frame
+
+    def open_video(self, open_writer):
+        """Return a writer of the output video in segments; `open_writer(path)` opens one segment."""
+        self.writer = SegmentWriter(self, open_writer)
+        return self.writer
+
+    def due(self, frame_count):
+        """Whether a checkpoint should be saved after `frame_count` frames."""
+        return frame_count - self.last_saved >= self.interval
+
+    def save(self, frame_count, state):
+        """Checkpoint the state after `frame_count` frames; committed once the video has caught up."""
+        self.last_saved = frame_count
+        checkpoint = (frame_count, pickle.dumps(state))
+        if self.writer is None:
+            self.commit(checkpoint)
+            return
+        with self.lock:
+            self.pending = checkpoint
+
+    def take_pending(self, frame_count):
+        """Return the pending checkpoint once `frame_count` frames were written, or None."""
+        with self.lock:
+            checkpoint = self.pending
+            if checkpoint is None or checkpoint[0] > frame_count:
+                return None
+            self.pending = None
+            return checkpoint
+
+    def commit(self, checkpoint, segment_path=None):
+        """Write a checkpoint, adding the segment that ends at it."""
+        frame_count, state = checkpoint
+        if segment_path is not None:
+            self.segments.append(os.path.basename(segment_path))
+        path = os.path.join(self.directory, STATE_NAME)
+        with open(f"{path}.tmp", "wb") as f:
+            pickle.dump({"frame": frame_count, "segments": self.segments, "state": state}, f)
+        os.replace(f"{path}.tmp", path)
+
+    def release(self):
+        if self.writer is not None:
+            self.writer.release()
+
+    def finish(self, output_path, fps, width, height, video_io=None):
+        """Join the segments into the output video and remove the checkpoint."""
+        self.release()
+        if self.writer is not None:
+            segments = [os.path.join(self.directory, name) for name in self.segments]
+            if self.writer.frames_in_segment:
+                segments.append(self.writer.path)
+            if segments:
+                concat_segments(segments, output_path, fps, width, height, video_io)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def add_checkpoint_arguments(parser):
+    """Add the checkpoint and resume command line flags."""
+    parser.add_argument("--checkpoint-interval", type=int, default=None, help="Checkpoint every N frames so the run can be resumed")
+    parser.add_argument("--resume", action="store_true", help="Continue from the last checkpoint of an interrupted run")
+
+
+def checkpoint_from_args(args):
+    """Return the checkpoint options from the command line flags, or None when checkpointing is disabled."""
+    if args.checkpoint_interval is None and not args.resume:
+        return None
+    return {"interval": args.checkpoint_interval or 1000, "resume": args.resume}
@@ -0,0 +1,281 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from ultralytics.trackers.utils.matching import linear_assignment
+from ultralytics.utils.metrics import bbox_ioa
+from ultralytics.utils.plotting import Annotator, colors
+from src.utils import setup_logger, get_video_properties, concat_segments
+from src.track_history import TrackHistory
+from src.regions import RegionCounter, load_regions
+
+
+# Columns of a track table row
+TRACK_COLUMNS = ["frame", "track_id", "x1", "y1", "x2", "y2", "conf", "cls"]
+TRACK_FORMATS = ["%d", "%d", "%.2f", "%.2f", "%.2f", "%.2f", "%.2f", "%d"] # CSV format of each column
+TRACK_HISTORY_LENGTH = 120 # Maximum number of points drawn per track
+HISTORY_WARMUP = 4 * TRACK_HISTORY_LENGTH # Frames replayed before a segment to rebuild track lines
+
+
+def plan_chunks(total_frames, chunk_size, overlap):
+    """Split a video into `(warmup_start, start, end)` chunks; frames before `start` only warm up the tracker."""
+    return [
+        (max(0, start - overlap), start, min(start + chunk_size, total_frames))
+        for start in range(0, total_frames, chunk_size)
+    ]
+
+
+def track_chunk(video_path, model_path, warmup_start, end, num_threads, batch_size=32):
+    """Track frames `[warmup_start, end)` of a video in a worker process and return its track table."""
+    import torch
+    from ultralytics import YOLO
+    from src.tracking import StrideTracker
+
+    torch.set_num_threads(num_threads) # Leave the other cores to the other workers
+    model = YOLO(model_path)
+    cap = cv2.VideoCapture(video_path)
+    fps = get_video_properties(cap)[2]
+    tracker = StrideTracker(model, tracker="botsort.yaml", frame_rate=fps, verbose=False, iou=0.5)
+
+    rows = []
+    try:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, warmup_start)
+        frame_index = warmup_start
+        while frame_index < end:
+            batch_frames = []
+            while len(batch_frames) < batch_size and frame_index + len(batch_frames) < end:
+                success, frame = cap.read()
+                if not success:
+                    break
+                batch_frames.append(frame)
+            if not batch_frames:
+                break
+
+            for result in tracker.track(batch_frames):
+                if result.boxes.id is not None:
+                    boxes = result.boxes
+                    frame_column = np.full((len(boxes), 1), frame_index)
+                    rows.append(np.hstack([
+                        frame_column, boxes.id.cpu().numpy()[:, None], boxes.xyxy.cpu().numpy(),
+                        boxes.conf.cpu().numpy()[:, None], boxes.cls.cpu().numpy()[:, None],
+                    ]))
+                frame_index += 1
+    finally:
+        cap.release()
+
+    table = np.vstack(rows) if rows else np.empty((0, len(TRACK_COLUMNS)))
+    return table, model.names
+
+
+def match_tracks(previous, current, warmup_start, start, iou_threshold=0.5):
+    """
+    Match track IDs of two chunk tables over their overlap window `[warmup_start, start)`.
+
+    Tracks are compared by their mean IoU over the overlap frames and assigned one to one.
+    Returns a dict mapping IDs of `current` to IDs of `previous`.
+    """
+    previous = previous[(previous[:, 0] >= warmup_start) & (previous[:, 0] < start)]
+    current = current[(current[:, 0] >= warmup_start) & (current[:, 0] < start)]
+    if not len(previous) or not len(current):
+        return {}
+
+    previous_ids, previous_idx = np.unique(previous[:, 1], return_inverse=True)
+    current_ids, current_idx = np.unique(current[:, 1], return_inverse=True)
+    iou_sum = np.zeros((len(previous_ids), len(current_ids)))
+
+    for frame in np.intersect1d(previous[:, 0], current[:, 0]):
+        p = previous[:, 0] == frame
+        c = current[:, 0] == frame
+        iou = bbox_ioa(previous[p, 2:6], current[c, 2:6], iou=True)
+        np.add.at(iou_sum, (previous_idx[p][:, None], current_idx[c][None, :]), iou)
+
+    # Normalize by the number of overlap frames either track appears in
+    previous_frames = np.bincount(previous_idx, minlength=len(previous_ids))
+    current_frames = np.bincount(current_idx, minlength=len(current_ids))
+    mean_iou = iou_sum / np.maximum(previous_frames[:, None], current_frames[None, :])
+
+    matches, _, _ = linear_assignment(1 - mean_iou, thresh=1 - iou_threshold)
+    return {current_ids[j]: previous_ids[i] for i, j in matches}
+
+
+def stitch_tracks(tables, chunks):
+    """Give tracks globally consistent IDs across chunks and keep each frame from the chunk that owns it."""
+    stitched = []
+    next_id = 1
+    previous = None
+    for table, (warmup_start, start, end) in zip(tables, chunks):
+        matches = match_tracks(previous, table, warmup_start, start) if previous is not None else {}
+
+        # Map local IDs to global ones, continuing matched tracks and numbering new ones
+        global_table = table.copy()
+        for local_id in np.unique(table[:, 1]):
+            if local_id not in matches:
+                matches[local_id] = next_id
+                next_id += 1
+            global_table[table[:, 1] == local_id, 1] = matches[local_id]
+
+        stitched.append(global_table[(global_table[:, 0] >= start) & (global_table[:, 0] < end)])
+        previous = global_table
+    return np.vstack(stitched) if stitched else np.empty((0, len(TRACK_COLUMNS)))
+
+
+def count_tracks(table, regions, names):
+    """
+    Replay the stitched tracks frame by frame through a `RegionCounter`, so totals are not split
+    or doubled at chunk edges and match the optimized counting script for the same regions.
+    """
+    engine = RegionCounter(regions, len(names))
+    _, frame_starts = np.unique(table[:, 0], return_index=True) # The stitched table is sorted by frame
+    for rows in np.split(table, frame_starts[1:]):
+        engine.update(rows[:, 2:6], rows[:, 1].astype(np.int64), rows[:, 7].astype(np.int64))
+
+    totals = engine.counts.sum(axis=0)
+    return {
+        "in": int(totals[0].sum()),
+        "out": int(totals[1].sum()),
+        "regions": engine.region_counts(),
+        "classwise": {
+            names[cls]: {"IN": int(totals[0, cls]), "OUT": int(totals[1, cls])}
+            for cls in np.flatnonzero(totals.sum(axis=0))
+        },
+    }
+
+
+def frame_rows_between(table, start, end):
+    """Return the slice of a frame-sorted track table holding frames `[start, end)`."""
+    first, last = np.searchsorted(table[:, 0], [start, end])
+    return slice(first, last)
+
+
+def frame_rows(table, frame_index):
+    """Return the slice of a frame-sorted track table holding one frame."""
+    return frame_rows_between(table, frame_index, frame_index + 1)
+
+
+def render_chunk(video_path, table, names, start, end, segment_path, regions=None):
+    """Draw the stitched tracks on frames `[start, end)` and write them to a segment video."""
+    cap = cv2.VideoCapture(video_path)
+    width, height, fps, _ = get_video_properties(cap)
+    out = cv2.VideoWriter(segment_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+
+    # Warm up the track history with the frames just before the segment
+    track_history = TrackHistory(TRACK_HISTORY_LENGTH)
+    centers = np.column_stack([(table[:, 2] + table[:, 4]) / 2, (table[:, 3] + table[:, 5]) / 2])
+    for frame_index in range(max(0, start - HISTORY_WARMUP), start):
+        rows = frame_rows(table, frame_index)
+        track_history.update(table[rows, 1].astype(int).tolist(), centers[rows], frame_index)
+
+    try:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        for frame_index in range(start, end):
+            success, frame = cap.read()
+            if not success:
+                break
+
+            rows = frame_rows(table, frame_index)
+            track_ids = table[rows, 1].astype(int).tolist()
+            annotator = Annotator(frame, line_width=2, font_size=4)
+            for points in (regions or {}).values():
+                annotator.draw_region(reg_pts=[tuple(p) for p in points], color=(104, 0, 123), thickness=4)
+            for (x1, y1, x2, y2, conf, cls), track_id in zip(table[rows, 2:8], track_ids):
+                label = f"id:{track_id} {names[int(cls)]} {conf:.2f}"
+                annotator.box_label((x1, y1, x2, y2), label, color=colors(int(cls), True))
+
+            track_history.update(track_ids, centers[rows], frame_index)
+            polylines = track_history.polylines(track_ids)
+            if polylines:
+                cv2.polylines(frame, polylines, isClosed=False, color=(230, 230, 230), thickness=4)
+            out.write(frame)
+    finally:
+        cap.release()
+        out.release()
+    return segment_path
+
+
+def process_video(video_path, output_dir, model_path, workers=None, chunk_seconds=None, overlap=30, regions=None):
+    """
+    Process a long video in parallel time chunks and stitch the tracks into one consistent result,
+    counting the named `regions` (a mapping of names to points) if given.
+    """
+    logger = setup_logger()
+    workers = workers or os.cpu_count()
+
+    try:
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            logger.error(f"Failed to open video: {video_path}")
+            return
+        width, height, fps, total_frames = get_video_properties(cap)
+        cap.release()
+        logger.info(f"Video properties: Width={width}, Height={height}, FPS={fps}, Total Frames={total_frames}")
+
+        chunk_size = int(chunk_seconds * fps) if chunk_seconds else math.ceil(total_frames / workers)
+        chunks = plan_chunks(total_frames, max(chunk_size, 1), overlap)
+        num_threads = max(1, os.cpu_count() // workers)
+        logger.info(f"Processing {len(chunks)} chunks of {chunk_size} frames on {workers} workers.")
+
+        # Spawned workers avoid inheriting torch state through fork
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [
+                pool.submit(track_chunk, video_path, model_path, warmup_start, end, num_threads)
+                for warmup_start, _, end in chunks
+            ]
+            outputs = [future.result() for future in futures]
+            tables = [table for table, _ in outputs]
+            names = outputs[0][1]
+
+            table = stitch_tracks(tables, chunks)
+            logger.info(f"Stitched {len(np.unique(table[:, 1]))} tracks across {len(chunks)} chunks.")
+
+            # Save the global track table
+            os.makedirs(output_dir, exist_ok=True)
+            video_name = os.path.splitext(os.path.basename(video_path))[0]
+            table_path = os.path.join(output_dir, f"{video_name}_tracks.csv")
+            np.savetxt(table_path, table, delimiter=",", header=",".join(TRACK_COLUMNS), comments="", fmt=TRACK_FORMATS)
+            logger.info(f"Track table saved to: {table_path}")
+
+            if regions:
+                counts = count_tracks(table, regions, names)
+                logger.info(f"Counts: {json.dumps(counts)}")
+
+            # Render the segments in parallel with the global IDs
+            with tempfile.TemporaryDirectory(dir=output_dir) as segment_dir:
+                futures = [
+                    pool.submit(
+                        render_chunk, video_path, table[frame_rows_between(table, start - HISTORY_WARMUP, end)], names,
+                        start, end, os.path.join(segment_dir, f"segment_{i:05d}.mp4"), regions,
+                    )
+                    for i, (_, start, end) in enumerate(chunks)
+                ]
+                segment_paths = [future.result() for future in futures]
+
+                output_path = os.path.join(output_dir, f"{video_name}_tracked_chunked.mp4")
+                concat_segments(segment_paths, output_path, fps, width, height)
+        logger.info(f"Output video saved to: {output_path}")
+    except Exception as e:
+        logger.error(f"Error processing video: {str(e)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunked Parallel Video Object Tracking")
+    parser.add_argument("--video-path", type=str, default="data/vietnam.mp4", help="Path to input video")
+    parser.add_argument("--output-dir", type=str, default="output", help="Directory to save the output video")
+    parser.add_argument("--model-path", type=str, default="yolo11l.pt", help="Path to YOLO model")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: all cores)")
+    parser.add_argument("--chunk-seconds", type=float, default=None, help="Chunk length in seconds (default: one chunk per worker)")
+    parser.add_argument("--overlap", type=int, default=30, help="Number of overlap frames used to stitch tracks between chunks")
+    parser.add_argument("--region", type=str, default=None, help="Counting region points as JSON, e.g. [[430,700],[1600,700],[1600,1080],[430,1080]]")
+    parser.add_argument("--regions", type=str, default=None, help="YAML or JSON file of named counting polygons and lines")
+    args = parser.parse_args()
+
+    regions = load_regions(args.regions) if args.regions else {"region": json.loads(args.region)} if args.region else None
+    process_video(args.video_path, args.output_dir, args.model_path, args.workers, args.chunk_seconds, args.overlap, regions)
+
+
+if __name__ == "__main__":
+    main()
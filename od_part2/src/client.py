@@ -0,0 +1,122 @@
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+
+
+DEFAULT_ADDRESS = "/tmp/od_server.sock"
+
+# Entry points a server can run, by job name
+ENTRY_POINTS = {
+    "tracking": "src.object_tracking.optimized",
+    "counting": "src.object_counting.optimized",
+    "speed": "src.speech_estimation.optimized",
+    "open_vocab": "src.open_vocab_detection",
+}
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix domain socket."""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def parse_address(address):
+    """Return ("tcp", (host, port)) for `host:port` or `http://host:port`, and ("unix", path) for anything else."""
+    if address.startswith("http://"):
+        address = address[len("http://"):].rstrip("/")
+    elif os.sep in address or ":" not in address:
+        return "unix", address
+    host, port = address.rsplit(":", 1)
+    return "tcp", (host or "localhost", int(port))
+
+
+def request(address, method, path, body=None, timeout=None):
+    """Send a JSON request to the server and return the decoded response."""
+    kind, target = parse_address(address)
+    connection = UnixHTTPConnection(target, timeout) if kind == "unix" else http.client.HTTPConnection(*target, timeout=timeout)
+    try:
+        payload = json.dumps(body).encode() if body is not None else None
+        connection.request(method, path, payload, {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        result = json.loads(response.read() or b"{}")
+        if response.status != 200:
+            raise RuntimeError(result.get("error", f"Server returned HTTP {response.status}"))
+        return result
+    finally:
+        connection.close()
+
+
+def submit_job(address, entry, argv):
+    """
+    Run an entry point on the server with the given command line and wait for it to finish.
+
+    Relative paths are resolved against the current directory, as if the job ran here. The
+    log of the job is printed as it would have been locally. Returns the exit status.
+    """
+    try:
+        result = request(address, "POST", "/jobs", {"entry": entry, "argv": list(argv), "cwd": os.getcwd()})
+    except (OSError, RuntimeError) as e:
+        print(f"Failed to submit the job to {address}: {e}", file=sys.stderr)
+        return 1
+    for line in result["log"]:
+        print(line, file=sys.stderr)
+    if result["error"] is not None:
+        print(f"Job failed on the server: {result['error']}", file=sys.stderr)
+    print(f"Job finished on the server in {result['seconds']:.2f} s", file=sys.stderr)
+    return 0 if result["error"] is None else 1
+
+
+def add_server_arguments(parser):
+    """Add the flag that submits a run to a warm inference server."""
+    parser.add_argument(
+        "--server", type=str, nargs="?", const=DEFAULT_ADDRESS, default=None,
+        help=(
+            f"Run on a warm `python -m src.server` (Unix socket or host:port, default {DEFAULT_ADDRESS}) "
+            "instead of importing PyTorch and loading the model here"
+        )
+    )
+
+
+def forward_to_server(entry, argv=None):
+    """
+    Submit the command line to the server and exit when it has `--server`; otherwise return.
+
+    Entry points call this when run as scripts, before importing PyTorch and Ultralytics, so
+    that `--server` runs start as quickly as `python -m src.client`. `--help` stays local.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(add_help=False)
+    add_server_arguments(parser)
+    args, _ = parser.parse_known_args(argv)
+    if args.server and not {"-h", "--help"} & set(argv):
+        sys.exit(submit_job(args.server, entry, argv))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Submit jobs to a warm inference server without importing torch or loading models")
+    parser.add_argument("--server", type=str, default=DEFAULT_ADDRESS, help="Unix socket path or host:port of the server")
+    parser.add_argument("--status", action="store_true", help="Print the models loaded by the server")
+    parser.add_argument("entry", nargs="?", choices=list(ENTRY_POINTS), help="Entry point to run")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="Arguments of the entry point")
+    args = parser.parse_args()
+
+    if args.status:
+        print(json.dumps(request(args.server, "GET", "/models", timeout=10), indent=2))
+        return
+    if args.entry is None:
+        parser.error("an entry point is required")
+    sys.exit(submit_job(args.server, args.entry, args.args))
+
+
+if __name__ == "__main__":
+    main()
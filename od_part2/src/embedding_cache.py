@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import uuid
+import numpy as np
+import torch
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    """Return the SHA-256 of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TextEmbeddingCache:
+    """
+    Persistent, content-addressed cache of text embeddings.
+
+    Each embedding is stored as its own `.npy` file named after the SHA-256 of the model
+    checksum and the prompt, so caches can be shared by concurrent processes: files are
+    written atomically and a missing file is simply a miss. Hits refresh the file's
+    modification time, and the least recently used entries are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, cache_dir, max_entries=10_000):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def model_checksum(self, model_path):
+        """Return the checksum of a model file, reusing the one stored for the same size and mtime."""
+        stat = os.stat(model_path)
+        index_path = os.path.join(self.cache_dir, "checksums.json")
+        file_key = f"{os.path.abspath(model_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        checksums = {}
+        if os.path.exists(index_path):
+            try:
+                with open(index_path) as f:
+                    checksums = json.load(f)
+            except ValueError:
+                checksums = {} # Rewritten below
+        if file_key not in checksums:
+            checksums[file_key] = file_checksum(model_path)
+            self._write_atomic(index_path, lambda f: f.write(json.dumps(checksums).encode()))
+        return checksums[file_key]
+
+    def _path(self, model_checksum, prompt):
+        key = hashlib.sha256(f"{model_checksum}\0{prompt}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npy")
+
+    def _write_atomic(self, path, write):
+        """Write a file through a unique temporary file so readers never see a partial one."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    def get(self, model_checksum, prompt):
+        """Return the cached embedding of a prompt, or None."""
+        path = self._path(model_checksum, prompt)
+        try:
+            embedding = np.load(path)
+            os.utime(path) # Mark as recently used
+        except (FileNotFoundError, ValueError):
+            return None
+        return embedding
+
+    def put(self, model_checksum, prompt, embedding):
+        """Store the embedding of a prompt."""
+        self._write_atomic(self._path(model_checksum, prompt), lambda f: np.save(f, embedding))
+
+    def evict(self):
+        """Remove the least recently used entries beyond `max_entries`."""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".npy"):
+                    path = os.path.join(root, name)
+                    try:
+                        entries.append((os.stat(path).st_mtime_ns, path))
+                    except FileNotFoundError:
+                        continue # Evicted by another process
+        entries.sort()
+        for _, path in entries[:max(len(entries) - self.max_entries, 0)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def set_classes_cached(model, classes, cache, model_path=None):
+    """
+    Set the classes of a YOLOWorld model, encoding only prompts missing from the cache.
+
+    Equivalent to `model.set_classes(classes)`. When every prompt is cached, the CLIP text
+    encoder is not even loaded.
+    """
+    checksum = cache.model_checksum(model_path or model.ckpt_path)
+    embeddings = {prompt: cache.get(checksum, prompt) for prompt in classes}
+    missing = [prompt for prompt, embedding in embeddings.items() if embedding is None]
+
+    if missing:
+        model.model.set_classes(missing) # Runs the text encoder on the new prompts only
+        for prompt, embedding in zip(missing, model.model.txt_feats[0].float().cpu().numpy()):
+            cache.put(checksum, prompt, embedding)
+            embeddings[prompt] = embedding
+        cache.evict()
+
+    # Same state as YOLOWorld.set_classes leaves behind
+    txt_feats = torch.from_numpy(np.stack([embeddings[prompt] for prompt in classes]))
+    model.model.txt_feats = txt_feats.unsqueeze(0)
+    model.model.model[-1].nc = len(classes)
+    classes = [prompt for prompt in classes if prompt != " "] # Remove background if it's given
+    model.model.names = classes
+    if model.predictor:
+        model.predictor.model.names = classes
+    return len(missing)
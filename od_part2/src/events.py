@@ -0,0 +1,63 @@
+import json
+import os
+import cv2
+
+
+class EventWriter:
+    """
+    Append events and metrics of a headless run as JSON lines.
+
+    With `save_keyframes`, the frame of every event is also saved as a JPEG with the
+    event location marked, so the only pixels written are the ones worth looking at.
+    With `resume_from`, the events of an earlier run before that frame are kept.
+    """
+
+    def __init__(self, output_dir, video_path, suffix, fps, save_keyframes=False, resume_from=None):
+        os.makedirs(output_dir, exist_ok=True)
+        video_name = os.path.splitext(os.path.basename(video_path))[0]
+        self.output_path = os.path.join(output_dir, f"{video_name}_{suffix}_events.jsonl")
+        self.keyframe_dir = os.path.join(output_dir, f"{video_name}_{suffix}_keyframes") if save_keyframes else None
+        self.fps = fps
+        kept = self.read_events(resume_from) if resume_from is not None else []
+        self.file = open(self.output_path, "w")
+        self.file.writelines(kept)
+
+    def read_events(self, end_frame):
+        """Return the lines of the existing events file before `end_frame`, dropping a torn last line."""
+        if not os.path.exists(self.output_path):
+            return []
+        kept = []
+        with open(self.output_path) as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if event["frame"] < end_frame:
+                    kept.append(line if line.endswith("\n") else line + "\n")
+        return kept
+
+    def emit(self, event_type, frame_index, frame=None, box=None, point=None, **fields):
+        """Write one event; `box` or `point` marks its location on the saved keyframe."""
+        event = {"type": event_type, "frame": frame_index, "time": round(frame_index / self.fps, 3), **fields}
+        if self.keyframe_dir is not None and frame is not None:
+            name = f"{event_type}_{frame_index:06d}" + (f"_{fields['track_id']}" if "track_id" in fields else "")
+            event["keyframe"] = self.save_keyframe(name, frame, box, point)
+        self.file.write(json.dumps(event) + "\n")
+        self.file.flush() # Make events visible to readers as soon as they happen
+
+    def save_keyframe(self, name, frame, box=None, point=None):
+        """Save a copy of the frame with the event location marked."""
+        os.makedirs(self.keyframe_dir, exist_ok=True)
+        keyframe = frame.copy()
+        if box is not None:
+            x1, y1, x2, y2 = (int(v) for v in box)
+            cv2.rectangle(keyframe, (x1, y1), (x2, y2), (0, 0, 255), 2)
+        if point is not None:
+            cv2.circle(keyframe, (int(point[0]), int(point[1])), 8, (0, 0, 255), -1)
+        path = os.path.join(self.keyframe_dir, f"{name}.jpg")
+        cv2.imwrite(path, keyframe)
+        return path
+
+    def close(self):
+        self.file.close()
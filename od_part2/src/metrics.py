@@ -0,0 +1,253 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from src.utils import setup_logger
+
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class RollingHistogram:
+    """Keep the last `size` samples of a value for quantiles, plus running totals."""
+
+    def __init__(self, size=1024):
+        self.samples = np.zeros(size)
+        self.observations = 0
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value, weight=1):
+        self.samples[self.observations % len(self.samples)] = value
+        self.observations += 1
+        self.count += weight
+        self.total += value * weight
+
+    def window(self):
+        return self.samples[:min(self.observations, len(self.samples))]
+
+
+class PipelineMetrics:
+    """
+    Low-overhead per-stage timers, frame counters and queue gauges of a video pipeline.
+
+    Stage times are recorded in seconds per frame, so the stage with the highest mean is
+    the bottleneck. A background thread logs a JSON snapshot every `interval` seconds and,
+    optionally, writes it in Prometheus text format to `prometheus_path` (atomically, for
+    the node exporter's textfile collector) and serves it on `prometheus_host`:`prometheus_port`
+    at `/metrics`. The endpoint only listens on the loopback interface unless another host is given.
+    """
+
+    def __init__(self, pipeline, interval=10.0, prometheus_path=None, prometheus_port=None, window=1024, prometheus_host="127.0.0.1"):
+        self.pipeline = pipeline
+        self.interval = interval
+        self.prometheus_path = prometheus_path
+        self.prometheus_port = prometheus_port
+        self.prometheus_host = prometheus_host
+        self.window = window
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.latency = RollingHistogram(window)
+        self.gauges = {}
+        self.frames = 0
+        self.dropped = 0
+        self.fps = 0.0
+        self.last_frames = 0
+        self.last_time = time.perf_counter()
+        self.stop_event = threading.Event()
+        self.reporter = None
+        self.server = None
+        self.server_thread = None
+
+    def observe(self, stage, seconds, frames=1):
+        """Record that `stage` took `seconds` for `frames` frames."""
+        if frames <= 0:
+            return
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = RollingHistogram(self.window)
+            self.stages[stage].add(seconds / frames, frames)
+
+    @contextmanager
+    def time(self, stage, frames=1):
+        """Time the enclosed block as one stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, frames)
+
+    def observe_results(self, results, seconds, stage="tracking"):
+        """
+        Split the time of a `predict`/`track` call over the Ultralytics speed breakdown.
+
+        Preprocess, inference and postprocess come from each result's `speed` (in ms);
+        the rest of `seconds` is attributed to `stage`.
+        """
+        stages = {
+            name: sum(result.speed[name] or 0.0 for result in results) / 1000
+            for name in ("preprocess", "inference", "postprocess")
+        }
+        remainder = max(seconds - sum(stages.values()), 0.0)
+        stages[stage] = stages.get(stage, 0.0) + remainder
+        for name, total in stages.items():
+            self.observe(name, total, len(results))
+
+    def observe_latency(self, seconds):
+        """Record the glass-to-result latency of one frame of a live source."""
+        with self.lock:
+            self.latency.add(seconds)
+
+    def add_frames(self, frames=1):
+        with self.lock:
+            self.frames += frames
+
+    def add_dropped(self, frames=1):
+        with self.lock:
+            self.dropped += frames
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def snapshot(self):
+        """Return the current metrics as a dictionary."""
+        with self.lock:
+            now = time.perf_counter()
+            if now > self.last_time:
+                self.fps = (self.frames - self.last_frames) / (now - self.last_time)
+            self.last_frames, self.last_time = self.frames, now
+
+            stages = {}
+            for stage, histogram in self.stages.items():
+                samples = histogram.window()
+                p50, p95, p99 = np.quantile(samples, QUANTILES) * 1000
+                stages[stage] = {
+                    "count": histogram.count,
+                    "mean_ms": round(histogram.total / histogram.count * 1000, 3),
+                    "p50_ms": round(p50, 3),
+                    "p95_ms": round(p95, 3),
+                    "p99_ms": round(p99, 3),
+                    "total_seconds": round(histogram.total, 3),
+                }
+            snapshot = {
+                "pipeline": self.pipeline,
+                "frames": self.frames,
+                "dropped_frames": self.dropped,
+                "fps": round(self.fps, 2),
+                "queues": dict(self.gauges),
+                "stages": stages,
+                "bottleneck": max(stages, key=lambda stage: stages[stage]["mean_ms"]) if stages else None,
+            }
+            if self.latency.count:
+                p50, p95, p99 = np.quantile(self.latency.window(), QUANTILES) * 1000
+                snapshot["latency_ms"] = {"p50": round(float(p50), 1), "p95": round(float(p95), 1), "p99": round(float(p99), 1)}
+            return snapshot
+
+    def prometheus_text(self, snapshot=None):
+        """Render a snapshot in the Prometheus text exposition format."""
+        snapshot = snapshot or self.snapshot()
+        label = f'pipeline="{self.pipeline}"'
+        lines = [
+            "# TYPE od_stage_seconds summary",
+        ]
+        for stage, values in snapshot["stages"].items():
+            for quantile, key in zip(QUANTILES, ("p50_ms", "p95_ms", "p99_ms")):
+                lines.append(f'od_stage_seconds{{{label},stage="{stage}",quantile="{quantile}"}} {values[key] / 1000:.6f}')
+            lines.append(f'od_stage_seconds_sum{{{label},stage="{stage}"}} {values["total_seconds"]}')
+            lines.append(f'od_stage_seconds_count{{{label},stage="{stage}"}} {values["count"]}')
+        lines += [
+            "# TYPE od_frames_total counter",
+            f"od_frames_total{{{label}}} {snapshot['frames']}",
+            "# TYPE od_dropped_frames_total counter",
+            f"od_dropped_frames_total{{{label}}} {snapshot['dropped_frames']}",
+            "# TYPE od_fps gauge",
+            f"od_fps{{{label}}} {snapshot['fps']}",
+            "# TYPE od_queue_depth gauge",
+        ]
+        for name, value in snapshot["queues"].items():
+            lines.append(f'od_queue_depth{{{label},queue="{name}"}} {value}')
+        if "latency_ms" in snapshot:
+            lines.append("# TYPE od_latency_seconds summary")
+            for quantile, key in zip(QUANTILES, ("p50", "p95", "p99")):
+                lines.append(f'od_latency_seconds{{{label},quantile="{quantile}"}} {snapshot["latency_ms"][key] / 1000:.4f}')
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        """Log a JSON snapshot and update the Prometheus outputs."""
+        snapshot = self.snapshot()
+        setup_logger().info(f"metrics {json.dumps(snapshot)}")
+        self.text = self.prometheus_text(snapshot)
+        if self.prometheus_path:
+            os.makedirs(os.path.dirname(self.prometheus_path) or ".", exist_ok=True)
+            with open(f"{self.prometheus_path}.tmp", "w") as f:
+                f.write(self.text)
+            os.replace(f"{self.prometheus_path}.tmp", self.prometheus_path)
+        return snapshot
+
+    def _report_periodically(self):
+        while not self.stop_event.wait(self.interval):
+            self.report()
+
+    def start(self):
+        """Start periodic reporting and the scrape endpoint."""
+        self.text = self.prometheus_text()
+        if self.prometheus_port:
+            metrics = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path != "/metrics":
+                        self.send_error(404)
+                        return
+                    body = metrics.text.encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass # Keep scrapes out of the log
+
+            self.server = ThreadingHTTPServer((self.prometheus_host, self.prometheus_port), Handler)
+            self.server_thread = threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True)
+            self.server_thread.start()
+        self.reporter = threading.Thread(target=self._report_periodically, name="metrics-reporter", daemon=True)
+        self.reporter.start()
+        return self
+
+    def close(self):
+        """Stop reporting, release the scrape port for the next run in this process and write a final report."""
+        self.stop_event.set()
+        if self.reporter is not None:
+            self.reporter.join()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server_thread.join()
+            self.server = None
+        return self.report()
+
+
+def add_metrics_arguments(parser):
+    """Add the metrics command line flags shared by the pipelines."""
+    parser.add_argument("--metrics-interval", type=float, default=None, help="Log pipeline metrics as JSON every N seconds")
+    parser.add_argument("--prometheus-file", type=str, default=None, help="Also write metrics in Prometheus text format to this file")
+    parser.add_argument("--prometheus-port", type=int, default=None, help="Also serve metrics in Prometheus text format on this port")
+    parser.add_argument(
+        "--prometheus-host", type=str, default="127.0.0.1",
+        help="Interface to serve metrics on; use 0.0.0.0 to allow scrapes from other hosts"
+    )
+
+
+def metrics_from_args(args, pipeline):
+    """Create pipeline metrics from the shared flags, or None when metrics are disabled."""
+    if args.metrics_interval is None and args.prometheus_file is None and args.prometheus_port is None:
+        return None
+    return PipelineMetrics(
+        pipeline, args.metrics_interval or 10.0, args.prometheus_file, args.prometheus_port, prometheus_host=args.prometheus_host
+    )
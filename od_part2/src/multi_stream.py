@@ -0,0 +1,221 @@
+import argparse
+import json
+import queue
+import threading
+import time
+import cv2
+from tqdm import tqdm
+from ultralytics import YOLO
+from src.utils import setup_logger, get_video_properties, prepare_video_writer
+from src.pipeline import END, put_until_stopped, get_until_stopped
+from src.tracking import load_tracker, update_tracks
+from src.track_history import TrackHistory
+from src.batched_solutions import BatchedObjectCounter
+from src.object_tracking.optimized import draw_track_history
+from src.metrics import add_metrics_arguments, metrics_from_args
+
+
+class Stream:
+    """Capture, writer and tracking state of one video source."""
+
+    def __init__(self, index, video_path, output_dir, task, model, model_path, region_points=None):
+        self.index = index
+        self.video_path = video_path
+        self.task = task
+        self.frame_count = 0
+        self.writer = None
+        self.cap = cv2.VideoCapture(video_path)
+        if not self.cap.isOpened():
+            raise RuntimeError(f"Failed to open video: {video_path}")
+
+        self.width, self.height, self.fps, self.total_frames = get_video_properties(self.cap)
+        suffix = "tracked" if task == "tracking" else "counted"
+        self.writer, self.output_path = prepare_video_writer(
+            output_dir, video_path, f"{suffix}_stream{index}", self.fps, self.width, self.height
+        )
+
+        # Per-stream tracker and task state; the model is shared
+        self.tracker = load_tracker("botsort.yaml", self.fps)
+        if task == "tracking":
+            self.track_history = TrackHistory(120)
+        else:
+            # Either the points of one region or a mapping of region names to points
+            regions = region_points if isinstance(region_points, dict) else None
+            self.counter = BatchedObjectCounter(
+                show=False, region=next(iter(regions.values())) if regions else region_points, regions=regions,
+                model=model_path, shared_model=model, frame_rate=self.fps
+            )
+
+    def process(self, frame, detection):
+        """Track one frame of this stream and return the annotated frame."""
+        self.frame_count += 1
+        result = update_tracks(self.tracker, detection)
+
+        if self.task == "tracking":
+            boxes = result.boxes.xywh.cpu()
+            track_ids = result.boxes.id.int().cpu().tolist() if result.boxes.id is not None else []
+            annotated_frame = result.plot(font_size=4, line_width=2)
+            return draw_track_history(annotated_frame, boxes, track_ids, self.track_history, self.frame_count)
+        return self.counter.process_result(frame, result, self.counter.count)
+
+    def release(self):
+        """Release the capture and writer of this stream."""
+        self.cap.release()
+        if self.writer is not None:
+            self.writer.release()
+
+
+def read_stream(index, cap, frame_queue, stop_event, errors, metrics=None):
+    """Decode frames of one stream and put them on the shared queue, tagged with the stream index."""
+    try:
+        while cap.isOpened() and not stop_event.is_set():
+            start = time.perf_counter()
+            success, frame = cap.read()
+            if not success:
+                break
+            if metrics is not None:
+                metrics.observe("decode", time.perf_counter() - start)
+            if not put_until_stopped(frame_queue, (index, frame), stop_event):
+                return
+    except Exception as e:
+        errors.append(e)
+        stop_event.set()
+    finally:
+        put_until_stopped(frame_queue, (index, END), stop_event)
+
+
+def collect_batch(frame_queue, batch_size, stop_event, batch_timeout=0.05):
+    """
+    Collect up to `batch_size` frames from any stream.
+
+    Blocks for the first frame, then keeps taking frames until the batch is full or
+    `batch_timeout` seconds pass, so slow streams do not hold back a batch.
+    """
+    item = get_until_stopped(frame_queue, stop_event)
+    if item is END:
+        return []
+
+    items = [item]
+    deadline = time.monotonic() + batch_timeout
+    while len(items) < batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            items.append(frame_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return items
+
+
+def process_streams(video_paths, output_dir, model_path, task="tracking", regions=None, batch_size=64, metrics=None):
+    """Process several videos with one shared model, batching frames across streams."""
+    logger = setup_logger()
+    regions = regions or {}
+    streams = []
+    stop_event = threading.Event()
+    errors = []
+    frame_queue = queue.Queue(maxsize=2 * batch_size)
+    readers = []
+
+    try:
+        model = YOLO(model_path) # Load the YOLO model once for all streams
+        for index, video_path in enumerate(video_paths):
+            stream = Stream(index, video_path, output_dir, task, model, model_path, regions.get(video_path))
+            streams.append(stream)
+            logger.info(
+                f"Stream {index}: {video_path} Width={stream.width}, Height={stream.height}, "
+                f"FPS={stream.fps}, Total Frames={stream.total_frames}"
+            )
+
+        # Detect like `model.track`; counting streams share the detection settings of their counters
+        predict_args = {"conf": 0.1} if task == "tracking" else streams[0].counter.predict_args()
+        predict_args["verbose"] = False
+
+        for stream in streams:
+            reader = threading.Thread(
+                target=read_stream,
+                args=(stream.index, stream.cap, frame_queue, stop_event, errors, metrics),
+                name=f"stream-reader-{stream.index}",
+                daemon=True,
+            )
+            reader.start()
+            readers.append(reader)
+
+        active_streams = len(streams)
+        total_frames = sum(stream.total_frames for stream in streams)
+        logger.info(f"Starting processing of {active_streams} streams.")
+        if metrics is not None:
+            metrics.start()
+        with tqdm(total=total_frames, desc="Processing frames", colour="green") as pbar:
+            while active_streams:
+                items = collect_batch(frame_queue, batch_size, stop_event)
+                if not items:
+                    break
+
+                # One forward pass over frames from all streams
+                frames = [(index, frame) for index, frame in items if frame is not END]
+                start = time.perf_counter()
+                detections = model.predict([frame for _, frame in frames], **predict_args) if frames else []
+                if metrics is not None:
+                    metrics.set_gauge("frames", frame_queue.qsize())
+                    metrics.observe_results(detections, time.perf_counter() - start, "postprocess")
+
+                # Track and annotate each frame with the state of its own stream, in order
+                for (index, frame), detection in zip(frames, detections):
+                    start = time.perf_counter()
+                    processed_frame = streams[index].process(frame, detection)
+                    encode_start = time.perf_counter()
+                    streams[index].writer.write(processed_frame)
+                    pbar.update(1)
+                    if metrics is not None:
+                        metrics.observe("tracking", encode_start - start) # Includes region logic and annotation
+                        metrics.observe("encode", time.perf_counter() - encode_start)
+                        metrics.add_frames(1)
+
+                active_streams -= sum(frame is END for _, frame in items)
+
+        if errors:
+            raise errors[0]
+        for stream in streams:
+            logger.info(f"Stream {stream.index}: processed {stream.frame_count} frames, saved to {stream.output_path}")
+            if task == "counting":
+                logger.info(f"Stream {stream.index}: IN={stream.counter.in_count}, OUT={stream.counter.out_count}")
+    except Exception as e:
+        logger.error(f"Error processing streams: {str(e)}")
+    finally:
+        # Clean up resources
+        stop_event.set()
+        for reader in readers:
+            reader.join()
+        for stream in streams:
+            stream.release()
+        cv2.destroyAllWindows()
+        if metrics is not None:
+            metrics.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-stream Object Tracking and Counting")
+    parser.add_argument("--video-paths", type=str, nargs="+", default=["data/vietnam.mp4", "data/highway.mp4"], help="Paths to input videos")
+    parser.add_argument("--output-dir", type=str, default="output", help="Directory to save the output videos")
+    parser.add_argument("--model-path", type=str, default="yolo11l.pt", help="Path to YOLO model")
+    parser.add_argument("--task", type=str, default="tracking", choices=["tracking", "counting"], help="Task to run on every stream")
+    parser.add_argument("--regions", type=str, default=None, help="JSON file mapping each video path to its counting region points, or to named regions")
+    parser.add_argument("--batch-size", type=int, default=64, help="Maximum number of frames per inference batch")
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    regions = None
+    if args.regions:
+        with open(args.regions) as f:
+            regions = json.load(f)
+
+    process_streams(
+        args.video_paths, args.output_dir, args.model_path, args.task, regions, args.batch_size,
+        metrics_from_args(args, "multi_stream")
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,53 @@
-import cv2
+import sys
+import time
 import argparse
-from ultralytics import solutions
+from src.client import add_server_arguments, forward_to_server, submit_job
+
+if __name__ == "__main__":
+    forward_to_server("counting") # Hand off --server runs before the heavy imports below
+
+import cv2
 from tqdm import tqdm
-from src.utils import setup_logger, get_video_properties, prepare_video_writer, save_batch_as_images
+from ultralytics import YOLO
+from src.utils import (
+    setup_logger, open_capture, get_video_properties, prepare_video_writer, save_batch_as_images, add_video_io_arguments,
+    video_io_from_args, capture_scale, video_output_path, open_video_writer, seek_capture
+)
+from src.pipeline import (
+    run_pipeline, run_live_pipeline, add_batch_arguments, batch_size_from_args, add_live_arguments, live_options_from_args
+)
+from src.batched_solutions import BatchedObjectCounter
+from src.results_store import prepare_results_writer
+from src.events import EventWriter
+from src.roi import region_bounds
+from src.regions import load_regions
+from src.metrics import add_metrics_arguments, metrics_from_args
+from src.backends import add_backend_arguments, model_from_args
+from src.checkpoint import Checkpointer, add_checkpoint_arguments, checkpoint_from_args
+from src.tiling import TiledDetector, add_tiling_arguments, tiling_from_args
 
 
-def process_batch(counter, batch_frames):
+def process_batch(counter, batch_frames, on_result=None):
     """Process a batch of frames through the object counter."""
     try:
-        return [counter.count(frame) for frame in batch_frames]
+        return counter.count_batch(batch_frames, on_result)
     except Exception as e:
         raise RuntimeError(f"Error processing batch: {str(e)}")
 
 
-def process_video(video_path, output_dir, model_path, region_points):
-    """Process video for object counting"""
+def process_video(
+    video_path, output_dir, model_path, regions, save_results=False, headless=False, save_keyframes=False,
+    batch_size=64, metrics=None, live=None, roi_margin=None, tiling=None, video_io=None, checkpointing=None, model=None
+):
+    """Process video for object counting in one or more named regions (a mapping of names to points), with an already loaded `model` if given"""
     logger = setup_logger()
+    out = None
+    results_writer = None
+    event_writer = None
+    checkpoint = None
     
     try:
-        cap = cv2.VideoCapture(video_path)
+        cap = open_capture(video_path, live is not None, video_io)
         if not cap.isOpened():
             logger.error(f"Failed to open video: {video_path}")
             return
@@ -26,59 +55,146 @@ def process_video(video_path, output_dir, model_path, region_points):
         # Get video properties
         width, height, fps, total_frames = get_video_properties(cap)
         logger.info(f"Video properties: Width={width}, Height={height}, FPS={fps}, Total Frames={total_frames}")
+        fps = fps or 30 # Live streams may not report their frame rate
+        
+        # Region points are given in source pixels
+        scale_x, scale_y = capture_scale(cap)
+        regions = {name: [(round(x * scale_x), round(y * scale_y)) for x, y in points] for name, points in regions.items()}
         
-        # Prepare output video
-        out, output_path = prepare_video_writer(output_dir, video_path, "counted_optimized", fps, width, height)
+        # Resume an interrupted run from its last checkpoint; live streams cannot be resumed
+        if checkpointing is not None and live is None:
+            checkpoint = Checkpointer(output_dir, video_path, "counted_optimized", **checkpointing)
+        start_frame = checkpoint.start_frame if checkpoint is not None else 0
+        resume_from = start_frame if checkpoint is not None else None
         
-        # Initialize Object Counter
-        counter = solutions.ObjectCounter(show=False, region=region_points, model=model_path)
+        # Prepare output file, or only an event stream in headless mode
+        if headless:
+            event_writer = EventWriter(output_dir, video_path, "counted_optimized", fps, save_keyframes, resume_from)
+        elif checkpoint is not None:
+            # Write segments at every checkpoint, joined once the run completes
+            output_path = video_output_path(output_dir, video_path, "counted_optimized")
+            out = checkpoint.open_video(lambda path: open_video_writer(path, fps, width, height, video_io))
+        else:
+            out, output_path = prepare_video_writer(output_dir, video_path, "counted_optimized", fps, width, height, video_io)
+        if save_results:
+            results_writer, results_dir = prepare_results_writer(output_dir, video_path, "counted_optimized", resume_from=resume_from)
+        
+        # Initialize Object Counter, detecting on overlapping tiles when tiling is enabled
+        if tiling is not None:
+            model = TiledDetector(model if model is not None else YOLO(model_path), **tiling)
+        counter = BatchedObjectCounter(
+            show=False, region=next(iter(regions.values())), regions=regions, model=model_path, draw=not headless, shared_model=model,
+            frame_rate=fps
+        )
+        counter.metrics = metrics
+        if roi_margin is not None:
+            # Detect only around the counting regions
+            counter.roi = region_bounds(list(regions.values()), width, height, roi_margin)
+            logger.info(f"Detecting in ROI {counter.roi}")
+        if start_frame:
+            counter.load_state(checkpoint.state) # Tracks, regions and tallies
+            seek_capture(cap, start_frame)
         
         # Process video frames
-        batch_size = 64
-        batch_frames = []
-        frame_count = 0
+        batch_start = time.perf_counter()
         
-        logger.info("Starting video processing.")
-        with tqdm(total=total_frames, desc="Processing frames", colour="green") as pbar:
-            while cap.isOpened():
-                success, frame = cap.read()
-                if not success:
-                    break
-                
-                # Collect frames for batch processing
-                frame_count += 1
-                batch_frames.append(frame) 
-                
-                # Process when batch is full or at end of video
-                if len(batch_frames) == batch_size or frame_count == total_frames:
-                    processed_frames = process_batch(counter, batch_frames)
-                    
-                    # Save the batch of processed frames as images
-                    # save_batch_as_images(output_dir, processed_frames, frame_count)
+        def process_frames(batch_frames, frame_count):
+            nonlocal batch_start
+            
+            # Export boxes, track IDs, running counts and crossing events
+            def record_result(frame_idx, result):
+                frame_index = frame_count - len(batch_frames) + frame_idx
+                if results_writer is not None:
+                    results_writer.add(frame_index, result, counts=(counter.in_count, counter.out_count))
+                if event_writer is not None:
+                    for crossing in counter.crossings:
+                        event_writer.emit("crossing", frame_index, batch_frames[frame_idx], point=crossing["centroid"], **crossing)
+
+            processed_frames = process_batch(counter, batch_frames, record_result)
+            
+            if event_writer is not None:
+                now = time.perf_counter()
+                event_writer.emit(
+                    "metrics", frame_count - 1, in_count=counter.in_count, out_count=counter.out_count,
+                    classwise_counts=counter.classwise_counts, region_counts=counter.region_counts(), processing_fps=round(len(batch_frames) / (now - batch_start), 2)
+                )
+                batch_start = now
+            
+            if checkpoint is not None and checkpoint.due(frame_count):
+                if results_writer is not None:
+                    results_writer.flush() # Results up to the checkpoint must be on disk
+                checkpoint.save(frame_count, counter.state())
+            
+            # Save the batch of processed frames as images
+            # save_batch_as_images(output_dir, processed_frames, frame_count - len(processed_frames))
+            return processed_frames
 
-                    for processed_frame in processed_frames:
-                        out.write(processed_frame)
-                        pbar.update(1)
+        logger.info("Starting video processing.")
+        if metrics is not None:
+            metrics.start()
+        with tqdm(total=total_frames if live is None else None, initial=start_frame, desc="Processing frames", colour="green") as pbar:
+            # Decode, process and encode on overlapping threads
+            write_frame = out.write if out is not None else None
+            if live is None:
+                frame_count = run_pipeline(
+                    cap, process_frames, write_frame, batch_size=batch_size, on_frame=pbar.update, metrics=metrics,
+                    start_frame=start_frame
+                )
+            else:
+                # Drop stale frames instead of queueing them; pace files like a camera
+                frame_count = run_live_pipeline(
+                    cap, process_frames, write_frame, batch_size=batch_size, pace_fps=fps if total_frames > 0 else None,
+                    on_frame=pbar.update, metrics=metrics, **live
+                )
 
-                    batch_frames = []
-                
-        logger.info(f"Processed {frame_count} frames successfully")
+        logger.info(f"Processed {frame_count} frames successfully, IN={counter.in_count}, OUT={counter.out_count}")
+        if len(regions) > 1:
+            for name, counts in counter.region_counts().items():
+                logger.info(f"{name}: IN={counts['IN']}, OUT={counts['OUT']}")
+        if checkpoint is not None:
+            checkpoint.finish(output_path if out is not None else None, fps, width, height, video_io)
     except Exception as e:
         logger.error(f"Error processing video: {str(e)}")
     finally:
         # Clean up resources
         cap.release()
-        out.release()
         cv2.destroyAllWindows()
-        logger.info(f"Output video saved to: {output_path}")
+        if out is not None:
+            out.release()
+            logger.info(f"Output video saved to: {output_path}")
+        if event_writer is not None:
+            event_writer.close()
+            logger.info(f"Events saved to: {event_writer.output_path}")
+        if results_writer is not None:
+            results_writer.close()
+            logger.info(f"Results saved to: {results_dir}")
+        if metrics is not None:
+            metrics.close()
 
 
-def main():
+def main(argv=None, model_pool=None):
     parser = argparse.ArgumentParser(description="Video Object Tracking")
     parser.add_argument("--video-path", type=str, default="data/highway.mp4", help="Path to input video")
     parser.add_argument("--output-dir", type=str, default="output", help="Directory to save the output video")
     parser.add_argument("--model-path", type=str, default="yolo11x.pt", help="Path to YOLO model")
-    args = parser.parse_args()
+    parser.add_argument("--save-results", action="store_true", help="Export per-frame boxes, track IDs and counts as .npy shards")
+    parser.add_argument("--headless", action="store_true", help="Skip annotation and video encoding; write an event stream instead")
+    parser.add_argument("--save-keyframes", action="store_true", help="In headless mode, save a JPEG of every crossing event")
+    parser.add_argument("--regions", type=str, default=None, help="YAML or JSON file of named counting polygons and lines")
+    add_batch_arguments(parser)
+    add_metrics_arguments(parser)
+    add_live_arguments(parser)
+    parser.add_argument("--roi", action="store_true", help="Only run detection on the bounding box of the regions")
+    parser.add_argument("--roi-margin", type=int, default=64, help="Margin around the regions in ROI mode (px)")
+    add_tiling_arguments(parser)
+    add_backend_arguments(parser)
+    add_video_io_arguments(parser)
+    add_checkpoint_arguments(parser)
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.server and model_pool is None:
+        # Run on the warm server instead of loading the model here
+        sys.exit(submit_job(args.server, "counting", sys.argv[1:] if argv is None else argv))
     
     # highway.mp4 - region points
     region_points = [
@@ -99,7 +215,29 @@ def main():
     # fruit_and_vegetable.gif - region points
     # region_points = [(250, 0), (250, 270)]
     
-    process_video(args.video_path, args.output_dir, args.model_path, region_points)
+    # Count many lanes and lines in one pass
+    regions = load_regions(args.regions) if args.regions else {"region": region_points}
+    
+    model_path = model_from_args(args, args.video_path) # Export once for the ONNX and OpenVINO backends
+    model = model_pool.get(model_path) if model_pool is not None else None # Warm model of the server
+    
+    process_video(
+        args.video_path, 
+        args.output_dir, 
+        model_path, 
+        regions, 
+        args.save_results, 
+        args.headless, 
+        args.save_keyframes, 
+        batch_size_from_args(args), 
+        metrics_from_args(args, "counting"), 
+        live_options_from_args(args), 
+        args.roi_margin if args.roi else None, 
+        tiling_from_args(args), 
+        video_io_from_args(args), 
+        checkpoint_from_args(args), 
+        model
+    )
 
 
 if __name__ == "__main__":
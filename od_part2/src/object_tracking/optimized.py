@@ -1,73 +1,97 @@
 import argparse
+import sys
+import time
+from src.client import add_server_arguments, forward_to_server, submit_job
+
+if __name__ == "__main__":
+    forward_to_server("tracking") # Hand off --server runs before the heavy imports below
+
 import cv2
 import numpy as np
 from tqdm import tqdm
-from collections import defaultdict
 from ultralytics import YOLO
-from src.utils import setup_logger, get_video_properties, prepare_video_writer, save_batch_as_images
+from src.utils import (
+    setup_logger, open_capture, get_video_properties, prepare_video_writer, save_batch_as_images, add_video_io_arguments,
+    video_io_from_args, video_output_path, open_video_writer, seek_capture
+)
+from src.pipeline import (
+    run_pipeline, run_live_pipeline, add_batch_arguments, batch_size_from_args, add_live_arguments, live_options_from_args
+)
+from src.track_history import TrackHistory
+from src.tracking import StrideTracker
+from src.results_store import prepare_results_writer
+from src.events import EventWriter
+from src.metrics import add_metrics_arguments, metrics_from_args
+from src.backends import add_backend_arguments, model_from_args
+from src.checkpoint import Checkpointer, add_checkpoint_arguments, checkpoint_from_args
+from src.tiling import TiledDetector, add_tiling_arguments, tiling_from_args
 
 
-def update_track_history(track_history, last_seen, current_tracks, frame_count, frame_idx, track_history_length):
-    """Manage the history of tracked objects and remove inactive tracks."""
-    # Remove tracks that haven't been seen for longer than the specified history length
-    for track_id in list(track_history.keys()):
-        if track_id in current_tracks:
-            # Update the last seen frame for active tracks
-            last_seen[track_id] = frame_count - (len(track_history) - frame_idx - 1)
-        elif frame_count - last_seen[track_id] > track_history_length:
-            # Remove tracks that have been inactive for too long
-            del track_history[track_id]
-            del last_seen[track_id]
-
-
-def draw_track_history(frame, boxes, track_ids, track_history, track_history_length):
+def draw_track_history(frame, boxes, track_ids, track_history, frame_index):
     """Visualize the movement paths of tracked objects on the frame."""
-    for box, track_id in zip(boxes, track_ids):
-        # Extract the center coordinates of the bounding box
-        x, y, _, _ = box
-        track = track_history[track_id]        
-        track.append((float(x), float(y)))
-        
-        # Limit the length of the track history to prevent excessive memory usage
-        if len(track) > track_history_length:
-            track.pop(0)
-        
-        # Draw the movement path
-        points = np.hstack(track).astype(np.int32).reshape((-1, 1, 2))
-        cv2.polylines(frame, [points], isClosed=False, color=(230, 230, 230), thickness=4)
+    # Store the center coordinates of the bounding boxes
+    track_history.update(track_ids, np.asarray(boxes[:, :2]), frame_index)
+    
+    # Draw the movement paths
+    polylines = track_history.polylines(track_ids)
+    if polylines:
+        cv2.polylines(frame, polylines, isClosed=False, color=(230, 230, 230), thickness=4)
     return frame
 
 
-def process_batch(batch_frames, model, track_history, last_seen, track_history_length, frame_count):
-    """Process a batch of frames and return the processed frames."""
-    results = model.track(batch_frames, persist=True, tracker="botsort.yaml", verbose=False, iou=0.5)
+def process_batch(batch_frames, tracker, track_history, frame_count, on_result=None, draw=True, metrics=None):
+    """
+    Process a batch of frames and return the processed frames.
+
+    `on_result(frame_index, result)` is called for every tracked frame, with the 0-based index
+    of the frame in the source, like the exported results, events and checkpoints of all the
+    optimized scripts. With `draw=False` the frames are returned without annotation. With
+    `metrics`, annotation time is recorded.
+    """
+    results = tracker.track(batch_frames)
     processed_frames = []
 
     for frame_idx, result in enumerate(results):
+        frame_index = frame_count - len(batch_frames) + frame_idx # 0-based; track history only compares indices
+        if on_result is not None:
+            on_result(frame_index, result)
+        if not draw:
+            processed_frames.append(batch_frames[frame_idx])
+            continue
+
         # Extract bounding boxes and track IDs
         boxes = result.boxes.xywh.cpu()
         track_ids = result.boxes.id.int().cpu().tolist() if result.boxes.id is not None else []
 
-        # Update and manage track history
-        current_tracks = set(track_ids)
-        update_track_history(track_history, last_seen, current_tracks, frame_count, frame_idx, track_history_length)
-
         # Annotate frame with detection boxes and tracking information
+        start = time.perf_counter()
         annotated_frame = result.plot(font_size=4, line_width=2)
-        annotated_frame = draw_track_history(annotated_frame, boxes, track_ids, track_history, track_history_length)
+        annotated_frame = draw_track_history(annotated_frame, boxes, track_ids, track_history, frame_index)
+        if metrics is not None:
+            metrics.observe("plot", time.perf_counter() - start)
 
         processed_frames.append(annotated_frame)
 
     return processed_frames
 
 
-def process_video(video_path, output_dir, model_path):
-    """Process a video file using YOLO object tracking."""
+def process_video(
+    video_path, output_dir, model_path, stride=1, motion_threshold=None, save_results=False, headless=False, save_keyframes=False,
+    batch_size=64, metrics=None, live=None, tiling=None, video_io=None, checkpointing=None, model=None
+):
+    """Process a video file using YOLO object tracking, with an already loaded `model` if given."""
     logger = setup_logger()
+    out = None
+    results_writer = None
+    event_writer = None
+    checkpoint = None
     
     try:
-        model = YOLO(model_path) # Load YOLO model
-        cap = cv2.VideoCapture(video_path) # Open video file
+        if model is None:
+            model = YOLO(model_path) # Load YOLO model
+        if tiling is not None:
+            model = TiledDetector(model, **tiling) # Detect on overlapping tiles and merge the boxes
+        cap = open_capture(video_path, live is not None, video_io) # Open video file or stream
         if not cap.isOpened():
             logger.error(f"Failed to open video {video_path}")
             return
@@ -75,61 +99,169 @@ def process_video(video_path, output_dir, model_path):
         # Get video details
         width, height, fps, total_frames = get_video_properties(cap)
         logger.info(f"Video properties: Width={width}, Height={height}, FPS={fps}, Total Frames={total_frames}")
+        fps = fps or 30 # Live streams may not report their frame rate
         
-        # Prepare output file
-        out, output_path = prepare_video_writer(output_dir, video_path, "tracked_optimized", fps, width, height)
+        # Resume an interrupted run from its last checkpoint; live streams cannot be resumed
+        if checkpointing is not None and live is None:
+            checkpoint = Checkpointer(output_dir, video_path, "tracked_optimized", **checkpointing)
+        start_frame = checkpoint.start_frame if checkpoint is not None else 0
+        resume_from = start_frame if checkpoint is not None else None
+        
+        # Prepare output file, or only an event stream in headless mode
+        if headless:
+            event_writer = EventWriter(output_dir, video_path, "tracked_optimized", fps, save_keyframes, resume_from)
+        elif checkpoint is not None:
+            # Write segments at every checkpoint, joined once the run completes
+            output_path = video_output_path(output_dir, video_path, "tracked_optimized")
+            out = checkpoint.open_video(lambda path: open_video_writer(path, fps, width, height, video_io))
+        else:
+            out, output_path = prepare_video_writer(output_dir, video_path, "tracked_optimized", fps, width, height, video_io)
+        if save_results:
+            results_writer, results_dir = prepare_results_writer(output_dir, video_path, "tracked_optimized", resume_from=resume_from)
 
         # Initialize tracking
-        track_history = defaultdict(list) # Store movement history for each tracked object
-        last_seen = defaultdict(int) # Track the last frame each object was seen
-        batch_size = 64 # Number of frames to process in each batch
         track_history_length = 120 # Maximum number of frames to keep in track history
+        track_history = TrackHistory(track_history_length) # Store movement history for each tracked object
         
-        logger.info("Starting video processing.")
-        with tqdm(total=total_frames, desc="Processing frames", colour="green") as pbar:
-            frame_count = 0
-            batch_frames = []
+        # Run the detector on every `stride`-th frame (or on motion) and propagate tracks in between
+        tracker = StrideTracker(
+            model, 
+            tracker="botsort.yaml", 
+            stride=stride, 
+            motion_threshold=motion_threshold, 
+            frame_rate=fps, 
+            verbose=False, 
+            iou=0.5
+        )
+        tracker.metrics = metrics
+        
+        seen_ids = set()
+        active_tracks = 0
+        if start_frame:
+            tracker.load_state(checkpoint.state["tracker"])
+            track_history = checkpoint.state["track_history"]
+            seen_ids = checkpoint.state["seen_ids"]
+            seek_capture(cap, start_frame)
+        batch_start = time.perf_counter()
+        
+        # Export boxes and track IDs, and report new tracks as events
+        def record_result(frame_index, result):
+            nonlocal active_tracks
+            if results_writer is not None:
+                results_writer.add(frame_index, result)
+            if event_writer is not None:
+                track_ids = result.boxes.id.int().tolist() if result.boxes.id is not None else []
+                active_tracks = len(track_ids)
+                for track_id, box, cls in zip(track_ids, result.boxes.xyxy.tolist(), result.boxes.cls.int().tolist()):
+                    if track_id not in seen_ids:
+                        seen_ids.add(track_id)
+                        event_writer.emit("new_track", frame_index, result.orig_img, box=box, track_id=track_id, cls=cls)
+        
+        def process_frames(batch_frames, frame_count):
+            nonlocal batch_start
+            processed_frames = process_batch(
+                batch_frames, tracker, track_history, frame_count, record_result, draw=not headless, metrics=metrics
+            )
             
-            # Iterate through video frames
-            while cap.isOpened():
-                success, frame = cap.read()
-                if not success:
-                    break
-                
-                frame_count += 1
-                batch_frames.append(frame) # Collect frames for batch processing
-                
-                # Process batches
-                if len(batch_frames) == batch_size or frame_count == total_frames:
-                    processed_frames = process_batch(batch_frames, model, track_history, last_seen, track_history_length, frame_count)
-                    
-                    # Save the batch of processed frames as images
-                    # save_batch_as_images(output_dir, processed_frames, frame_count)
-                    
-                    # Save frames to output video
-                    for frame in processed_frames:
-                        out.write(frame)
-                        pbar.update(1)
-                    
-                    batch_frames = []
+            if event_writer is not None:
+                now = time.perf_counter()
+                event_writer.emit(
+                    "metrics", frame_count - 1, active_tracks=active_tracks, total_tracks=len(seen_ids),
+                    processing_fps=round(len(batch_frames) / (now - batch_start), 2)
+                )
+                batch_start = now
+            
+            if checkpoint is not None and checkpoint.due(frame_count):
+                if results_writer is not None:
+                    results_writer.flush() # Results up to the checkpoint must be on disk
+                checkpoint.save(frame_count, {"tracker": tracker.state(), "track_history": track_history, "seen_ids": seen_ids})
+            
+            # Save the batch of processed frames as images
+            # save_batch_as_images(output_dir, processed_frames, frame_count)
+            return processed_frames
+        
+        logger.info("Starting video processing.")
+        if metrics is not None:
+            metrics.start()
+        with tqdm(total=total_frames if live is None else None, initial=start_frame, desc="Processing frames", colour="green") as pbar:
+            # Decode, track and encode on overlapping threads
+            write_frame = out.write if out is not None else None
+            if live is None:
+                frame_count = run_pipeline(
+                    cap, process_frames, write_frame, batch_size=batch_size, on_frame=pbar.update, metrics=metrics,
+                    start_frame=start_frame
+                )
+            else:
+                # Drop stale frames instead of queueing them; pace files like a camera
+                frame_count = run_live_pipeline(
+                    cap, process_frames, write_frame, batch_size=batch_size, pace_fps=fps if total_frames > 0 else None,
+                    on_frame=pbar.update, metrics=metrics, **live
+                )
+        logger.info(f"Processed {frame_count} frames successfully")
+        if checkpoint is not None:
+            checkpoint.finish(output_path if out is not None else None, fps, width, height, video_io)
     except Exception as e:
         logger.error(f"Error processing video: {str(e)}")
     finally:
         # Clean up resources
         cap.release()
-        out.release()
         cv2.destroyAllWindows()
-        logger.info(f"Output video saved to: {output_path}")
+        if out is not None:
+            out.release()
+            logger.info(f"Output video saved to: {output_path}")
+        if event_writer is not None:
+            event_writer.close()
+            logger.info(f"Events saved to: {event_writer.output_path}")
+        if results_writer is not None:
+            results_writer.close()
+            logger.info(f"Results saved to: {results_dir}")
+        if metrics is not None:
+            metrics.close()
 
 
-def main():
+def main(argv=None, model_pool=None):
     parser = argparse.ArgumentParser(description="Video Object Tracking")
     parser.add_argument("--video-path", type=str, default="data/vietnam.mp4", help="Path to input video")
     parser.add_argument("--output-dir", type=str, default="output", help="Directory to save the output video")
     parser.add_argument("--model-path", type=str, default="yolo11l.pt", help="Path to YOLO model")
-    args = parser.parse_args()
+    parser.add_argument("--stride", type=int, default=1, help="Run the detector every N frames")
+    parser.add_argument("--motion-threshold", type=float, default=None, help="Also run the detector when motion energy exceeds this value (0-1)")
+    parser.add_argument("--save-results", action="store_true", help="Export per-frame boxes and track IDs as .npy shards")
+    parser.add_argument("--headless", action="store_true", help="Skip annotation and video encoding; write an event stream instead")
+    parser.add_argument("--save-keyframes", action="store_true", help="In headless mode, save a JPEG of every new track event")
+    add_batch_arguments(parser)
+    add_metrics_arguments(parser)
+    add_live_arguments(parser)
+    add_tiling_arguments(parser)
+    add_backend_arguments(parser)
+    add_video_io_arguments(parser)
+    add_checkpoint_arguments(parser)
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.server and model_pool is None:
+        # Run on the warm server instead of loading the model here
+        sys.exit(submit_job(args.server, "tracking", sys.argv[1:] if argv is None else argv))
+    
+    model_path = model_from_args(args, args.video_path) # Export once for the ONNX and OpenVINO backends
+    model = model_pool.get(model_path) if model_pool is not None else None # Warm model of the server
     
-    process_video(args.video_path, args.output_dir, args.model_path)
+    process_video(
+        args.video_path, 
+        args.output_dir, 
+        model_path, 
+        args.stride, 
+        args.motion_threshold, 
+        args.save_results, 
+        args.headless, 
+        args.save_keyframes, 
+        batch_size_from_args(args), 
+        metrics_from_args(args, "tracking"), 
+        live_options_from_args(args), 
+        tiling_from_args(args), 
+        video_io_from_args(args), 
+        checkpoint_from_args(args), 
+        model
+    )
 
 
 if __name__ == "__main__":
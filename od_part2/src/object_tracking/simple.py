@@ -1,30 +1,25 @@
-from collections import defaultdict
 import cv2
 import numpy as np
 from ultralytics import YOLO
 import argparse
 from src.utils import setup_logger, get_video_properties, prepare_video_writer
+from src.track_history import TrackHistory
+from src.tracking import StrideTracker
 
 
-def draw_tracking_lines(frame, track_history, boxes, track_ids, track_history_length):
+def draw_tracking_lines(frame, track_history, boxes, track_ids, frame_index):
     """Visualize the movement paths of tracked objects on the frame."""
-    for box, track_id in zip(boxes, track_ids):
-        # Extract the center coordinates of the bounding box
-        x, y, _, _ = box
-        track = track_history[track_id]
-        track.append((float(x), float(y)))
-
-        # Limit the length of the track history to prevent excessive memory usage
-        if len(track) > track_history_length:
-            track.pop(0)
-        
-        # Draw the movement path
-        points = np.hstack(track).astype(np.int32).reshape((-1, 1, 2))
-        cv2.polylines(frame, [points], isClosed=False, color=(230, 230, 230), thickness=4)
+    # Store the center coordinates of the bounding boxes
+    track_history.update(track_ids, np.asarray(boxes[:, :2]), frame_index)
+
+    # Draw the movement paths
+    polylines = track_history.polylines(track_ids)
+    if polylines:
+        cv2.polylines(frame, polylines, isClosed=False, color=(230, 230, 230), thickness=4)
     return frame
 
 
-def process_video(video_path, output_dir, model_path):
+def process_video(video_path, output_dir, model_path, stride=1, motion_threshold=None):
     """Process a video file using YOLO object tracking."""
     logger = setup_logger()
     
@@ -43,8 +38,12 @@ def process_video(video_path, output_dir, model_path):
         out, output_path = prepare_video_writer(output_dir, video_path, "tracked_simple", fps, width, height)
 
         # Initialize tracking
-        track_history = defaultdict(list)
         track_history_length = 120 # Maximum number of frames to keep in track history
+        track_history = TrackHistory(track_history_length)
+        frame_count = 0
+        
+        # Run the detector on every `stride`-th frame (or on motion) and propagate tracks in between
+        tracker = StrideTracker(model, stride=stride, motion_threshold=motion_threshold, frame_rate=fps)
 
         logger.info("Processing video...")
         while cap.isOpened():
@@ -52,10 +51,10 @@ def process_video(video_path, output_dir, model_path):
             success, frame = cap.read()
             if not success:
                 break
+            frame_count += 1
 
             # Perform object detection and tracking
-            # 'persist=True' maintains tracking across frames
-            results = model.track(frame, persist=True, show=False)
+            results = tracker.track([frame])
             
             # Extract bounding boxes and track IDs
             boxes = results[0].boxes.xywh.cpu()
@@ -63,7 +62,7 @@ def process_video(video_path, output_dir, model_path):
             
             # Annotate frame with object detections and tracking paths
             annotated_frame = results[0].plot(font_size=4, line_width=2)
-            annotated_frame = draw_tracking_lines(annotated_frame, track_history, boxes, track_ids, track_history_length)
+            annotated_frame = draw_tracking_lines(annotated_frame, track_history, boxes, track_ids, frame_count)
 
             # Write annotated frame to output video
             out.write(annotated_frame)
@@ -82,9 +81,11 @@ def main():
     parser.add_argument("--video-path", type=str, default="data/vietnam.mp4", help="Path to input video")
     parser.add_argument("--output-dir", type=str, default="output", help="Directory to save the output video")
     parser.add_argument("--model-path", type=str, default="yolo11l.pt", help="Path to YOLO model")
+    parser.add_argument("--stride", type=int, default=1, help="Run the detector every N frames")
+    parser.add_argument("--motion-threshold", type=float, default=None, help="Also run the detector when motion energy exceeds this value (0-1)")
     args = parser.parse_args()
 
-    process_video(args.video_path, args.output_dir, args.model_path)
+    process_video(args.video_path, args.output_dir, args.model_path, args.stride, args.motion_threshold)
 
 
 if __name__ == "__main__":
@@ -1,10 +1,22 @@
 import uuid
-import cv2
+import csv
+import glob
 import os
+import sys
 import argparse
-from ultralytics import YOLOWorld
+from concurrent.futures import ThreadPoolExecutor
+from src.client import add_server_arguments, forward_to_server, submit_job
+
+if __name__ == "__main__":
+    forward_to_server("open_vocab") # Hand off --server runs before the heavy imports below
+
+import cv2
+from tqdm import tqdm
+from ultralytics import YOLO, YOLOWorld
 from ultralytics.engine.results import Boxes
 from src.utils import setup_logger
+from src.embedding_cache import TextEmbeddingCache, set_classes_cached
+from src.backends import add_backend_arguments, model_from_args, classes_tag
 
 
 def save_detection_results(results, image_path, output_dir, logger):
@@ -25,7 +37,8 @@ def save_detection_results(results, image_path, output_dir, logger):
 
         # Create unique filename and save the image
         image_name = os.path.splitext(os.path.basename(image_path))[0]
-        output_path = os.path.join(output_dir, f"{image_name}_ovd.jpg")
+        output_name = f"{image_name}_ovd.jpg" if i == 0 else f"{image_name}_ovd_{i}.jpg"
+        output_path = os.path.join(output_dir, output_name)
         cv2.imwrite(output_path, annotated_image)
         saved_paths.append(str(output_path))
         
@@ -33,20 +46,165 @@ def save_detection_results(results, image_path, output_dir, logger):
     return saved_paths
 
 
-def main():
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+MANIFEST_COLUMNS = ["image", "output", "class_id", "class_name", "conf", "x1", "y1", "x2", "y2"]
+
+
+def list_images(source):
+    """List images from a directory, a glob pattern or a text manifest with one path per line."""
+    if os.path.isdir(source):
+        paths = glob.glob(os.path.join(source, "**", "*"), recursive=True)
+        return sorted(path for path in paths if path.lower().endswith(IMAGE_EXTENSIONS))
+    if source.endswith(".txt"):
+        with open(source) as f:
+            return [line.strip() for line in f if line.strip()]
+    return sorted(glob.glob(source, recursive=True))
+
+
+def load_processed(processed_path):
+    """Return the images already processed by a previous run."""
+    if not os.path.exists(processed_path):
+        return set()
+    with open(processed_path) as f:
+        return {line.rstrip("\n") for line in f}
+
+
+def image_root(image_paths):
+    """Deepest directory containing all images, so outputs can mirror the layout of the source."""
+    if not image_paths:
+        return ""
+    return os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in image_paths])
+
+
+def save_result(result, image_path, output_dir, root=None):
+    """
+    Save the annotated image of one result and return its manifest rows.
+
+    The output mirrors the path of the image relative to `root`, so images with the same
+    name in different subdirectories do not overwrite each other.
+    """
+    if not len(result.boxes):
+        return []
+
+    image_name = os.path.splitext(os.path.basename(image_path))[0]
+    image_dir = os.path.relpath(os.path.dirname(os.path.abspath(image_path)), root) if root else ""
+    os.makedirs(os.path.join(output_dir, image_dir), exist_ok=True)
+    output_path = os.path.normpath(os.path.join(output_dir, image_dir, f"{image_name}_ovd.jpg"))
+    cv2.imwrite(output_path, result.plot())
+
+    rows = []
+    for cls, conf, box in zip(result.boxes.cls.int().tolist(), result.boxes.conf.tolist(), result.boxes.xyxy.tolist()):
+        rows.append([image_path, output_path, cls, result.names[cls], round(conf, 4), *(round(v, 1) for v in box)])
+    return rows
+
+
+def process_images(model, source, output_dir, batch_size=32, workers=8):
+    """
+    Detect objects in many images, skipping images processed by a previous run.
+
+    Images are decoded on a thread pool one batch ahead of inference, and annotated
+    images are encoded and written on a second pool. Detections are appended to
+    `detections.csv`, and each finished image to `processed.txt`, after its batch is
+    fully written, so an interrupted run resumes from the last complete batch. Annotated
+    images keep the subdirectories of the source under `output_dir`.
+    """
+    logger = setup_logger()
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, "detections.csv")
+    processed_path = os.path.join(output_dir, "processed.txt")
+
+    image_paths = list_images(source)
+    root = image_root(image_paths)
+    processed = load_processed(processed_path)
+    pending = [path for path in image_paths if path not in processed]
+    logger.info(f"Found {len(image_paths)} images, {len(image_paths) - len(pending)} already processed")
+    if not pending:
+        return
+
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    write_header = not os.path.exists(manifest_path)
+    with ThreadPoolExecutor(workers) as decode_pool, ThreadPoolExecutor(workers) as write_pool, \
+            open(manifest_path, "a", newline="") as manifest_file, open(processed_path, "a") as processed_file, \
+            tqdm(total=len(pending), desc="Processing images", colour="green") as pbar:
+        manifest = csv.writer(manifest_file)
+        if write_header:
+            manifest.writerow(MANIFEST_COLUMNS)
+
+        decoded = [decode_pool.submit(cv2.imread, path) for path in batches[0]]
+        for batch_index, batch_paths in enumerate(batches):
+            images = [future.result() for future in decoded]
+
+            # Start decoding the next batch while this one runs through the model
+            if batch_index + 1 < len(batches):
+                decoded = [decode_pool.submit(cv2.imread, path) for path in batches[batch_index + 1]]
+
+            readable = [(path, image) for path, image in zip(batch_paths, images) if image is not None]
+            for path, image in zip(batch_paths, images):
+                if image is None:
+                    logger.warning(f"Failed to read image: {path}")
+
+            results = model.predict([image for _, image in readable], verbose=False) if readable else []
+            writes = [write_pool.submit(save_result, result, path, output_dir, root) for (path, _), result in zip(readable, results)]
+            for future in writes:
+                manifest.writerows(future.result())
+            manifest_file.flush()
+
+            processed_file.writelines(f"{path}\n" for path, _ in readable)
+            processed_file.flush()
+            pbar.update(len(batch_paths))
+
+    logger.info(f"Detections saved to: {manifest_path}")
+
+
+def load_model(args, logger):
+    """Load the YOLO-World model with the class prompts of the arguments, exported to the selected backend."""
+    logger.info(f"Loading YOLO model from: {args.model_path}")
+    model = YOLOWorld(args.model_path)
+    if args.embedding_cache:
+        # Define custom classes, encoding only prompts not seen before
+        cache = TextEmbeddingCache(args.embedding_cache, args.cache_size)
+        encoded = set_classes_cached(model, args.classes, cache)
+        logger.info(f"Encoded {encoded} of {len(args.classes)} class prompts, the rest were cached")
+    else:
+        model.set_classes(args.classes) # Define custom classes
+    
+    if args.backend != "torch":
+        # The vocabulary is baked into the exported model, so exports are cached per class list
+        model = YOLO(model_from_args(args, args.source or args.image_path, model=model, tag=classes_tag(args.classes)))
+    return model
+
+
+def main(argv=None, model_pool=None):
     logger = setup_logger()
     
     parser = argparse.ArgumentParser(description="Video Object Tracking")
     parser.add_argument("--image-path", type=str, default="data/vietnam_3.jpg", help="Path to input image")
+    parser.add_argument("--source", type=str, default=None, help="Directory, glob pattern or .txt list of images to process in bulk")
+    parser.add_argument("--batch-size", type=int, default=32, help="Number of images per inference batch in bulk mode")
+    parser.add_argument("--workers", type=int, default=8, help="Threads for image decoding and saving in bulk mode")
     parser.add_argument("--output-dir", type=str, default="output", help="Directory to save the output image")
     parser.add_argument("--model-path", type=str, default="yolov8x-world.pt", help="Path to YOLO model")
-    args = parser.parse_args()
+    parser.add_argument("--classes", type=str, nargs="+", default=["mask", "glasses"], help="Class prompts to detect")
+    parser.add_argument("--embedding-cache", type=str, default=".cache/text_embeddings", help="Directory of cached prompt embeddings, empty to disable")
+    parser.add_argument("--cache-size", type=int, default=10000, help="Maximum number of cached prompt embeddings")
+    add_backend_arguments(parser)
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.server and model_pool is None:
+        # Run on the warm server instead of loading the model here
+        sys.exit(submit_job(args.server, "open_vocab", sys.argv[1:] if argv is None else argv))
     
     try:                
-        # Load and configure YOLO model
-        logger.info(f"Loading YOLO model from: {args.model_path}")
-        model = YOLOWorld(args.model_path)
-        model.set_classes(["mask", "glasses"]) # Define custom classes
+        # Load and configure YOLO model; the server keeps one warm model per vocabulary
+        if model_pool is not None:
+            key = (args.model_path, tuple(args.classes), args.backend, args.int8)
+            model = model_pool.get(key, lambda: load_model(args, logger))
+        else:
+            model = load_model(args, logger)
+        
+        if args.source:
+            process_images(model, args.source, args.output_dir, args.batch_size, args.workers)
+            return
         
         # Perform object detection
         logger.info(f"Running predictions on image: {args.image_path}")
@@ -0,0 +1,435 @@
+import queue
+import threading
+import time
+from collections import deque
+import numpy as np
+import psutil
+from src.utils import setup_logger
+
+
+END = object() # Marks the end of a stage's output
+
+
+def put_until_stopped(q, item, stop_event):
+    """Put an item on a bounded queue, blocking until there is room or the pipeline stops."""
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def get_until_stopped(q, stop_event):
+    """Get an item from a queue, returning the end marker if the pipeline stops."""
+    while not stop_event.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return END
+
+
+class AdaptiveBatchSizer:
+    """
+    Pick the batch size from a memory ceiling and a latency budget, and keep adjusting it.
+
+    The ceiling caps the decoded frames that can be in flight across all pipeline stages,
+    given the frame size and the process memory in use before the first frame. If the
+    process still exceeds the ceiling (e.g. because of model activations), the batch size
+    is halved, until a later probe finds memory well below the ceiling again. The latency
+    budget caps a batch's processing time, from the measured time per frame. Within these
+    limits the batch size is doubled as long as that lowers the time per frame, then kept
+    at the best size and probed again every `probe_interval` batches.
+    """
+
+    def __init__(self, initial_size=8, min_size=1, max_size=64, memory_limit_mb=None, latency_budget=None, probe_interval=50):
+        self.size = max(min_size, min(initial_size, max_size))
+        self.min_size = min_size
+        self.max_size = max_size
+        self.memory_limit = memory_limit_mb * 2**20 if memory_limit_mb else None
+        self.latency_budget = latency_budget
+        self.probe_interval = probe_interval
+        self.frames_cap = max_size
+        self.memory_cap = max_size
+        self.frame_seconds = {} # Smoothed processing time per frame for each batch size tried
+        self.previous_size = None
+        self.settled_batches = 0
+        self.process = psutil.Process()
+
+    def configure(self, frame_bytes, batches_in_flight):
+        """Cap the batch size so that the frames in flight fit in the memory left for them."""
+        if self.memory_limit is None:
+            return
+        available = self.memory_limit - self.process.memory_info().rss
+        self.frames_cap = max(self.min_size, min(self.max_size, int(available // (frame_bytes * batches_in_flight))))
+        self.memory_cap = self.frames_cap
+        self._resize(min(self.size, self.memory_cap))
+
+    def _resize(self, size):
+        if size != self.size:
+            setup_logger().info(f"Batch size {self.size} -> {size}")
+            self.previous_size, self.size = self.size, size
+
+    def update(self, batch_len, seconds):
+        """Adjust the batch size after a batch of `batch_len` frames took `seconds` to process."""
+        if batch_len != self.size:
+            return # Partial last batch, or a batch read before the last change
+
+        frame_seconds = seconds / batch_len
+        previous = self.frame_seconds.get(self.size)
+        self.frame_seconds[self.size] = frame_seconds if previous is None else 0.7 * previous + 0.3 * frame_seconds
+
+        # Shrink under memory pressure and remember the size that caused it
+        if self.memory_limit is not None:
+            rss = self.process.memory_info().rss
+            if rss > self.memory_limit:
+                self.memory_cap = max(self.min_size, self.size // 2)
+                self._resize(self.memory_cap)
+                return
+            if self.settled_batches >= self.probe_interval and rss < 0.8 * self.memory_limit:
+                self.memory_cap = self.frames_cap
+
+        limit = min(self.max_size, self.memory_cap)
+        if self.latency_budget is not None:
+            limit = min(limit, max(self.min_size, int(self.latency_budget / self.frame_seconds[self.size])))
+        if self.size > limit:
+            self._resize(limit)
+            return
+
+        # Grow while larger batches lower the time per frame, otherwise return to the best size
+        allowed = [size for size in self.frame_seconds if size <= limit]
+        best_size = min(allowed, key=self.frame_seconds.get)
+        larger_size = min(self.size * 2, limit)
+        if best_size != self.size:
+            self._resize(best_size)
+        elif larger_size > self.size and (
+            larger_size not in self.frame_seconds or self.settled_batches >= self.probe_interval
+        ):
+            self.frame_seconds.pop(larger_size, None) # Measure again, conditions may have changed
+            self.settled_batches = 0
+            self._resize(larger_size)
+        else:
+            self.settled_batches += 1
+
+
+def add_batch_arguments(parser):
+    """Add the batch size command line flags shared by the pipelines."""
+    parser.add_argument("--batch-size", type=int, default=64, help="Number of frames per batch, the maximum with adaptive batching")
+    parser.add_argument("--max-memory-mb", type=float, default=None, help="Adapt the batch size to keep the process under this memory (MB)")
+    parser.add_argument("--latency-budget-ms", type=float, default=None, help="Adapt the batch size to process a batch within this time (ms)")
+
+
+def batch_size_from_args(args):
+    """Return the fixed batch size, or an adaptive one when a memory or latency limit is set."""
+    if args.max_memory_mb is None and args.latency_budget_ms is None:
+        return args.batch_size
+    latency_budget = args.latency_budget_ms / 1000 if args.latency_budget_ms is not None else None
+    return AdaptiveBatchSizer(max_size=args.batch_size, memory_limit_mb=args.max_memory_mb, latency_budget=latency_budget)
+
+
+def batch_size_of(batch_size):
+    """Return the current size of a fixed or adaptive batch size."""
+    return batch_size.size if isinstance(batch_size, AdaptiveBatchSizer) else batch_size
+
+
+def read_batches(cap, batch_queue, batch_size, stop_event, errors, metrics=None, batches_in_flight=None, start_frame=0):
+    """Decode frames from the capture and queue them in batches of a fixed or adaptive size."""
+    batch_frames = []
+    frame_count = start_frame
+    try:
+        while cap.isOpened() and not stop_event.is_set():
+            start = time.perf_counter()
+            success, frame = cap.read()
+            if not success:
+                break
+            if metrics is not None:
+                metrics.observe("decode", time.perf_counter() - start)
+            if frame_count == start_frame and isinstance(batch_size, AdaptiveBatchSizer):
+                batch_size.configure(frame.nbytes, batches_in_flight)
+
+            frame_count += 1
+            batch_frames.append(frame)
+            if len(batch_frames) >= batch_size_of(batch_size):
+                if not put_until_stopped(batch_queue, (batch_frames, frame_count), stop_event):
+                    return
+                batch_frames = []
+
+        # Flush the last partial batch
+        if batch_frames:
+            put_until_stopped(batch_queue, (batch_frames, frame_count), stop_event)
+    except Exception as e:
+        errors.append(e)
+        stop_event.set()
+    finally:
+        put_until_stopped(batch_queue, END, stop_event)
+
+
+def write_batches(write_frame, result_queue, stop_event, errors, on_frame=None, metrics=None):
+    """Write processed batches in the order they were queued."""
+    try:
+        while True:
+            processed_frames = get_until_stopped(result_queue, stop_event)
+            if processed_frames is END:
+                break
+
+            for frame in processed_frames:
+                if write_frame is not None:
+                    start = time.perf_counter()
+                    write_frame(frame)
+                    if metrics is not None:
+                        metrics.observe("encode", time.perf_counter() - start)
+                if on_frame is not None:
+                    on_frame(1)
+                if metrics is not None:
+                    metrics.add_frames(1)
+    except Exception as e:
+        errors.append(e)
+        stop_event.set()
+
+
+def run_pipeline(cap, process_batch_fn, write_frame, batch_size=64, queue_size=1, on_frame=None, metrics=None, start_frame=0):
+    """
+    Run decode, inference and encode as overlapping stages.
+
+    Frames are decoded on a reader thread, processed batch by batch on the calling thread
+    with `process_batch_fn(batch_frames, frame_count)` and written on a writer thread
+    (only counted when `write_frame` is None, e.g. in headless runs).
+    The stages are connected by queues holding at most `queue_size` batches, so a slow
+    stage blocks the ones feeding it instead of buffering the whole video. Output frames
+    keep the order of the input. With `start_frame`, the capture has been positioned at that
+    frame (e.g. when resuming) and frame counts start from it. Returns the index of the last
+    frame read plus one.
+
+    `batch_size` is a number of frames or an `AdaptiveBatchSizer`, which is updated with
+    the processing time of every batch.
+
+    With `metrics`, decode and encode times, written frames and queue depths are recorded.
+    """
+    stop_event = threading.Event()
+    errors = []
+    batch_queue = queue.Queue(maxsize=queue_size)
+    result_queue = queue.Queue(maxsize=queue_size)
+
+    # Batches alive at once: the one being read, the queued ones, the one being processed
+    # (input and output frames) and the one being written
+    batches_in_flight = 2 * queue_size + 4
+    reader = threading.Thread(
+        target=read_batches,
+        args=(cap, batch_queue, batch_size, stop_event, errors, metrics, batches_in_flight, start_frame),
+        name="pipeline-reader",
+        daemon=True,
+    )
+    writer = threading.Thread(
+        target=write_batches,
+        args=(write_frame, result_queue, stop_event, errors, on_frame, metrics),
+        name="pipeline-writer",
+        daemon=True,
+    )
+    reader.start()
+    writer.start()
+
+    frame_count = start_frame
+    try:
+        while True:
+            item = get_until_stopped(batch_queue, stop_event)
+            if item is END:
+                break
+
+            batch_frames, frame_count = item
+            if metrics is not None:
+                metrics.set_gauge("batch", batch_queue.qsize())
+                metrics.set_gauge("result", result_queue.qsize())
+            start = time.perf_counter()
+            processed_frames = process_batch_fn(batch_frames, frame_count)
+            if isinstance(batch_size, AdaptiveBatchSizer):
+                batch_size.update(len(batch_frames), time.perf_counter() - start)
+            if not put_until_stopped(result_queue, processed_frames, stop_event):
+                break
+    except BaseException:
+        stop_event.set()
+        raise
+    finally:
+        put_until_stopped(result_queue, END, stop_event)
+        reader.join()
+        writer.join()
+
+    if errors:
+        raise errors[0]
+    return frame_count
+
+
+class LatestFrames:
+    """
+    Bounded buffer of the newest captured frames of a live source.
+
+    When the buffer is full the oldest frame is dropped, so a consumer that falls behind
+    always gets the most recent frames instead of an ever older backlog.
+    """
+
+    def __init__(self, size):
+        self.frames = deque(maxlen=size)
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        with self.condition:
+            if len(self.frames) == self.frames.maxlen:
+                self.dropped += 1
+            self.frames.append(item)
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def take(self, max_items, batch_deadline, max_delay):
+        """
+        Wait for frames and return the buffered ones, oldest first, or None once closed and empty.
+
+        After the first frame arrives, waits up to `batch_deadline` seconds from its capture
+        for the batch to fill. Frames captured more than `max_delay` seconds ago are dropped,
+        except the newest one.
+        """
+        with self.condition:
+            while not self.frames and not self.closed:
+                self.condition.wait(0.1)
+            if not self.frames:
+                return None
+
+            deadline = self.frames[0][2] + batch_deadline
+            while len(self.frames) < max_items and not self.closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            items = list(self.frames)[-max_items:]
+            self.dropped += len(self.frames) - len(items)
+            self.frames.clear()
+
+        now = time.perf_counter()
+        fresh = [item for item in items[:-1] if now - item[2] <= max_delay] + items[-1:]
+        self.dropped += len(items) - len(fresh)
+        return fresh
+
+
+def read_live(cap, frames, stop_event, errors, pace_fps=None):
+    """Capture frames as fast as the source delivers them, tagged with their index and capture time."""
+    frame_index = 0
+    start = time.perf_counter()
+    try:
+        while cap.isOpened() and not stop_event.is_set():
+            if pace_fps:
+                # Emulate a camera when the source is a file
+                delay = start + frame_index / pace_fps - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            success, frame = cap.read()
+            if not success:
+                break
+            frames.put((frame_index, frame, time.perf_counter()))
+            frame_index += 1
+    except Exception as e:
+        errors.append(e)
+        stop_event.set()
+    finally:
+        frames.close()
+
+
+def run_live_pipeline(
+    cap, process_batch_fn, write_frame, batch_size=8, batch_deadline=0.05, max_delay=0.5, pace_fps=None,
+    on_frame=None, metrics=None
+):
+    """
+    Process a live source with bounded latency, dropping frames when processing falls behind.
+
+    Frames are captured on a reader thread into a buffer of the `batch_size` newest frames.
+    Each micro-batch takes the buffered frames once the batch is full or `batch_deadline`
+    seconds after its first frame was captured, skipping frames older than `max_delay`.
+    `process_batch_fn(batch_frames, frame_count)` gets consecutive frames, with `frame_count`
+    the source index of the last frame plus one. Glass-to-result latency, from capture to the
+    end of processing, is logged at the end and recorded in `metrics`. Returns the number of
+    frames read.
+    """
+    logger = setup_logger()
+    stop_event = threading.Event()
+    errors = []
+    frames = LatestFrames(batch_size_of(batch_size))
+    result_queue = queue.Queue(maxsize=4)
+    latencies = deque(maxlen=10000)
+    processed = 0
+    frame_count = 0
+    reported_dropped = 0
+
+    reader = threading.Thread(
+        target=read_live, args=(cap, frames, stop_event, errors, pace_fps), name="live-reader", daemon=True
+    )
+    writer = threading.Thread(
+        target=write_batches,
+        args=(write_frame, result_queue, stop_event, errors, on_frame, metrics),
+        name="pipeline-writer",
+        daemon=True,
+    )
+    reader.start()
+    writer.start()
+
+    try:
+        while not stop_event.is_set():
+            items = frames.take(batch_size_of(batch_size), batch_deadline, max_delay)
+            if metrics is not None:
+                dropped = frames.dropped
+                metrics.add_dropped(dropped - reported_dropped)
+                reported_dropped = dropped
+            if items is None:
+                break
+
+            # Stale frames are always the oldest ones, so the remaining frames are consecutive
+            start = time.perf_counter()
+            frame_count = items[-1][0] + 1
+            processed_frames = process_batch_fn([frame for _, frame, _ in items], frame_count)
+            done = time.perf_counter()
+            if isinstance(batch_size, AdaptiveBatchSizer):
+                batch_size.update(len(items), done - start)
+
+            processed += len(items)
+            for _, _, captured in items:
+                latencies.append(done - captured)
+                if metrics is not None:
+                    metrics.observe_latency(done - captured)
+            if not put_until_stopped(result_queue, processed_frames, stop_event):
+                break
+    except BaseException:
+        stop_event.set()
+        raise
+    finally:
+        put_until_stopped(result_queue, END, stop_event)
+        reader.join()
+        writer.join()
+
+    if errors:
+        raise errors[0]
+    if latencies:
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        logger.info(
+            f"Live: processed {processed} of {frame_count} frames, dropped {frames.dropped}, "
+            f"glass-to-result latency p50={p50:.0f} ms, p95={p95:.0f} ms, p99={p99:.0f} ms"
+        )
+    return frame_count
+
+
+def add_live_arguments(parser):
+    """Add the live mode command line flags shared by the pipelines."""
+    parser.add_argument("--live", action="store_true", help="Treat the input as a live stream: process the newest frames and drop stale ones")
+    parser.add_argument("--batch-deadline-ms", type=float, default=50, help="In live mode, longest wait for a micro-batch to fill (ms)")
+    parser.add_argument("--max-delay-ms", type=float, default=500, help="In live mode, skip frames captured longer ago than this (ms)")
+
+
+def live_options_from_args(args):
+    """Return the live mode options for `run_live_pipeline`, or None when not live."""
+    if not args.live:
+        return None
+    return {"batch_deadline": args.batch_deadline_ms / 1000, "max_delay": args.max_delay_ms / 1000}
@@ -0,0 +1,158 @@
+import numpy as np
+from ultralytics.utils import yaml_load
+
+
+def load_regions(path):
+    """
+    Load named counting regions from a YAML or JSON file.
+
+    Either a mapping of names to points, or a `regions` list of `{name, points}` entries.
+    Two points make a line, more make a polygon:
+
+        regions:
+          - name: lane_1
+            points: [[430, 700], [1600, 700], [1600, 1080], [430, 1080]]
+          - name: exit_line
+            points: [[0, 600], [3300, 600]]
+    """
+    config = yaml_load(path)
+    if isinstance(config, dict) and "regions" in config:
+        config = config["regions"]
+    if isinstance(config, dict):
+        regions = {str(name): points for name, points in config.items()}
+    else:
+        regions = {str(region.get("name", i)): region["points"] for i, region in enumerate(config)}
+    for name, points in regions.items():
+        if len(points) < 2:
+            raise ValueError(f"Region {name} needs at least 2 points, got {len(points)}")
+    return regions
+
+
+def cross(origin, a, b):
+    """Z component of (a - origin) x (b - origin), broadcast over leading dimensions."""
+    return (a[..., 0] - origin[..., 0]) * (b[..., 1] - origin[..., 1]) - (a[..., 1] - origin[..., 1]) * (b[..., 0] - origin[..., 0])
+
+
+def points_in_polygons(points, edge_start, edge_end):
+    """
+    Even-odd test of N points against P polygons at once.
+
+    `edge_start` and `edge_end` are (P, V, 2) polygon edges; polygons with fewer edges are
+    padded with zero-length edges, which never count as crossings. Returns an (N, P) mask.
+    """
+    px, py = points[:, None, None, 0], points[:, None, None, 1]
+    x1, y1, x2, y2 = edge_start[None, ..., 0], edge_start[None, ..., 1], edge_end[None, ..., 0], edge_end[None, ..., 1]
+    straddles = (y1 > py) != (y2 > py)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_cross = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+    return (straddles & (px < x_cross)).sum(axis=2) % 2 == 1
+
+
+def segments_intersect(start, end, line_start, line_end):
+    """Test N segments against L segments at once, touching included; returns an (N, L) mask."""
+    a, b = start[:, None], end[:, None]
+    c, d = line_start[None], line_end[None]
+    straddles = (cross(c, d, a) * cross(c, d, b) <= 0) & (cross(a, b, c) * cross(a, b, d) <= 0)
+    # Collinear segments straddle each other everywhere; they only intersect if their extents overlap
+    overlaps = (np.minimum(a, b) <= np.maximum(c, d)).all(axis=-1) & (np.maximum(a, b) >= np.minimum(c, d)).all(axis=-1)
+    return straddles & overlaps
+
+
+class RegionCounter:
+    """
+    Count tracks entering polygons and crossing lines, for any number of named regions in one pass.
+
+    Follows the rules of Ultralytics' `ObjectCounter` for each region: a track is counted
+    once per region, when its centroid is inside a polygon or its last step crosses a line.
+    The direction is IN when it moved right (regions taller than wide) or down (otherwise).
+    All tracks of a frame are tested against all regions with array operations, so the
+    cost per frame barely grows with the number of regions.
+
+    Tallies are kept in arrays: `counts[region, direction, class]` (direction 0 is IN, 1 is
+    OUT). Which regions counted each track and the last centroid of each track are indexed
+    by track ID.
+    """
+
+    def __init__(self, regions, num_classes):
+        self.names = list(regions)
+        points = [np.asarray(regions[name], dtype=np.float64).reshape(-1, 2) for name in self.names]
+        self.is_line = np.array([len(p) == 2 for p in points])
+        extent = np.array([p.max(axis=0) - p.min(axis=0) for p in points])
+        self.axis = (extent[:, 0] >= extent[:, 1]).astype(np.int64) # Direction along x (0) for tall regions, y (1) otherwise
+
+        lines = [p for p, is_line in zip(points, self.is_line) if is_line]
+        self.line_index = np.flatnonzero(self.is_line)
+        self.line_start = np.array([p[0] for p in lines]).reshape(-1, 2)
+        self.line_end = np.array([p[1] for p in lines]).reshape(-1, 2)
+
+        # Polygon edges, padded to the largest polygon with zero-length edges
+        polygons = [p for p, is_line in zip(points, self.is_line) if not is_line]
+        self.polygon_index = np.flatnonzero(~self.is_line)
+        num_edges = max((len(p) for p in polygons), default=0)
+        self.edge_start = np.zeros((len(polygons), num_edges, 2))
+        self.edge_end = np.zeros((len(polygons), num_edges, 2))
+        for i, p in enumerate(polygons):
+            self.edge_start[i] = np.concatenate((p, np.repeat(p[:1], num_edges - len(p), axis=0)))
+            self.edge_end[i] = np.concatenate((np.roll(p, -1, axis=0), np.repeat(p[:1], num_edges - len(p), axis=0)))
+
+        self.counts = np.zeros((len(self.names), 2, num_classes), dtype=np.int64)
+        self.counted = np.zeros((0, len(self.names)), dtype=bool)
+        self.last_position = np.zeros((0, 2))
+        self.seen = np.zeros(0, dtype=bool)
+
+    def _reserve(self, max_track_id):
+        """Grow the per-track arrays to hold `max_track_id`, doubling their size."""
+        if max_track_id < len(self.seen):
+            return
+        size = max(2 * len(self.seen), max_track_id + 1, 1024)
+        grow = size - len(self.seen)
+        self.counted = np.concatenate((self.counted, np.zeros((grow, len(self.names)), dtype=bool)))
+        self.last_position = np.concatenate((self.last_position, np.zeros((grow, 2))))
+        self.seen = np.concatenate((self.seen, np.zeros(grow, dtype=bool)))
+
+    def update(self, boxes, track_ids, classes):
+        """
+        Count the tracks of one frame.
+
+        Parameters:
+            boxes: (N, 4) xyxy boxes.
+            track_ids: (N,) integer track IDs.
+            classes: (N,) integer class IDs.
+
+        Returns:
+            list: One (track index, region index, direction) tuple per new count.
+        """
+        track_ids = np.asarray(track_ids, dtype=np.int64)
+        if not len(track_ids):
+            return []
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        classes = np.asarray(classes, dtype=np.int64)
+        centroids = (boxes[:, :2] + boxes[:, 2:]) / 2
+        self._reserve(int(track_ids.max()))
+
+        previous = self.last_position[track_ids]
+        hits = np.zeros((len(track_ids), len(self.names)), dtype=bool)
+        if len(self.line_index):
+            hits[:, self.line_index] = segments_intersect(previous, centroids, self.line_start, self.line_end)
+        if len(self.polygon_index):
+            hits[:, self.polygon_index] = points_in_polygons(centroids, self.edge_start, self.edge_end)
+        hits &= self.seen[track_ids, None] & ~self.counted[track_ids]
+
+        self.seen[track_ids] = True
+        self.last_position[track_ids] = centroids
+        track_index, region_index = np.nonzero(hits)
+        if not len(track_index):
+            return []
+
+        # Tracks moving towards increasing x or y along the region's axis go IN
+        axis = self.axis[region_index]
+        moved_forward = centroids[track_index, axis] > previous[track_index, axis]
+        direction = np.where(moved_forward, 0, 1)
+        np.add.at(self.counts, (region_index, direction, classes[track_index]), 1)
+        self.counted[track_ids[track_index], region_index] = True
+        return list(zip(track_index.tolist(), region_index.tolist(), direction.tolist()))
+
+    def region_counts(self):
+        """Return the IN and OUT totals of every region by name."""
+        totals = self.counts.sum(axis=2)
+        return {name: {"IN": int(totals[i, 0]), "OUT": int(totals[i, 1])} for i, name in enumerate(self.names)}
@@ -0,0 +1,190 @@
+import json
+import os
+import numpy as np
+
+
+# One row per detection
+DETECTION_DTYPE = np.dtype([
+    ("frame", np.int64),
+    ("track_id", np.int64), # -1 for untracked detections
+    ("x1", np.float32),
+    ("y1", np.float32),
+    ("x2", np.float32),
+    ("y2", np.float32),
+    ("conf", np.float32),
+    ("cls", np.int32),
+    ("speed", np.float32), # NaN when no speed was estimated
+])
+
+# One row per frame
+COUNT_DTYPE = np.dtype([
+    ("frame", np.int64),
+    ("in_count", np.int64),
+    ("out_count", np.int64),
+])
+
+MANIFEST_NAME = "manifest.json"
+
+
+class ResultsWriter:
+    """
+    Stream per-frame detections, tracks, speeds and counts into append-only `.npy` shards.
+
+    Rows are buffered until `shard_size` rows are collected and then written as one shard,
+    so memory stays bounded. `manifest.json` lists the shards with their frame and track
+    ranges and is replaced atomically after every shard, so a crashed run stays readable.
+    With `resume_from`, the results of an earlier run are kept up to that frame and new
+    rows are appended after them. `speed_unit` is recorded in the manifest when speeds are
+    exported.
+    """
+
+    def __init__(self, results_dir, shard_size=100_000, names=None, resume_from=None, speed_unit=None):
+        self.results_dir = results_dir
+        self.shard_size = shard_size
+        os.makedirs(results_dir, exist_ok=True)
+        self.manifest = {"names": names or {}, "detections": [], "counts": []}
+        if speed_unit is not None:
+            self.manifest["speed_unit"] = speed_unit
+        self.buffers = {"detections": [], "counts": []}
+        self.buffered_rows = {"detections": 0, "counts": 0}
+        if resume_from is not None and os.path.exists(os.path.join(results_dir, MANIFEST_NAME)):
+            self._truncate(resume_from)
+
+    def _truncate(self, end_frame):
+        """Keep the rows of an earlier run before `end_frame`, rewriting or removing the shards past it."""
+        with open(os.path.join(self.results_dir, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        self.manifest["names"] = self.manifest["names"] or {int(k): v for k, v in manifest["names"].items()}
+        for kind in ("detections", "counts"):
+            for shard in manifest[kind]:
+                path = os.path.join(self.results_dir, shard["file"])
+                if shard["frames"][1] < end_frame:
+                    self.manifest[kind].append(shard)
+                    continue
+                rows = np.load(path)
+                rows = rows[rows["frame"] < end_frame]
+                if not len(rows):
+                    os.remove(path)
+                    continue
+                np.save(path, rows)
+                shard.update(rows=len(rows), frames=[int(rows["frame"].min()), int(rows["frame"].max())])
+                if kind == "detections":
+                    shard["track_ids"] = [int(rows["track_id"].min()), int(rows["track_id"].max())]
+                self.manifest[kind].append(shard)
+        self._write_manifest()
+
+    def add(self, frame_index, result, speeds=None, counts=None):
+        """Add the boxes of one Ultralytics result, with optional per-track speeds and running counts."""
+        boxes = result.boxes
+        rows = np.zeros(len(boxes), dtype=DETECTION_DTYPE)
+        rows["frame"] = frame_index
+        rows["track_id"] = boxes.id.int().cpu().numpy() if boxes.id is not None else -1
+        xyxy = boxes.xyxy.cpu().numpy()
+        rows["x1"], rows["y1"], rows["x2"], rows["y2"] = xyxy.T
+        rows["conf"] = boxes.conf.cpu().numpy()
+        rows["cls"] = boxes.cls.cpu().numpy()
+        rows["speed"] = np.nan
+        if speeds:
+            rows["speed"] = [speeds.get(int(track_id), np.nan) for track_id in rows["track_id"]]
+        if not self.manifest["names"]:
+            self.manifest["names"] = {int(k): v for k, v in result.names.items()}
+        self._append("detections", rows)
+
+        if counts is not None:
+            self._append("counts", np.array([(frame_index, *counts)], dtype=COUNT_DTYPE))
+
+    def _append(self, kind, rows):
+        """Buffer rows and write a shard once enough are collected."""
+        self.buffers[kind].append(rows)
+        self.buffered_rows[kind] += len(rows)
+        if self.buffered_rows[kind] >= self.shard_size:
+            self._write_shard(kind)
+
+    def _write_shard(self, kind):
+        """Write the buffered rows of one kind as a new shard and update the manifest."""
+        if not self.buffered_rows[kind]:
+            return
+
+        rows = np.concatenate(self.buffers[kind])
+        shard_name = f"{kind}_{len(self.manifest[kind]):05d}.npy"
+        np.save(os.path.join(self.results_dir, shard_name), rows)
+
+        shard = {"file": shard_name, "rows": len(rows), "frames": [int(rows["frame"].min()), int(rows["frame"].max())]}
+        if kind == "detections":
+            shard["track_ids"] = [int(rows["track_id"].min()), int(rows["track_id"].max())]
+        self.manifest[kind].append(shard)
+        self.buffers[kind] = []
+        self.buffered_rows[kind] = 0
+        self._write_manifest()
+
+    def _write_manifest(self):
+        """Atomically replace the manifest."""
+        path = os.path.join(self.results_dir, MANIFEST_NAME)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(f"{path}.tmp", path)
+
+    def flush(self):
+        """Write the buffered rows as shards now, e.g. before checkpointing."""
+        self._write_shard("detections")
+        self._write_shard("counts")
+
+    def close(self):
+        """Write the remaining buffered rows."""
+        self.flush()
+        self._write_manifest()
+
+
+class ResultsReader:
+    """Query results written by `ResultsWriter` by frame range or track ID without loading every shard."""
+
+    def __init__(self, results_dir):
+        self.results_dir = results_dir
+        with open(os.path.join(results_dir, MANIFEST_NAME)) as f:
+            self.manifest = json.load(f)
+        self.names = {int(k): v for k, v in self.manifest["names"].items()}
+        self.speed_unit = self.manifest.get("speed_unit") # None when no speeds were exported
+
+    def _load(self, kind, keep_shard, select_rows):
+        """Memory-map the shards that may hold matching rows and concatenate the matches."""
+        dtype = DETECTION_DTYPE if kind == "detections" else COUNT_DTYPE
+        parts = []
+        for shard in self.manifest[kind]:
+            if not keep_shard(shard):
+                continue
+            rows = np.load(os.path.join(self.results_dir, shard["file"]), mmap_mode="r")
+            parts.append(np.asarray(rows[select_rows(rows)]))
+        return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+    def frames(self, start, end=None):
+        """Return detections of frames `[start, end)`; `end=None` means until the last frame."""
+        end = np.iinfo(np.int64).max if end is None else end
+        return self._load(
+            "detections",
+            lambda shard: shard["frames"][0] < end and shard["frames"][1] >= start,
+            lambda rows: (rows["frame"] >= start) & (rows["frame"] < end),
+        )
+
+    def track(self, track_id):
+        """Return all detections of one track, ordered by frame."""
+        return self._load(
+            "detections",
+            lambda shard: shard["track_ids"][0] <= track_id <= shard["track_ids"][1],
+            lambda rows: rows["track_id"] == track_id,
+        )
+
+    def counts(self, start=0, end=None):
+        """Return the running in/out counts of frames `[start, end)`."""
+        end = np.iinfo(np.int64).max if end is None else end
+        return self._load(
+            "counts",
+            lambda shard: shard["frames"][0] < end and shard["frames"][1] >= start,
+            lambda rows: (rows["frame"] >= start) & (rows["frame"] < end),
+        )
+
+
+def prepare_results_writer(output_dir, video_path, suffix, **kwargs):
+    """Prepares a ResultsWriter for the results of a video, next to the output video."""
+    video_name = os.path.splitext(os.path.basename(video_path))[0]
+    results_dir = os.path.join(output_dir, f"{video_name}_{suffix}_results")
+    return ResultsWriter(results_dir, **kwargs), results_dir
@@ -0,0 +1,27 @@
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+
+
+def region_bounds(regions, width, height, margin=64):
+    """Return the bounding box (x1, y1, x2, y2) of all region points plus a margin, clipped to the frame."""
+    points = np.concatenate([np.asarray(region, dtype=np.float32).reshape(-1, 2) for region in regions])
+    x1, y1 = np.floor(points.min(axis=0)) - margin
+    x2, y2 = np.ceil(points.max(axis=0)) + margin
+    return int(max(x1, 0)), int(max(y1, 0)), int(min(x2, width)), int(min(y2, height))
+
+
+def crop_frames(frames, roi):
+    """Crop frames to the ROI."""
+    x1, y1, x2, y2 = roi
+    return [np.ascontiguousarray(frame[y1:y2, x1:x2]) for frame in frames]
+
+
+def uncrop_result(result, frame, roi):
+    """Map a result computed on an ROI crop back to the full frame."""
+    x1, y1 = roi[:2]
+    data = result.boxes.data.clone()
+    data[:, :4] += torch.tensor([x1, y1, x1, y1], dtype=data.dtype, device=data.device)
+    full = Results(frame, path=result.path, names=result.names, boxes=data)
+    full.speed = result.speed
+    return full
@@ -0,0 +1,236 @@
+import argparse
+import contextlib
+import copy
+import gc
+import importlib
+import io
+import itertools
+import json
+import logging
+import os
+import socketserver
+import stat
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import torch
+from ultralytics import YOLO
+from src.utils import setup_logger
+from src.client import DEFAULT_ADDRESS, ENTRY_POINTS, parse_address
+
+
+def path_size(path):
+    """Size of a file, or of all files under a directory, in bytes."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def model_memory(model):
+    """Estimate the memory held by a loaded model: its weights, or the size of an exported model on disk."""
+    module = getattr(model, "model", None)
+    if isinstance(module, torch.nn.Module):
+        return sum(t.numel() * t.element_size() for t in itertools.chain(module.parameters(), module.buffers()))
+    if isinstance(module, (str, os.PathLike)) and os.path.exists(module):
+        return path_size(module)
+    return 0
+
+
+class ModelPool:
+    """
+    Keep loaded, warmed-up models in memory, keyed by model path (or any key with a loader).
+
+    A model is loaded on first use and warmed up on a blank frame, which fuses its layers and
+    builds its predictor (or inference session for exported models). When the estimated memory
+    of the pool exceeds `memory_budget` bytes, the least recently used models are evicted.
+    Predictor arguments are restored to their warm state every time a model is handed out, so
+    the `predict` arguments of one job never leak into the next.
+    """
+
+    def __init__(self, memory_budget=4 * 1024 ** 3, imgsz=640):
+        self.memory_budget = memory_budget
+        self.imgsz = imgsz
+        self.models = OrderedDict() # Key -> (model, bytes, warm predictor args), least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, key, load=None):
+        """Return the model of `key`, loading it with `load()` (default: `YOLO(key)`) if it is not in the pool."""
+        logger = setup_logger()
+        if isinstance(key, str) and os.path.exists(key):
+            key = os.path.abspath(key) # Jobs run in the directories of their clients
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                model, _, args = self.models[key]
+                if args is not None:
+                    model.predictor.args = copy.deepcopy(args)
+                logger.info(f"Using warm model: {key}")
+                return model
+
+            start = time.perf_counter()
+            model = load() if load is not None else YOLO(key)
+            model.predict(np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8), verbose=False) # Warm up
+            predictor = getattr(model, "predictor", None)
+            args = copy.deepcopy(predictor.args) if predictor is not None else None
+            size = model_memory(model)
+            self.models[key] = (model, size, args)
+            logger.info(f"Loaded {key} ({size / 1024 ** 2:.0f} MB) in {time.perf_counter() - start:.2f} s")
+            self._evict()
+            return model
+
+    def _evict(self):
+        """Drop least recently used models until the pool fits its budget, keeping the newest one."""
+        logger = setup_logger()
+        evicted = False
+        while len(self.models) > 1 and self.used() > self.memory_budget:
+            key, _ = self.models.popitem(last=False)
+            logger.info(f"Evicted {key} to stay within the memory budget")
+            evicted = True
+        if evicted:
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    def used(self):
+        """Estimated memory of the pooled models in bytes; call with the lock held."""
+        return sum(size for _, size, _ in self.models.values())
+
+    def status(self):
+        """Describe the loaded models, most recently used last."""
+        with self.lock:
+            models = [{"key": str(key), "mb": round(size / 1024 ** 2, 1)} for key, (_, size, _) in self.models.items()]
+            used = self.used()
+        return {"models": models, "used_mb": round(used / 1024 ** 2, 1), "budget_mb": round(self.memory_budget / 1024 ** 2, 1)}
+
+
+class LogCapture(logging.Handler):
+    """Collect the log lines of a job, to send them back to the client."""
+
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+class JobRunner:
+    """
+    Run entry point jobs one at a time with models from a shared pool.
+
+    Entry points are imported once, so neither imports nor model loading are paid per job.
+    Jobs run in the working directory of the client, and are serialized: they share the
+    models, and a single job already keeps the device busy.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.modules = {entry: importlib.import_module(module) for entry, module in ENTRY_POINTS.items()}
+
+    def run(self, entry, argv, cwd):
+        if entry not in self.modules:
+            raise ValueError(f"Unknown entry point: {entry}")
+        with self.lock:
+            capture = LogCapture()
+            logging.getLogger().addHandler(capture)
+            server_dir = os.getcwd()
+            start = time.perf_counter()
+            error = None
+            stderr = io.StringIO() # Progress bars and argument errors, only read when the job exits early
+            try:
+                os.chdir(cwd)
+                with contextlib.redirect_stderr(stderr):
+                    self.modules[entry].main(argv, self.pool)
+            except SystemExit as e:
+                if e.code: # Invalid arguments
+                    lines = stderr.getvalue().strip().splitlines()
+                    error = lines[-1] if lines else f"Exited with status {e.code}"
+            except Exception as e:
+                error = str(e)
+                logging.getLogger(__name__).error(f"Job failed: {error}")
+            finally:
+                os.chdir(server_dir)
+                logging.getLogger().removeHandler(capture)
+        return {"log": capture.lines, "seconds": time.perf_counter() - start, "error": error}
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """`POST /jobs` runs a job and returns its log; `GET /models` describes the model pool."""
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path != "/models":
+            return self.send_json(404, {"error": f"Not found: {self.path}"})
+        self.send_json(200, self.server.runner.pool.status())
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            return self.send_json(404, {"error": f"Not found: {self.path}"})
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            self.send_json(200, self.server.runner.run(job["entry"], job["argv"], job["cwd"]))
+        except (KeyError, ValueError) as e:
+            self.send_json(400, {"error": str(e)})
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else "unix"
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(address, runner):
+    """Serve jobs on a Unix socket (readable by the current user only) or on a TCP host:port until interrupted."""
+    logger = setup_logger()
+    kind, target = parse_address(address)
+    if kind == "unix":
+        if os.path.exists(target):
+            os.remove(target) # Left behind by a previous server
+        server = UnixHTTPServer(target, RequestHandler)
+        os.chmod(target, stat.S_IRUSR | stat.S_IWUSR)
+    else:
+        server = ThreadingHTTPServer(target, RequestHandler)
+    server.runner = runner
+    logger.info(f"Serving on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if kind == "unix" and os.path.exists(target):
+            os.remove(target)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm inference server for the tracking, counting, speed and open-vocabulary scripts")
+    parser.add_argument("--address", type=str, default=DEFAULT_ADDRESS, help="Unix socket path, or host:port to serve HTTP on (e.g. localhost:8765)")
+    parser.add_argument("--memory-budget-mb", type=int, default=4096, help="Evict least recently used models above this estimated memory")
+    parser.add_argument("--preload", type=str, nargs="*", default=[], help="Models to load and warm up at startup")
+    args = parser.parse_args()
+
+    logger = setup_logger()
+    pool = ModelPool(args.memory_budget_mb * 1024 ** 2)
+    runner = JobRunner(pool)
+    for model_path in args.preload:
+        try:
+            pool.get(model_path)
+        except Exception as e:
+            logger.error(f"Failed to preload {model_path}: {e}")
+    serve(args.address, runner)
+
+
+if __name__ == "__main__":
+    main()
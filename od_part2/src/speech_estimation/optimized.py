@@ -1,25 +1,53 @@
-import cv2 
+import sys
+import time
 import argparse
+from src.client import add_server_arguments, forward_to_server, submit_job
+
+if __name__ == "__main__":
+    forward_to_server("speed") # Hand off --server runs before the heavy imports below
+
+import cv2 
 from tqdm import tqdm
-from ultralytics import solutions
-from src.utils import setup_logger, prepare_video_writer, get_video_properties, save_batch_as_images
+from src.utils import (
+    setup_logger, open_capture, prepare_video_writer, get_video_properties, save_batch_as_images, add_video_io_arguments,
+    video_io_from_args, capture_scale, video_output_path, open_video_writer, seek_capture
+)
+from src.pipeline import (
+    run_pipeline, run_live_pipeline, add_batch_arguments, batch_size_from_args, add_live_arguments, live_options_from_args
+)
+from src.batched_solutions import BatchedSpeedEstimator
+from src.results_store import prepare_results_writer
+from src.events import EventWriter
+from src.roi import region_bounds
+from src.metrics import add_metrics_arguments, metrics_from_args
+from src.backends import add_backend_arguments, model_from_args
+from src.checkpoint import Checkpointer, add_checkpoint_arguments, checkpoint_from_args
+from src.speed import add_speed_arguments, speed_options_from_args
 
 
-def process_batch(speed, batch_frames):
+def process_batch(speed, batch_frames, on_result=None):
     """Process a batch of frames through the speech estimation"""
     try:
-        return [speed.estimate_speed(frame) for frame in batch_frames]
+        return speed.estimate_speed_batch(batch_frames, on_result)
     except Exception as e:
         raise RuntimeError(f"Error processing batch: {str(e)}")
 
 
-def process_video(video_path, output_dir, model_path):
-    """Process video for speed estimation."""
+def process_video(
+    video_path, output_dir, model_path, save_results=False, headless=False, save_keyframes=False, speed_limit=None,
+    batch_size=64, metrics=None, live=None, roi_margin=None, video_io=None, speed_options=None, checkpointing=None,
+    model=None
+):
+    """Process video for speed estimation, with an already loaded `model` if given."""
     logger = setup_logger()
+    out = None
+    results_writer = None
+    event_writer = None
+    checkpoint = None
     
     try:
         # Open video capture
-        cap = cv2.VideoCapture(video_path)
+        cap = open_capture(video_path, live is not None, video_io)
         if not cap.isOpened():
             logger.error(f"Failed to open video: {video_path}")
             return
@@ -27,6 +55,7 @@ def process_video(video_path, output_dir, model_path):
         # Get video properties
         width, height, fps, total_frames = get_video_properties(cap)
         logger.info(f"Video properties: Width={width}, Height={height}, FPS={fps}, Total Frames={total_frames}")
+        fps = fps or 30 # Live streams may not report their frame rate
 
         # thai.mp4 - region points
         speed_region = [
@@ -36,57 +65,162 @@ def process_video(video_path, output_dir, model_path):
             (int(width*0.0), int(height*0.9)) # Bottom left
         ]
         
-        # Prepare output video
-        out, output_path = prepare_video_writer(output_dir, video_path, "speedest_optimized", fps, width, height)
+        # Resume an interrupted run from its last checkpoint; live streams cannot be resumed
+        if checkpointing is not None and live is None:
+            checkpoint = Checkpointer(output_dir, video_path, "speedest_optimized", **checkpointing)
+        start_frame = checkpoint.start_frame if checkpoint is not None else 0
+        resume_from = start_frame if checkpoint is not None else None
         
-        # Init speed estimator
-        speed = solutions.SpeedEstimator(show=False, model=model_path, region=speed_region)
+        # Prepare output file, or only an event stream in headless mode
+        if headless:
+            event_writer = EventWriter(output_dir, video_path, "speedest_optimized", fps, save_keyframes, resume_from)
+        elif checkpoint is not None:
+            # Write segments at every checkpoint, joined once the run completes
+            output_path = video_output_path(output_dir, video_path, "speedest_optimized")
+            out = checkpoint.open_video(lambda path: open_video_writer(path, fps, width, height, video_io))
+        else:
+            out, output_path = prepare_video_writer(output_dir, video_path, "speedest_optimized", fps, width, height, video_io)
+        # Init speed estimator, estimating all tracks at once from their ground positions
+        speed = BatchedSpeedEstimator(
+            show=False, model=model_path, region=speed_region, fps=fps, draw=not headless, pixel_scale=capture_scale(cap),
+            shared_model=model, **(speed_options or {})
+        )
+        speed.metrics = metrics
+        logger.info(f"Speeds in {speed.engine.unit}") # Also the unit of the speed limit
+        if save_results:
+            results_writer, results_dir = prepare_results_writer(
+                output_dir, video_path, "speedest_optimized", resume_from=resume_from, speed_unit=speed.engine.unit
+            )
+        if roi_margin is not None:
+            # Detect only around the speed band
+            speed.roi = region_bounds([speed_region], width, height, roi_margin)
+            logger.info(f"Detecting in ROI {speed.roi}")
+        if start_frame:
+            speed.load_state(checkpoint.state) # Tracks and speed buffers
+            seek_capture(cap, start_frame)
 
         # Process video frames
-        batch_size = 64
-        batch_frames = []
-        frame_count = 0
+        batch_start = time.perf_counter()
+        
+        def process_frames(batch_frames, frame_count):
+            nonlocal batch_start
+            speed.frame_index = frame_count - len(batch_frames) # Source index of the first frame, in case frames were dropped
+            
+            # Export boxes, track IDs, estimated speeds and speed events
+            def record_result(frame_idx, result):
+                frame_index = frame_count - len(batch_frames) + frame_idx
+                if results_writer is not None:
+                    results_writer.add(frame_index, result, speeds={k: float(v) for k, v in speed.spd.items()})
+                if event_writer is not None:
+                    for estimate in speed.new_speeds:
+                        # Only speeding events get a keyframe
+                        if speed_limit is not None and estimate["speed"] > speed_limit:
+                            event_writer.emit("speeding", frame_index, batch_frames[frame_idx], **estimate)
+                        else:
+                            event_writer.emit("speed", frame_index, **estimate)
 
-        logger.info("Starting video processing.")
-        with tqdm(total=total_frames, desc="Processing frames", colour="green") as pbar:
-            while cap.isOpened():
-                success, frame = cap.read()
-                if not success:
-                    break
-                
-                # Collect frames for batch processing
-                frame_count += 1
-                batch_frames.append(frame) 
-                
-                # Process when batch is full or at end of video
-                if len(batch_frames) == batch_size or frame_count == total_frames:
-                    processed_frames = process_batch(speed, batch_frames)
-                    
-                    # Save the batch of processed frames as images
-                    save_batch_as_images(output_dir, processed_frames, frame_count)
-                    
-                    for processed_frame in processed_frames:
-                        out.write(processed_frame)
-                        pbar.update(1)
+            processed_frames = process_batch(speed, batch_frames, record_result)
+            
+            if event_writer is not None:
+                now = time.perf_counter()
+                event_writer.emit(
+                    "metrics", frame_count - 1, tracks=len(speed.track_ids), estimated=len(speed.spd),
+                    processing_fps=round(len(batch_frames) / (now - batch_start), 2)
+                )
+                batch_start = now
+            elif live is None:
+                # Save the batch of processed frames as images
+                save_batch_as_images(output_dir, processed_frames, frame_count - len(processed_frames))
             
+            if checkpoint is not None and checkpoint.due(frame_count):
+                if results_writer is not None:
+                    results_writer.flush() # Results up to the checkpoint must be on disk
+                checkpoint.save(frame_count, speed.state())
+            return processed_frames
+
+        logger.info("Starting video processing.")
+        if metrics is not None:
+            metrics.start()
+        with tqdm(total=total_frames if live is None else None, initial=start_frame, desc="Processing frames", colour="green") as pbar:
+            # Decode, process and encode on overlapping threads
+            write_frame = out.write if out is not None else None
+            if live is None:
+                frame_count = run_pipeline(
+                    cap, process_frames, write_frame, batch_size=batch_size, on_frame=pbar.update, metrics=metrics,
+                    start_frame=start_frame
+                )
+            else:
+                # Drop stale frames instead of queueing them; pace files like a camera
+                frame_count = run_live_pipeline(
+                    cap, process_frames, write_frame, batch_size=batch_size, pace_fps=fps if total_frames > 0 else None,
+                    on_frame=pbar.update, metrics=metrics, **live
+                )
+
         logger.info(f"Processed {frame_count} frames successfully")
+        if checkpoint is not None:
+            checkpoint.finish(output_path if out is not None else None, fps, width, height, video_io)
     except Exception as e:
         logger.error(f"Error processing video: {str(e)}")
     finally:
         # Clean up resources
         cap.release()
-        out.release()
         cv2.destroyAllWindows()
-        logger.info(f"Output video saved to: {output_path}")
+        if out is not None:
+            out.release()
+            logger.info(f"Output video saved to: {output_path}")
+        if event_writer is not None:
+            event_writer.close()
+            logger.info(f"Events saved to: {event_writer.output_path}")
+        if results_writer is not None:
+            results_writer.close()
+            logger.info(f"Results saved to: {results_dir}")
+        if metrics is not None:
+            metrics.close()
 
-def main():
+def main(argv=None, model_pool=None):
     parser = argparse.ArgumentParser(description="Video Object Tracking")
     parser.add_argument("--video-path", type=str, default="data/thai.mp4", help="Path to input video")
     parser.add_argument("--output-dir", type=str, default="output", help="Directory to save the output video")
     parser.add_argument("--model-path", type=str, default="yolo11n.pt", help="Path to YOLO model")
-    args = parser.parse_args()
+    parser.add_argument("--save-results", action="store_true", help="Export per-frame boxes, track IDs and speeds as .npy shards")
+    parser.add_argument("--headless", action="store_true", help="Skip annotation and video encoding; write an event stream instead")
+    parser.add_argument("--save-keyframes", action="store_true", help="In headless mode, save a JPEG of every speeding event")
+    parser.add_argument("--speed-limit", type=float, default=None, help="Speed above which an estimate is reported as speeding, in km/h with --homography and px/s without")
+    add_batch_arguments(parser)
+    add_metrics_arguments(parser)
+    add_live_arguments(parser)
+    parser.add_argument("--roi", action="store_true", help="Only run detection on the bounding box of the regions")
+    parser.add_argument("--roi-margin", type=int, default=64, help="Margin around the regions in ROI mode (px)")
+    add_backend_arguments(parser)
+    add_video_io_arguments(parser)
+    add_checkpoint_arguments(parser)
+    add_server_arguments(parser)
+    add_speed_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.server and model_pool is None:
+        # Run on the warm server instead of loading the model here
+        sys.exit(submit_job(args.server, "speed", sys.argv[1:] if argv is None else argv))
+    
+    model_path = model_from_args(args, args.video_path) # Export once for the ONNX and OpenVINO backends
+    model = model_pool.get(model_path) if model_pool is not None else None # Warm model of the server
     
-    process_video(args.video_path, args.output_dir, args.model_path)
+    process_video(
+        args.video_path, 
+        args.output_dir, 
+        model_path, 
+        args.save_results, 
+        args.headless, 
+        args.save_keyframes, 
+        args.speed_limit, 
+        batch_size_from_args(args), 
+        metrics_from_args(args, "speed"), 
+        live_options_from_args(args), 
+        args.roi_margin if args.roi else None, 
+        video_io_from_args(args), 
+        speed_options_from_args(args), 
+        checkpoint_from_args(args), 
+        model
+    )
 
 
 if __name__ == "__main__":
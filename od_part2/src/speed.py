@@ -0,0 +1,189 @@
+import cv2
+import numpy as np
+from ultralytics.utils import yaml_load
+
+
+def load_homography(path):
+    """
+    Load an image-to-ground homography from a YAML or JSON file.
+
+    Either a 3x3 `matrix`, or at least four `image_points` (source pixels) with the matching
+    `world_points` on the road plane, in meters:
+
+        image_points: [[520, 410], [1390, 410], [1880, 1060], [40, 1060]]
+        world_points: [[0, 0], [14.6, 0], [14.6, 60], [0, 60]]
+    """
+    config = yaml_load(path)
+    if "matrix" in config:
+        return np.asarray(config["matrix"], dtype=np.float64).reshape(3, 3)
+    image_points = np.asarray(config["image_points"], dtype=np.float64).reshape(-1, 2)
+    world_points = np.asarray(config["world_points"], dtype=np.float64).reshape(-1, 2)
+    if len(image_points) < 4 or len(image_points) != len(world_points):
+        raise ValueError("A homography needs at least 4 image points and as many world points")
+    homography, _ = cv2.findHomography(image_points, world_points)
+    if homography is None:
+        raise ValueError(f"Could not fit a homography to the points in {path}")
+    return homography
+
+
+def project_points(points, homography):
+    """Map (N, 2) image points through a 3x3 homography."""
+    projected = np.concatenate((points, np.ones((len(points), 1))), axis=1) @ homography.T
+    return projected[:, :2] / projected[:, 2:]
+
+
+class SpeedEngine:
+    """
+    Estimate the speed of all tracks of a frame in one batched step.
+
+    The last `window` positions and timestamps of every active track are kept in fixed-size
+    ring buffers, one row per track. Each frame, the positions are projected to the ground
+    plane with `homography` (boxes are placed at their bottom center, where they touch the
+    road), and the speed of every track is the slope of a least-squares line through its
+    buffered positions over time, which smooths detection jitter without lagging behind
+    like an average of frame-to-frame speeds. Speeds are in km/h with a homography, and in
+    source pixels per second without one. Tracks unseen for `max_age` seconds free their row,
+    so memory is bounded by the number of concurrent tracks, not by the length of the video.
+
+    `pixel_scale` (x, y) is the scale of the frames relative to the source, when they were
+    downscaled while decoding. The last `window` speed estimates of every track are kept as
+    well, see `series`.
+    """
+
+    def __init__(self, homography=None, window=15, min_samples=5, max_age=2.0, pixel_scale=(1.0, 1.0), capacity=256):
+        self.homography = homography
+        self.window = window
+        self.min_samples = min_samples
+        self.max_age = max_age
+        self.pixel_scale = np.asarray(pixel_scale, dtype=np.float64)
+        self.slots = {} # Track ID to row
+        self.free = []
+        self.track_ids = np.full(0, -1, dtype=np.int64)
+        self.positions = np.zeros((0, window, 2))
+        self.times = np.zeros((0, window))
+        self.speeds = np.full((0, window), np.nan)
+        self.lengths = np.zeros(0, dtype=np.int64)
+        self.heads = np.zeros(0, dtype=np.int64)
+        self.last_seen = np.zeros(0)
+        self.reported = np.zeros(0, dtype=bool)
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        """Add rows to the buffers, up to `capacity` rows."""
+        grow = capacity - len(self.track_ids)
+        self.free.extend(range(capacity - 1, len(self.track_ids) - 1, -1))
+        self.track_ids = np.concatenate((self.track_ids, np.full(grow, -1, dtype=np.int64)))
+        self.positions = np.concatenate((self.positions, np.zeros((grow, self.window, 2))))
+        self.times = np.concatenate((self.times, np.zeros((grow, self.window))))
+        self.speeds = np.concatenate((self.speeds, np.full((grow, self.window), np.nan)))
+        self.lengths = np.concatenate((self.lengths, np.zeros(grow, dtype=np.int64)))
+        self.heads = np.concatenate((self.heads, np.zeros(grow, dtype=np.int64)))
+        self.last_seen = np.concatenate((self.last_seen, np.zeros(grow)))
+        self.reported = np.concatenate((self.reported, np.zeros(grow, dtype=bool)))
+
+    def _evict(self, timestamp):
+        """Free the rows of tracks not seen for more than `max_age` seconds."""
+        stale = np.flatnonzero((self.track_ids >= 0) & (timestamp - self.last_seen > self.max_age))
+        for row in stale.tolist():
+            del self.slots[int(self.track_ids[row])]
+        self.track_ids[stale] = -1
+        self.lengths[stale] = 0
+        self.heads[stale] = 0
+        self.speeds[stale] = np.nan
+        self.reported[stale] = False
+        self.free.extend(stale.tolist())
+
+    def rows(self, track_ids):
+        """Return the buffer rows of the tracks, assigning rows to new tracks."""
+        rows = np.empty(len(track_ids), dtype=np.int64)
+        for i, track_id in enumerate(track_ids):
+            row = self.slots.get(track_id)
+            if row is None:
+                if not self.free:
+                    self._grow(2 * len(self.track_ids))
+                row = self.free.pop()
+                self.slots[track_id] = row
+                self.track_ids[row] = track_id
+            rows[i] = row
+        return rows
+
+    @property
+    def unit(self):
+        """Unit of the speeds: km/h with a homography, source pixels per second without one."""
+        return "km/h" if self.homography is not None else "px/s"
+
+    def ground_points(self, boxes):
+        """Return the points of the boxes to measure speed at, in ground or source pixel coordinates."""
+        if self.homography is None:
+            points = (boxes[:, :2] + boxes[:, 2:]) / 2
+            return points / self.pixel_scale
+        points = np.stack(((boxes[:, 0] + boxes[:, 2]) / 2, boxes[:, 3]), axis=1) # Bottom center
+        return project_points(points / self.pixel_scale, self.homography)
+
+    def update(self, track_ids, boxes, timestamp):
+        """
+        Add the boxes of one frame and estimate the speed of its tracks.
+
+        Parameters:
+            track_ids: (N,) integer track IDs.
+            boxes: (N, 4) xyxy boxes.
+            timestamp (float): Time of the frame in the video, in seconds.
+
+        Returns:
+            tuple: Speeds (N,), NaN for tracks with fewer than `min_samples` positions, and the
+                buffer rows of the tracks.
+        """
+        self._evict(timestamp)
+        track_ids = [int(track_id) for track_id in track_ids]
+        if not track_ids:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+        rows = self.rows(track_ids)
+        heads = self.heads[rows]
+        self.positions[rows, heads] = self.ground_points(np.asarray(boxes, dtype=np.float64).reshape(-1, 4))
+        self.times[rows, heads] = timestamp
+        self.lengths[rows] = np.minimum(self.lengths[rows] + 1, self.window)
+        self.last_seen[rows] = timestamp
+
+        # Least-squares velocity of each track over its buffered samples
+        valid = np.arange(self.window)[None, :] < self.lengths[rows, None]
+        times = np.where(valid, self.times[rows] - timestamp, 0.0) # Relative times keep precision on long videos
+        counts = valid.sum(axis=1)
+        time_mean = times.sum(axis=1) / counts
+        position_mean = (self.positions[rows] * valid[..., None]).sum(axis=1) / counts[:, None]
+        dt = np.where(valid, times - time_mean[:, None], 0.0)
+        covariance = (dt[..., None] * (self.positions[rows] - position_mean[:, None])).sum(axis=1)
+        variance = (dt ** 2).sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            speeds = np.linalg.norm(covariance, axis=1) / variance
+        speeds[(counts < self.min_samples) | (variance <= 0)] = np.nan
+        if self.homography is not None:
+            speeds *= 3.6 # m/s to km/h
+
+        self.speeds[rows, heads] = speeds
+        self.heads[rows] = (heads + 1) % self.window
+        return speeds, rows
+
+    def series(self, track_id):
+        """Return the timestamps and speeds of the last `window` estimates of an active track, oldest first."""
+        row = self.slots.get(track_id)
+        if row is None:
+            return np.zeros(0), np.zeros(0)
+        order = (self.heads[row] + np.arange(self.window)) % self.window
+        order = order[self.window - self.lengths[row]:]
+        return self.times[row, order], self.speeds[row, order]
+
+
+def add_speed_arguments(parser):
+    """Add the speed estimation command line flags."""
+    parser.add_argument("--homography", type=str, default=None, help="YAML or JSON image-to-ground calibration; speeds in km/h")
+    parser.add_argument("--speed-window", type=int, default=15, help="Positions per track used to fit its speed")
+    parser.add_argument("--speed-min-samples", type=int, default=5, help="Positions needed before a speed is reported")
+
+
+def speed_options_from_args(args):
+    """Return the speed engine options from the command line flags."""
+    return {
+        "homography": load_homography(args.homography) if args.homography else None,
+        "window": args.speed_window,
+        "min_samples": args.speed_min_samples,
+    }
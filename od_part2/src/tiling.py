@@ -0,0 +1,148 @@
+import torch
+from ultralytics.engine.results import Results
+
+
+def tile_starts(length, tile_size, step):
+    """Start offsets of tiles covering `length`; the last tile is aligned to the end."""
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, step))
+    return starts + [length - tile_size]
+
+
+def tile_grid(width, height, tile_size=640, overlap=0.2):
+    """Return the (x1, y1, x2, y2) windows of overlapping tiles covering a frame."""
+    step = max(1, int(tile_size * (1 - overlap)))
+    return [
+        (x, y, min(x + tile_size, width), min(y + tile_size, height))
+        for y in tile_starts(height, tile_size, step)
+        for x in tile_starts(width, tile_size, step)
+    ]
+
+
+def merge_boxes(boxes, threshold=0.5, fuse=True):
+    """
+    Merge duplicate detections of objects seen by several tiles, in one vectorized pass.
+
+    `boxes` are (x1, y1, x2, y2, conf, cls) rows in frame coordinates. A box is dropped when
+    a higher-confidence box of the same class overlaps it by more than `threshold` (all pairs
+    are compared at once, as in Fast NMS). With `fuse`, overlap is measured as intersection
+    over the smaller box and each kept box grows to the union of the boxes it absorbed, so
+    halves of an object cut by a tile border become one box. Without it, this is class-aware
+    NMS on IoU.
+    """
+    if len(boxes) < 2:
+        return boxes
+
+    boxes = boxes[boxes[:, 4].argsort(descending=True)]
+    xyxy = boxes[:, :4]
+    area = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+    top_left = torch.max(xyxy[:, None, :2], xyxy[None, :, :2])
+    bottom_right = torch.min(xyxy[:, None, 2:], xyxy[None, :, 2:])
+    inter = (bottom_right - top_left).clamp(min=0).prod(2)
+    if fuse:
+        overlap = inter / torch.min(area[:, None], area[None, :]).clamp(min=1e-6)
+    else:
+        overlap = inter / (area[:, None] + area[None, :] - inter).clamp(min=1e-6)
+
+    # matches[i, j]: box i has higher confidence than box j and covers the same object
+    matches = (overlap > threshold) & (boxes[:, None, 5] == boxes[None, :, 5])
+    matches = matches.triu(diagonal=1)
+    keep = ~matches.any(dim=0)
+    if not fuse:
+        return boxes[keep]
+
+    # Each box joins the first (most confident) kept box that matches it, or its own group
+    owners = matches & keep[:, None]
+    owner = torch.where(owners.any(dim=0), owners.byte().argmax(dim=0), torch.arange(len(boxes), device=boxes.device))
+    fused = boxes.clone()
+    index = owner[:, None].expand(-1, 2)
+    fused[:, :2] = fused[:, :2].scatter_reduce(0, index, xyxy[:, :2], reduce="amin")
+    fused[:, 2:4] = fused[:, 2:4].scatter_reduce(0, index, xyxy[:, 2:], reduce="amax")
+    return fused[keep]
+
+
+class TiledDetector:
+    """
+    Run a YOLO model on overlapping tiles of each frame, for small objects in high-resolution footage.
+
+    Supports the `predict` and `names` interface used by the pipelines, so it can replace
+    the model of `StrideTracker` or a batched solution, which own the trackers. The tiles of all frames are
+    detected together, in batches of at most `max_batch` tiles, and their boxes are merged
+    per frame with `merge_boxes` before they reach the tracker. With `full_frame`, the
+    downscaled full frame is detected as an extra tile, so large objects that no tile
+    contains entirely are still found.
+    """
+
+    def __init__(self, model, tile_size=640, overlap=0.2, full_frame=False, fuse=True, merge_threshold=0.5, max_batch=32):
+        self.model = model
+        self.names = model.names
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.full_frame = full_frame
+        self.fuse = fuse
+        self.merge_threshold = merge_threshold
+        self.max_batch = max_batch
+        self.grids = {}
+
+    def windows(self, frame):
+        """Return the windows to detect in a frame, cached per frame size."""
+        height, width = frame.shape[:2]
+        if (width, height) not in self.grids:
+            windows = tile_grid(width, height, self.tile_size, self.overlap)
+            if self.full_frame and windows != [(0, 0, width, height)]:
+                windows.append((0, 0, width, height))
+            self.grids[(width, height)] = windows
+        return self.grids[(width, height)]
+
+    def predict(self, source, **kwargs):
+        frames = source if isinstance(source, list) else [source]
+        crops, owners = [], []
+        for frame_idx, frame in enumerate(frames):
+            for window in self.windows(frame):
+                x1, y1, x2, y2 = window
+                crops.append(frame[y1:y2, x1:x2])
+                owners.append((frame_idx, window))
+
+        tile_results = []
+        for start in range(0, len(crops), self.max_batch):
+            tile_results += self.model.predict(crops[start:start + self.max_batch], **kwargs)
+
+        # Move the tile boxes to frame coordinates and group them by frame
+        frame_boxes = [[] for _ in frames]
+        speeds = [{"preprocess": 0.0, "inference": 0.0, "postprocess": 0.0} for _ in frames]
+        for result, (frame_idx, (x1, y1, _, _)) in zip(tile_results, owners):
+            data = result.boxes.data
+            frame_boxes[frame_idx].append(data + torch.tensor([x1, y1, x1, y1, 0, 0], dtype=data.dtype, device=data.device))
+            for name in speeds[frame_idx]:
+                speeds[frame_idx][name] += result.speed[name] or 0.0
+
+        results = []
+        for frame, boxes, speed in zip(frames, frame_boxes, speeds):
+            boxes = merge_boxes(torch.cat(boxes), self.merge_threshold, self.fuse)
+            result = Results(frame, path="", names=self.names, boxes=boxes)
+            result.speed = speed
+            results.append(result)
+        return results
+
+
+def add_tiling_arguments(parser):
+    """Add the tiled inference command line flags shared by the pipelines."""
+    parser.add_argument("--tile-size", type=int, default=None, help="Detect on overlapping tiles of this size (px)")
+    parser.add_argument("--tile-overlap", type=float, default=0.2, help="Overlap between neighbouring tiles (0-1)")
+    parser.add_argument("--tile-full-frame", action="store_true", help="Also detect on the full frame, for large objects")
+    parser.add_argument("--tile-merge", type=str, default="fuse", choices=["fuse", "nms"], help="How to merge boxes across tiles")
+    parser.add_argument("--tile-merge-threshold", type=float, default=0.5, help="Overlap above which boxes across tiles are merged")
+
+
+def tiling_from_args(args):
+    """Return the tiled inference options from the shared flags, or None when tiling is disabled."""
+    if args.tile_size is None:
+        return None
+    return {
+        "tile_size": args.tile_size,
+        "overlap": args.tile_overlap,
+        "full_frame": args.tile_full_frame,
+        "fuse": args.tile_merge == "fuse",
+        "merge_threshold": args.tile_merge_threshold,
+    }
@@ -0,0 +1,88 @@
+import numpy as np
+
+
+class TrackHistory:
+    """
+    Movement history of tracked objects stored in preallocated NumPy ring buffers.
+
+    Every active track owns one slot of a shared `(capacity, 2 * history_length, 2)` buffer.
+    Each point is written twice, `history_length` positions apart, so the latest points of a
+    track are always one contiguous slice and can be handed to `cv2.polylines` without a copy.
+    Slots of tracks that have not been seen for `max_age` frames are released and reused.
+    """
+
+    def __init__(self, history_length=120, max_age=None, capacity=256, dtype=np.int32):
+        self.history_length = history_length
+        self.max_age = history_length if max_age is None else max_age
+        self.points = np.zeros((capacity, 2 * history_length, 2), dtype=dtype)
+        self.heads = np.zeros(capacity, dtype=np.int64) # Number of points written per slot
+        self.last_seen = np.zeros(capacity, dtype=np.int64) # Frame each slot was last updated
+        self.active = np.zeros(capacity, dtype=bool)
+        self.slot_ids = np.full(capacity, -1, dtype=np.int64) # Track ID owning each slot
+        self.slots = {} # Track ID -> slot
+        self.free_slots = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, track_id):
+        return track_id in self.slots
+
+    def _grow(self):
+        """Double the number of slots."""
+        capacity = len(self.heads)
+        self.points = np.concatenate([self.points, np.zeros_like(self.points)])
+        self.heads = np.concatenate([self.heads, np.zeros_like(self.heads)])
+        self.last_seen = np.concatenate([self.last_seen, np.zeros_like(self.last_seen)])
+        self.active = np.concatenate([self.active, np.zeros_like(self.active)])
+        self.slot_ids = np.concatenate([self.slot_ids, np.full_like(self.slot_ids, -1)])
+        self.free_slots.extend(range(2 * capacity - 1, capacity - 1, -1))
+
+    def _acquire(self, track_id):
+        """Return the slot of a track, assigning a free one to new tracks."""
+        slot = self.slots.get(track_id)
+        if slot is None:
+            if not self.free_slots:
+                self._grow()
+            slot = self.free_slots.pop()
+            self.slots[track_id] = slot
+            self.slot_ids[slot] = track_id
+            self.heads[slot] = 0
+            self.active[slot] = True
+        return slot
+
+    def update(self, track_ids, centers, frame_index):
+        """Append the centers of the tracks seen in a frame and expire inactive tracks."""
+        if len(track_ids):
+            slots = np.fromiter((self._acquire(track_id) for track_id in track_ids), dtype=np.int64, count=len(track_ids))
+            positions = self.heads[slots] % self.history_length
+            centers = np.asarray(centers)
+            self.points[slots, positions] = centers
+            self.points[slots, positions + self.history_length] = centers
+            self.heads[slots] += 1
+            self.last_seen[slots] = frame_index
+        self.expire(frame_index)
+
+    def expire(self, frame_index):
+        """Release the slots of tracks not seen for more than `max_age` frames."""
+        stale = np.flatnonzero(self.active & (frame_index - self.last_seen > self.max_age))
+        if not len(stale):
+            return
+
+        self.active[stale] = False
+        for slot in stale.tolist():
+            del self.slots[int(self.slot_ids[slot])]
+            self.free_slots.append(slot)
+        self.slot_ids[stale] = -1
+
+    def track(self, track_id):
+        """Return a view of the stored points of a track, oldest first, with shape (n, 2)."""
+        slot = self.slots[track_id]
+        head = int(self.heads[slot])
+        length = min(head, self.history_length)
+        end = (head - 1) % self.history_length + self.history_length + 1
+        return self.points[slot, end - length:end]
+
+    def polylines(self, track_ids):
+        """Return the points of each track as views shaped for `cv2.polylines`."""
+        return [self.track(track_id).reshape((-1, 1, 2)) for track_id in track_ids if track_id in self.slots]
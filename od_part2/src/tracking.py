@@ -0,0 +1,143 @@
+import time
+import cv2
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+from ultralytics.trackers.basetrack import BaseTrack
+from ultralytics.trackers.track import TRACKER_MAP
+from ultralytics.utils import IterableSimpleNamespace, yaml_load
+from ultralytics.utils.checks import check_yaml
+
+
+def load_tracker(tracker="botsort.yaml", frame_rate=30):
+    """Create a BoT-SORT or ByteTrack tracker from an Ultralytics tracker config."""
+    cfg = IterableSimpleNamespace(**yaml_load(check_yaml(tracker)))
+    if cfg.tracker_type not in TRACKER_MAP:
+        raise ValueError(f"Unsupported tracker type: {cfg.tracker_type}")
+    return TRACKER_MAP[cfg.tracker_type](args=cfg, frame_rate=frame_rate)
+
+
+def tracker_state(tracker):
+    """
+    Return a picklable snapshot of a tracker.
+
+    Track IDs come from a counter shared by all trackers, which is saved too, so a restored
+    tracker never hands out an ID again.
+    """
+    return {"tracker": tracker, "next_id": BaseTrack._count}
+
+
+def restore_tracker(state):
+    """Return the tracker of a `tracker_state` snapshot and restore the track ID counter."""
+    BaseTrack._count = max(BaseTrack._count, state["next_id"])
+    return state["tracker"]
+
+
+def update_tracks(tracker, result):
+    """Update the tracker with a detection result and return the result with track IDs, like `model.track`."""
+    det = result.boxes.cpu().numpy()
+    if len(det) == 0:
+        return result
+
+    tracks = tracker.update(det, result.orig_img)
+    if len(tracks) == 0:
+        return result
+
+    idx = tracks[:, -1].astype(int)
+    result = result[idx]
+    result.update(boxes=torch.as_tensor(tracks[:, :-1]))
+    return result
+
+
+def predict_tracks(tracker, frame, names):
+    """Advance all tracks by one frame with the tracker's motion model and return them as a result."""
+    tracker.multi_predict(tracker.joint_stracks(tracker.tracked_stracks, tracker.lost_stracks))
+    tracks = [track.result[:-1] for track in tracker.tracked_stracks if track.is_activated]
+    boxes = torch.as_tensor(np.asarray(tracks, dtype=np.float32).reshape(-1, 7))
+    return Results(frame, path="", names=names, boxes=boxes)
+
+
+def motion_energy(reference, frame, size=(160, 90)):
+    """Mean absolute difference between two frames on a small grayscale thumbnail, in [0, 1]."""
+    thumbnails = [
+        cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), size, interpolation=cv2.INTER_AREA)
+        for image in (reference, frame)
+    ]
+    return float(cv2.absdiff(*thumbnails).mean()) / 255.0
+
+
+class StrideTracker:
+    """
+    Track objects while running the detector only on keyframes.
+
+    A frame is a keyframe every `stride` frames, or earlier when its motion energy against the
+    last keyframe exceeds `motion_threshold`. Keyframes are detected in one batch and fed to the
+    tracker; on the frames in between, tracks are moved with the tracker's Kalman motion model,
+    so every frame still gets boxes and track IDs. With `stride=1` this is equivalent to
+    `model.track(..., persist=True)`, including its lower default confidence of 0.1, which lets
+    the tracker's second association see low-score boxes. Set `metrics` to record detection
+    and tracking times.
+    """
+
+    def __init__(self, model, tracker="botsort.yaml", stride=1, motion_threshold=None, frame_rate=30, **predict_args):
+        self.model = model
+        self.metrics = None
+        self.tracker = load_tracker(tracker, frame_rate)
+        self.stride = max(1, stride)
+        self.motion_threshold = motion_threshold
+        self.predict_args = predict_args
+        self.predict_args["conf"] = predict_args.get("conf") or 0.1 # The default of `model.track`
+        self.frames_since_keyframe = None
+        self.keyframe = None
+
+    def is_keyframe(self, frame):
+        """Decide whether the detector should run on the frame."""
+        if self.frames_since_keyframe is None or self.frames_since_keyframe + 1 >= self.stride:
+            is_keyframe = True
+        elif self.motion_threshold is not None:
+            is_keyframe = motion_energy(self.keyframe, frame) > self.motion_threshold
+        else:
+            is_keyframe = False
+
+        if is_keyframe:
+            self.frames_since_keyframe = 0
+            if self.motion_threshold is not None:
+                self.keyframe = frame
+        else:
+            self.frames_since_keyframe += 1
+        return is_keyframe
+
+    def track(self, batch_frames):
+        """Return one tracked result per frame, in order."""
+        keyframe_flags = [self.is_keyframe(frame) for frame in batch_frames]
+        keyframes = [frame for frame, is_keyframe in zip(batch_frames, keyframe_flags) if is_keyframe]
+        start = time.perf_counter()
+        detections = self.model.predict(keyframes, **self.predict_args) if keyframes else []
+        if self.metrics is not None:
+            self.metrics.observe_results(detections, time.perf_counter() - start, "postprocess")
+
+        start = time.perf_counter()
+        detections = iter(detections)
+        results = []
+        for frame, is_keyframe in zip(batch_frames, keyframe_flags):
+            if is_keyframe:
+                results.append(update_tracks(self.tracker, next(detections)))
+            else:
+                results.append(predict_tracks(self.tracker, frame, self.model.names))
+        if self.metrics is not None:
+            self.metrics.observe("tracking", time.perf_counter() - start, len(batch_frames))
+        return results
+
+    def state(self):
+        """Return the tracks and keyframe schedule, to checkpoint a run."""
+        return {
+            "tracker": tracker_state(self.tracker),
+            "frames_since_keyframe": self.frames_since_keyframe,
+            "keyframe": self.keyframe,
+        }
+
+    def load_state(self, state):
+        """Continue from a `state` snapshot."""
+        self.tracker = restore_tracker(state["tracker"])
+        self.frames_since_keyframe = state["frames_since_keyframe"]
+        self.keyframe = state["keyframe"]
@@ -1,35 +1,413 @@
+import itertools
+import json
 import logging
+import shutil
+import subprocess
+from fractions import Fraction
 import cv2
+import numpy as np
 import os
 
 
+VIDEO_BACKENDS = ("opencv", "pyav", "ffmpeg")
+NTSC_FRAME_RATES = (Fraction(24000, 1001), Fraction(30000, 1001), Fraction(60000, 1001))
+
+
 def setup_logger():
     """Set up the logger for debugging."""
     logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
     return logging.getLogger(__name__)
 
 
+def decoded_size(width, height, decode_size=None):
+    """Frame size after scaling the longer side down to `decode_size` (even, never upscaled)."""
+    if not decode_size or max(width, height) <= decode_size:
+        return width, height
+    scale = decode_size / max(width, height)
+    return max(2, round(width * scale / 2) * 2), max(2, round(height * scale / 2) * 2)
+
+
+class ScaledCapture:
+    """OpenCV capture that resizes frames after decoding, the fallback for `decode_size` without PyAV or ffmpeg."""
+
+    def __init__(self, cap, decode_size):
+        self.cap = cap
+        source_width, source_height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.width, self.height = decoded_size(source_width, source_height, decode_size)
+        self.scale = (self.width / source_width, self.height / source_height) if source_width else (1.0, 1.0)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        ret, frame = self.cap.read()
+        if ret and frame.shape[1] != self.width:
+            frame = cv2.resize(frame, (self.width, self.height), interpolation=cv2.INTER_AREA)
+        return ret, frame
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        return self.cap.get(prop)
+
+    def set(self, prop, value):
+        return self.cap.set(prop, value)
+
+    def release(self):
+        self.cap.release()
+
+
+class PyAVCapture:
+    """
+    Read a video with PyAV, a drop-in for `cv2.VideoCapture` in the pipelines.
+
+    Frames are decoded with FFmpeg's frame and slice threading, and scaled and converted to
+    BGR in a single swscale pass, so downscaling to the model input size costs less than
+    the color conversion alone at full size. The frame rate is exact (`frame_rate`).
+    """
+
+    def __init__(self, source, decode_size=None, threads=0, live=False):
+        import av
+
+        options = {"fflags": "nobuffer", "flags": "low_delay"} if live else {}
+        self.container = av.open(source, options=options)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = "AUTO"
+        self.stream.codec_context.thread_count = threads
+        source_width, source_height = self.stream.codec_context.width, self.stream.codec_context.height
+        self.width, self.height = decoded_size(source_width, source_height, decode_size)
+        self.scale = (self.width / source_width, self.height / source_height)
+        self.frame_rate = self.stream.average_rate or self.stream.guessed_rate or Fraction(0)
+        self.total_frames = self.stream.frames
+        self.frames = self.container.decode(self.stream)
+        self.opened = True
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        frame = next(self.frames, None) if self.opened else None
+        if frame is None:
+            self.opened = False
+            return False, None
+        return True, frame.to_ndarray(format="bgr24", width=self.width, height=self.height, interpolation="AREA")
+
+    def get(self, prop):
+        return {
+            cv2.CAP_PROP_FRAME_WIDTH: self.width,
+            cv2.CAP_PROP_FRAME_HEIGHT: self.height,
+            cv2.CAP_PROP_FPS: float(self.frame_rate),
+            cv2.CAP_PROP_FRAME_COUNT: self.total_frames,
+        }.get(prop, 0)
+
+    def set(self, prop, value):
+        if prop != cv2.CAP_PROP_POS_FRAMES or not self.frame_rate:
+            return False
+        # Seek to the keyframe before the frame, then decode up to it
+        time_base = self.stream.time_base
+        target = (self.stream.start_time or 0) + int(Fraction(int(value)) / self.frame_rate / time_base)
+        half_frame = int(1 / (2 * self.frame_rate * time_base))
+        self.container.seek(target, stream=self.stream, backward=True)
+        frames = self.container.decode(self.stream)
+        self.frames = iter(())
+        for frame in frames:
+            if frame.pts is None or frame.pts >= target - half_frame:
+                self.frames = itertools.chain([frame], frames)
+                break
+        self.opened = True
+        return True
+
+    def release(self):
+        self.opened = False
+        self.container.close()
+
+
+class FFmpegCapture:
+    """
+    Read a video from an `ffmpeg` subprocess, a drop-in for `cv2.VideoCapture` in the pipelines.
+
+    Decoding and scaling run multithreaded in a separate process, so they overlap with
+    inference without holding the GIL. Each frame is read straight from the pipe into its
+    own array, without intermediate copies. The frame rate is exact (`frame_rate`).
+    """
+
+    def __init__(self, source, decode_size=None, threads=0, live=False):
+        probe = json.loads(subprocess.run(
+            [
+                "ffprobe", "-v", "error", "-select_streams", "v:0", "-of", "json",
+                "-show_entries", "stream=width,height,avg_frame_rate,r_frame_rate,nb_frames", source
+            ],
+            capture_output=True, check=True, text=True
+        ).stdout)["streams"][0]
+        source_width, source_height = probe["width"], probe["height"]
+        self.width, self.height = decoded_size(source_width, source_height, decode_size)
+        self.scale = (self.width / source_width, self.height / source_height)
+        rate = probe.get("avg_frame_rate", "0/0")
+        self.frame_rate = Fraction(rate) if not rate.endswith("/0") else Fraction(probe.get("r_frame_rate", "0/1"))
+        self.total_frames = int(probe.get("nb_frames", 0) or 0)
+
+        self.source = source
+        self.threads = threads
+        self.live = live
+        self.scaled = (self.width, self.height) != (source_width, source_height)
+        self.frame_bytes = self.width * self.height * 3
+        self.process = None
+        self._start()
+
+    def _start(self, start_frame=0):
+        """Start decoding, from `start_frame` on."""
+        command = ["ffmpeg", "-v", "error", "-nostdin", "-threads", str(self.threads)]
+        if self.live:
+            command += ["-fflags", "nobuffer", "-flags", "low_delay"]
+        if start_frame:
+            command += ["-ss", str(float(start_frame / self.frame_rate))] # Frame accurate, since the input is decoded
+        command += ["-i", self.source, "-map", "0:v:0"]
+        if self.scaled:
+            command += ["-vf", f"scale={self.width}:{self.height}:flags=area"]
+        command += ["-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1"]
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=self.frame_bytes)
+        self.opened = True
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        if not self.opened:
+            return False, None
+        frame = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        if self.process.stdout.readinto(memoryview(frame).cast("B")) != self.frame_bytes:
+            self.opened = False
+            return False, None
+        return True, frame
+
+    def get(self, prop):
+        return {
+            cv2.CAP_PROP_FRAME_WIDTH: self.width,
+            cv2.CAP_PROP_FRAME_HEIGHT: self.height,
+            cv2.CAP_PROP_FPS: float(self.frame_rate),
+            cv2.CAP_PROP_FRAME_COUNT: self.total_frames,
+        }.get(prop, 0)
+
+    def set(self, prop, value):
+        if prop != cv2.CAP_PROP_POS_FRAMES or not self.frame_rate:
+            return False
+        self.release()
+        self._start(int(value))
+        return True
+
+    def release(self):
+        self.opened = False
+        self.process.stdout.close()
+        self.process.kill()
+        self.process.wait()
+
+
+def open_capture(source, live=False, video_io=None):
+    """
+    Open a video file, stream URL or camera index; live sources buffer as few frames as possible.
+
+    `video_io` (see `video_io_from_args`) selects the reader: OpenCV (the default), PyAV or an
+    ffmpeg subprocess, and the size frames are scaled down to while decoding. Camera indices
+    are always opened with OpenCV.
+    """
+    video_io = video_io or {}
+    backend = video_io.get("backend", "opencv")
+    decode_size = video_io.get("decode_size")
+    if backend != "opencv" and not str(source).isdigit():
+        capture = PyAVCapture if backend == "pyav" else FFmpegCapture
+        return capture(source, decode_size, video_io.get("threads", 0), live)
+
+    cap = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+    if live:
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return ScaledCapture(cap, decode_size) if decode_size else cap
+
+
+def capture_scale(cap):
+    """Scale (x, y) of decoded frames relative to the source, for coordinates given in source pixels."""
+    return getattr(cap, "scale", (1.0, 1.0))
+
+
+def frame_rate(cap):
+    """Exact frame rate of a capture as a fraction, e.g. 30000/1001 for 29.97 fps sources."""
+    rate = getattr(cap, "frame_rate", None)
+    return Fraction(rate) if rate is not None else as_frame_rate(cap.get(cv2.CAP_PROP_FPS))
+
+
+def as_frame_rate(fps):
+    """Recover the rational frame rate of a float, such as 30000/1001 from 29.97002997 or 29.97."""
+    rate = Fraction(fps).limit_denominator(1001)
+    for ntsc_rate in NTSC_FRAME_RATES:
+        if abs(rate - ntsc_rate) < ntsc_rate * Fraction(1, 10000): # Containers often round NTSC rates
+            return ntsc_rate
+    return rate
+
+
 def get_video_properties(cap):
     """Extract video properties from capture object."""
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
+    fps = float(frame_rate(cap)) # Not rounded, so timestamps do not drift on 29.97 fps sources
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     return width, height, fps, total_frames
 
 
-def prepare_video_writer(output_dir, video_path, suffix, fps, width, height):
-    """Prepares a cv2.VideoWriter object for saving the output video."""
+def seek_capture(cap, frame_index):
+    """Position a capture at a frame, decoding and dropping frames when it cannot seek."""
+    if frame_index <= 0 or cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index):
+        return
+    for _ in range(frame_index):
+        if not cap.read()[0]:
+            break
+
+
+class PyAVWriter:
+    """Encode H.264 with PyAV (libx264, frame threads), a drop-in for `cv2.VideoWriter`."""
+
+    def __init__(self, output_path, fps, width, height, preset="veryfast", crf=23, threads=0):
+        import av
+
+        self.av = av
+        self.container = av.open(output_path, "w")
+        rate = as_frame_rate(fps)
+        self.stream = self.container.add_stream("libx264", rate=rate, options={"preset": preset, "crf": str(crf)})
+        self.stream.width, self.stream.height = width, height
+        self.stream.pix_fmt = "yuv420p"
+        self.stream.thread_type = "AUTO"
+        self.stream.codec_context.thread_count = threads
+        self.stream.codec_context.time_base = 1 / rate
+        self.frame_index = 0
+
+    def write(self, frame):
+        video_frame = self.av.VideoFrame.from_ndarray(frame, format="bgr24")
+        video_frame.pts = self.frame_index
+        video_frame.time_base = self.stream.codec_context.time_base
+        self.frame_index += 1
+        self.container.mux(self.stream.encode(video_frame))
+
+    def release(self):
+        self.container.mux(self.stream.encode(None)) # Flush delayed frames
+        self.container.close()
+
+
+class FFmpegWriter:
+    """Encode H.264 in an `ffmpeg` subprocess (libx264, all cores), a drop-in for `cv2.VideoWriter`."""
+
+    def __init__(self, output_path, fps, width, height, preset="veryfast", crf=23, threads=0):
+        rate = as_frame_rate(fps)
+        command = [
+            "ffmpeg", "-v", "error", "-y", "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}",
+            "-framerate", f"{rate.numerator}/{rate.denominator}", "-i", "pipe:0",
+            "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", # yuv420p needs even dimensions
+            "-c:v", "libx264", "-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p", "-threads", str(threads),
+            "-movflags", "+faststart", output_path
+        ]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        self.process.stdin.write(memoryview(np.ascontiguousarray(frame)).cast("B")) # No copy for contiguous frames
+
+    def release(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with code {self.process.returncode}")
+
+
+def video_output_path(output_dir, video_path, suffix):
+    """Path of the output video of a run."""
     os.makedirs(output_dir, exist_ok=True)
     video_name = os.path.splitext(os.path.basename(video_path))[0]
-    output_path = os.path.join(output_dir, f"{video_name}_{suffix}.mp4")
-    writer = cv2.VideoWriter(
+    return os.path.join(output_dir, f"{video_name}_{suffix}.mp4")
+
+
+def open_video_writer(output_path, fps, width, height, video_io=None):
+    """
+    Open a video writer.
+
+    With the default `video_io`, this is a cv2.VideoWriter (mp4v). The PyAV and ffmpeg
+    backends encode H.264 on all cores with the configured preset and CRF, at the exact
+    rational frame rate.
+    """
+    video_io = video_io or {}
+    backend = video_io.get("backend", "opencv")
+    if backend != "opencv":
+        writer_class = PyAVWriter if backend == "pyav" else FFmpegWriter
+        return writer_class(
+            output_path, fps, width, height, video_io.get("preset", "veryfast"), video_io.get("crf", 23), video_io.get("threads", 0)
+        )
+
+    return cv2.VideoWriter(
         output_path, 
         cv2.VideoWriter_fourcc(*"mp4v"), 
         fps, 
         (width, height)
     )
-    return writer, output_path
+
+
+def prepare_video_writer(output_dir, video_path, suffix, fps, width, height, video_io=None):
+    """Prepares a video writer for saving the output video, see `open_video_writer`."""
+    output_path = video_output_path(output_dir, video_path, suffix)
+    return open_video_writer(output_path, fps, width, height, video_io), output_path
+
+
+def concat_segments(segment_paths, output_path, fps, width, height, video_io=None):
+    """Join segment videos, without re-encoding when ffmpeg is available."""
+    if shutil.which("ffmpeg"):
+        list_path = f"{output_path}.txt"
+        with open(list_path, "w") as f:
+            f.writelines(f"file '{os.path.abspath(path)}'\n" for path in segment_paths)
+        subprocess.run(
+            ["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", output_path],
+            check=True,
+        )
+        os.remove(list_path)
+        return
+
+    out = open_video_writer(output_path, fps, width, height, video_io)
+    try:
+        for path in segment_paths:
+            cap = cv2.VideoCapture(path)
+            while True:
+                success, frame = cap.read()
+                if not success:
+                    break
+                out.write(frame)
+            cap.release()
+    finally:
+        out.release()
+
+
+def add_video_io_arguments(parser):
+    """Add the video decoding and encoding command line flags shared by the pipelines."""
+    parser.add_argument("--video-io", type=str, default="opencv", choices=VIDEO_BACKENDS, help="Video reader and writer backend")
+    parser.add_argument("--decode-size", type=int, default=None, help="Scale frames down to this longer side while decoding, e.g. the model input size")
+    parser.add_argument("--io-threads", type=int, default=0, help="Decoder and encoder threads for PyAV and ffmpeg (0: all cores)")
+    parser.add_argument("--preset", type=str, default="veryfast", help="x264 preset of the PyAV and ffmpeg writers")
+    parser.add_argument("--crf", type=int, default=23, help="x264 constant rate factor of the PyAV and ffmpeg writers (lower is better)")
+
+
+def video_io_from_args(args):
+    """Return the video I/O options from the shared flags, or None for plain OpenCV."""
+    if args.video_io == "opencv" and args.decode_size is None:
+        return None
+    if args.video_io == "pyav":
+        try:
+            import av # noqa: F401
+        except ImportError:
+            setup_logger().warning("PyAV is not installed (pip install av); falling back to OpenCV")
+            args.video_io = "opencv"
+    elif args.video_io == "ffmpeg" and (shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None):
+        setup_logger().warning("ffmpeg/ffprobe not found on PATH; falling back to OpenCV")
+        args.video_io = "opencv"
+    return {
+        "backend": args.video_io,
+        "decode_size": args.decode_size,
+        "threads": args.io_threads,
+        "preset": args.preset,
+        "crf": args.crf,
+    }
 
 
 def save_batch_as_images(output_dir, batch_frames, start_index):
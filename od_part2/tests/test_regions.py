@@ -0,0 +1,125 @@
+import pickle
+import numpy as np
+import pytest
+import torch
+from shapely.geometry import LineString, Point, Polygon
+from ultralytics import solutions
+from ultralytics.engine.results import Results
+from src.batched_solutions import BatchedObjectCounter
+from src.regions import RegionCounter
+
+
+NAMES = {0: "car", 1: "truck", 2: "bus"}
+REGIONS = {
+    "vertical_line": [(320, 0), (320, 480)],
+    "horizontal_line": [(0, 250), (640, 250)],
+    "diagonal_line": [(100, 100), (500, 400)],
+    "tall_box": [(400, 50), (480, 50), (480, 450), (400, 450)],
+    "wide_box": [(50, 300), (600, 300), (600, 380), (50, 380)],
+    "concave": [(100, 50), (300, 50), (300, 200), (200, 120), (100, 200)],
+}
+
+
+class StubModel:
+    names = NAMES
+
+
+def synthetic_frames(num_frames=120, num_tracks=60, seed=0):
+    """Per frame, the (N, 4) boxes, track IDs and classes of tracks moving in straight lines, with dropouts."""
+    rng = np.random.default_rng(seed)
+    start = rng.uniform((0, 0), (640, 480), size=(num_tracks, 2))
+    velocity = rng.uniform(-12, 12, size=(num_tracks, 2))
+    first = rng.integers(0, num_frames // 2, num_tracks)
+    last = first + rng.integers(5, num_frames, num_tracks)
+    classes = rng.integers(0, len(NAMES), num_tracks)
+    half_size = rng.uniform(5, 30, size=(num_tracks, 2))
+
+    frames = []
+    for frame in range(num_frames):
+        visible = np.flatnonzero((first <= frame) & (frame <= last) & (rng.random(num_tracks) > 0.1))
+        centroids = start[visible] + velocity[visible] * (frame - first[visible, None])
+        boxes = np.concatenate((centroids - half_size[visible], centroids + half_size[visible]), axis=1)
+        frames.append((boxes, visible + 1, classes[visible]))
+    return frames
+
+
+def reference_counter(region):
+    """An Ultralytics `ObjectCounter` set up to count one region, without loading a model."""
+    counter = object.__new__(solutions.ObjectCounter)
+    counter.region = region
+    counter.names = NAMES
+    counter.counted_ids = []
+    counter.classwise_counts = {name: {"IN": 0, "OUT": 0} for name in NAMES.values()}
+    counter.in_count = counter.out_count = 0
+    counter.LineString, counter.Polygon, counter.Point = LineString, Polygon, Point
+    return counter
+
+
+def reference_counts(frames):
+    """Count every region with its own `ObjectCounter`, following the track history like `ObjectCounter.count`."""
+    counters = {name: reference_counter(points) for name, points in REGIONS.items()}
+    last_position = {}
+    for boxes, track_ids, classes in frames:
+        for box, track_id, cls in zip(boxes, track_ids.tolist(), classes.tolist()):
+            centroid = ((box[0] + box[2]) / 2, (box[1] + box[3]) / 2)
+            for counter in counters.values():
+                counter.count_objects(centroid, track_id, last_position.get(track_id), cls)
+            last_position[track_id] = centroid
+    return counters
+
+
+@pytest.fixture(scope="module")
+def frames():
+    return synthetic_frames()
+
+
+@pytest.fixture(scope="module")
+def reference(frames):
+    return reference_counts(frames)
+
+
+def test_region_counter_matches_object_counter(frames, reference):
+    engine = RegionCounter(REGIONS, len(NAMES))
+    for boxes, track_ids, classes in frames:
+        engine.update(boxes, track_ids, classes)
+
+    for i, (name, counter) in enumerate(reference.items()):
+        assert engine.region_counts()[name] == {"IN": counter.in_count, "OUT": counter.out_count}, name
+        for cls, class_name in NAMES.items():
+            assert engine.counts[i, 0, cls] == counter.classwise_counts[class_name]["IN"], (name, class_name)
+            assert engine.counts[i, 1, cls] == counter.classwise_counts[class_name]["OUT"], (name, class_name)
+    assert sum(counter.in_count + counter.out_count for counter in reference.values()) > 0
+
+
+def test_batched_object_counter_matches_object_counter(frames, reference):
+    counter = BatchedObjectCounter(shared_model=StubModel(), show=False, region=REGIONS["vertical_line"], regions=REGIONS, draw=False)
+    image = np.zeros((480, 640, 3), dtype=np.uint8)
+    crossings = 0
+    for boxes, track_ids, classes in frames:
+        data = np.column_stack((boxes, track_ids, np.ones(len(track_ids)), classes)).reshape(-1, 7)
+        result = Results(image, path="synthetic", names=NAMES, boxes=torch.as_tensor(data, dtype=torch.float32))
+        counter.process_result(image, result, counter.count)
+        crossings += len(counter.crossings)
+
+    assert counter.region_counts() == {name: {"IN": c.in_count, "OUT": c.out_count} for name, c in reference.items()}
+    assert counter.in_count == sum(c.in_count for c in reference.values())
+    assert counter.out_count == sum(c.out_count for c in reference.values())
+    assert crossings == counter.in_count + counter.out_count
+
+
+def test_batched_object_counter_restores_totals(frames):
+    def make_counter():
+        return BatchedObjectCounter(shared_model=StubModel(), show=False, region=REGIONS["vertical_line"], regions=REGIONS, draw=False)
+
+    counter = make_counter()
+    image = np.zeros((480, 640, 3), dtype=np.uint8)
+    for boxes, track_ids, classes in frames:
+        data = np.column_stack((boxes, track_ids, np.ones(len(track_ids)), classes)).reshape(-1, 7)
+        result = Results(image, path="synthetic", names=NAMES, boxes=torch.as_tensor(data, dtype=torch.float32))
+        counter.process_result(image, result, counter.count)
+
+    resumed = make_counter()
+    resumed.load_state(pickle.loads(pickle.dumps(counter.state())))
+    assert (resumed.in_count, resumed.out_count) == (counter.in_count, counter.out_count)
+    assert resumed.classwise_counts == counter.classwise_counts
+    assert resumed.region_counts() == counter.region_counts()